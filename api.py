@@ -0,0 +1,368 @@
+from __future__ import annotations
+
+import csv
+import io
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+from flask import Blueprint, current_app, g, request, session, url_for
+from sqlalchemy import select
+from werkzeug.exceptions import HTTPException
+
+from models import Asset
+
+import audit
+import auth
+import listing
+import records
+import repository
+import scan
+import stock
+import stocktake
+import valuation
+
+# Most records a single request may create, update or delete.
+MAX_BATCH = 1000
+# Asset list fields worked out for each page, as at the end of this month.
+VALUE_FIELDS = ('accumulated', 'book_value')
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str, **details: Any):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.details = details
+
+
+def _response(payload: Any, status: int = 200, headers: Optional[Mapping[str, str]] = None):
+    return current_app.response_class(records.dumps(payload), status=status, mimetype='application/json', headers=headers)
+
+
+def movement(data: Any, where: str) -> stock.Movement:
+    if not isinstance(data, dict):
+        raise ApiError(400, f'{where}: expected a JSON object')
+    unknown = set(data) - set(stock.Movement._fields)
+    if unknown:
+        raise ApiError(400, f'{where}: unknown field {sorted(unknown)[0]}')
+    try:
+        return stock.check(stock.Movement(**data))
+    except TypeError:
+        raise ApiError(400, f'{where}: item_id, kind and quantity are required') from None
+    except stock.StockError as exc:
+        raise ApiError(400, f'{where}: {exc}') from None
+
+
+def _json_body() -> Any:
+    body = request.get_json(silent=True)
+    if body is None:
+        raise ApiError(400, 'Expected a JSON request body')
+    return body
+
+
+def _batch_list(value: Any, name: str) -> List:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ApiError(400, f'{name}: expected a list')
+    return value
+
+
+def create_blueprint(
+    db_session,
+    conditional,
+    specs: Mapping[str, listing.ListingSpec],
+    tokens: Optional[Sequence[str]] = None,
+    scanner: Optional[scan.ScanIndex] = None,
+) -> Blueprint:
+    """The ``/api/v1`` JSON API over the listings in ``specs``, keyed by URL name.
+
+    Reads are keyset paginated like the HTML lists and return plain column
+    tuples; writes of many records share one transaction. Clients send a
+    bearer token from ``$INVENTORY_API_TOKENS`` or the web login cookie.
+    """
+    if tokens is None:
+        tokens = records.configured_tokens()
+    if scanner is None:
+        scanner = scan.ScanIndex()
+    blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+    resource_rule = f'<any({", ".join(specs)}):resource>'
+
+    def columns_of(spec: listing.ListingSpec) -> List[str]:
+        return [column.name for column in spec.model.__table__.c]
+
+    def computed_fields(spec: listing.ListingSpec) -> Sequence[str]:
+        return VALUE_FIELDS if spec.model is Asset else ()
+
+    def selected_fields(spec: listing.ListingSpec, computed: Sequence[str] = ()) -> List[str]:
+        available = columns_of(spec) + list(computed)
+        requested = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+        unknown = [name for name in requested if name not in available]
+        if unknown:
+            raise ApiError(400, f'Unknown fields: {", ".join(unknown)}', available=available)
+        return requested or available
+
+    def fetch_one(spec: listing.ListingSpec, record_id: int, fields: Sequence[str]) -> Dict[str, Any]:
+        row = db_session.execute(
+            select(*(spec.column(name) for name in fields)).where(spec.column('id') == record_id)
+        ).first()
+        if row is None:
+            raise ApiError(404, f'No record with id {record_id}')
+        return dict(zip(fields, row))
+
+    def apply(spec: listing.ListingSpec, **batch) -> repository.BatchResult:
+        try:
+            return repository.apply_batch(db_session, spec.model, **batch)
+        except repository.StaleRecords as exc:
+            raise ApiError(409, 'Records changed since they were read', ids=exc.ids) from None
+        except LookupError as exc:
+            raise ApiError(404, 'No records with these ids', ids=exc.args[0]) from None
+
+    @blueprint.before_request
+    def _authenticate():
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+            supplied = header[len('Bearer '):].strip()
+            if records.check_token(supplied, tokens):
+                audit.set_user(records.TOKEN_USER)
+                return None
+        elif 'user_id' in session:
+            g.user = auth.current_user(db_session, session)
+            if g.user is not None:
+                audit.set_user(g.user.username)
+                return None
+        return _response({'error': 'Authentication required'}, 401, {'WWW-Authenticate': 'Bearer'})
+
+    @blueprint.errorhandler(ApiError)
+    def _api_error(exc: ApiError):
+        return _response({'error': exc.message, **exc.details}, exc.status)
+
+    @blueprint.errorhandler(records.InvalidRecord)
+    def _invalid_record(exc: records.InvalidRecord):
+        return _response({'error': str(exc)}, 400)
+
+    @blueprint.errorhandler(HTTPException)
+    def _http_error(exc: HTTPException):
+        return _response({'error': exc.description}, exc.code or 500)
+
+    def list_page(resource: str):
+        spec = specs[resource]
+        computed = computed_fields(spec)
+        fields = selected_fields(spec, computed)
+        stored = [name for name in fields if name not in computed]
+        valued = len(stored) < len(fields)
+        columns = list(dict.fromkeys([*stored, 'id'])) if valued else stored
+        options = listing.parse_args(spec, request.args)
+        page = listing.fetch_page(db_session, spec, columns=columns, **options)
+        values = {}
+        if valued:
+            valuation.refresh(db_session)
+            values = valuation.cached_values(db_session, [row.id for row in page.rows])
+        data = []
+        for row in page.rows:
+            record = dict(zip(stored, row))
+            if valued:
+                record.update(zip(computed, valuation.amounts(values.get(row.id), computed)))
+            data.append({name: record[name] for name in fields})
+        return _response({
+            'data': data,
+            'next': page.next_cursor,
+            'limit': page.limit,
+        })
+
+    @blueprint.route(f'/{resource_rule}', methods=['GET'])
+    def list_records(resource):
+        spec = specs[resource]
+        vary = valuation.stamp if computed_fields(spec) else None
+        return conditional(spec.model.__tablename__, vary=vary)(list_page)(resource)
+
+    def show(resource: str, record_id: int):
+        spec = specs[resource]
+        return _response({'data': fetch_one(spec, record_id, selected_fields(spec))})
+
+    @blueprint.route(f'/{resource_rule}/<int:record_id>', methods=['GET'])
+    def get_record(resource, record_id):
+        return conditional(specs[resource].model.__tablename__)(show)(resource, record_id)
+
+    @blueprint.route(f'/{resource_rule}', methods=['POST'])
+    def create_records(resource):
+        """Create one record from an object, or many from a list of objects."""
+        spec = specs[resource]
+        body = _json_body()
+        if isinstance(body, list):
+            if len(body) > MAX_BATCH:
+                raise ApiError(413, f'At most {MAX_BATCH} records per request')
+            rows = [records.record_fields(spec.model, data, where=f'[{index}]') for index, data in enumerate(body)]
+            return _response({'created': apply(spec, create=rows).created}, 201)
+        record_id = apply(spec, create=[records.record_fields(spec.model, body)]).created[0]
+        location = url_for('.get_record', resource=resource, record_id=record_id)
+        return _response({'data': fetch_one(spec, record_id, columns_of(spec))}, 201, {'Location': location})
+
+    @blueprint.route(f'/{resource_rule}', methods=['PATCH'])
+    def update_records(resource):
+        """Apply a list of partial updates, each with the ``id`` it changes."""
+        spec = specs[resource]
+        body = _batch_list(_json_body(), 'body')
+        if len(body) > MAX_BATCH:
+            raise ApiError(413, f'At most {MAX_BATCH} records per request')
+        rows = [records.update_fields(spec.model, data, f'[{index}]') for index, data in enumerate(body)]
+        return _response({'updated': apply(spec, update_rows=rows).updated})
+
+    @blueprint.route(f'/{resource_rule}/<int:record_id>', methods=['PATCH'])
+    def update_record(resource, record_id):
+        spec = specs[resource]
+        apply(spec, update_rows=[{'id': record_id, **records.record_fields(spec.model, _json_body(), partial=True)}])
+        return _response({'data': fetch_one(spec, record_id, columns_of(spec))})
+
+    @blueprint.route(f'/{resource_rule}/<int:record_id>', methods=['DELETE'])
+    def delete_record(resource, record_id):
+        apply(specs[resource], delete_ids=[record_id])
+        return current_app.response_class(status=204)
+
+    @blueprint.route(f'/{resource_rule}/batch', methods=['POST'])
+    def batch(resource):
+        """Run ``{"create": [...], "update": [...], "delete": [ids]}`` in one transaction."""
+        spec = specs[resource]
+        body = _json_body()
+        if not isinstance(body, dict):
+            raise ApiError(400, 'body: expected a JSON object')
+        unknown = set(body) - {'create', 'update', 'delete'}
+        if unknown:
+            raise ApiError(400, f'body: unknown keys {", ".join(sorted(unknown))}')
+        create = _batch_list(body.get('create'), 'create')
+        updates = _batch_list(body.get('update'), 'update')
+        deletes = _batch_list(body.get('delete'), 'delete')
+        if len(create) + len(updates) + len(deletes) > MAX_BATCH:
+            raise ApiError(413, f'At most {MAX_BATCH} records per request')
+        rows = [records.record_fields(spec.model, data, where=f'create[{index}]') for index, data in enumerate(create)]
+        update_rows = [records.update_fields(spec.model, data, f'update[{index}]') for index, data in enumerate(updates)]
+        delete_ids = [records.record_id(value, f'delete[{index}]') for index, value in enumerate(deletes)]
+        result = apply(spec, create=rows, update_rows=update_rows, delete_ids=delete_ids)
+        return _response({'created': result.created, 'updated': result.updated, 'deleted': result.deleted})
+
+    @blueprint.route('/movements', methods=['POST'])
+    def post_movements():
+        """Post a list of stock movements in one transaction."""
+        body = _batch_list(_json_body(), 'body')
+        if len(body) > MAX_BATCH:
+            raise ApiError(413, f'At most {MAX_BATCH} records per request')
+        movements = [movement(data, f'[{index}]') for index, data in enumerate(body)]
+        user = getattr(g, 'user', None)
+        try:
+            ids = stock.post(db_session, movements, user.username if user else None)
+        except stock.StockError as exc:
+            raise ApiError(409, str(exc)) from None
+        return _response({'posted': ids}, 201)
+
+    @blueprint.route('/stock', methods=['GET'])
+    def stock_levels():
+        """Item quantities at ``?at=`` (ISO date and time, default now), optionally for one ``location``."""
+        try:
+            when = datetime.fromisoformat(request.args['at']).timestamp() if request.args.get('at') else time.time()
+        except ValueError:
+            raise ApiError(400, 'at must be an ISO date and time') from None
+        try:
+            rows = stock.stock_at(db_session, when, request.args.get('location'))
+        except stock.StockError as exc:
+            raise ApiError(404, str(exc)) from None
+        return _response({'at': when, 'data': [{'item_id': item_id, 'quantity': quantity} for item_id, quantity in rows]})
+
+    @blueprint.route('/scan', methods=['GET'])
+    def scan_lookup():
+        """Assets whose label (``asset_code`` or ``asset_code/sub_code``) or serial number is ``?code=``."""
+        code = request.args.get('code', '').strip()
+        if not code:
+            raise ApiError(400, 'code is required')
+        matches = scanner.lookup(db_session, code)
+        if not matches:
+            raise ApiError(404, f'No asset with code or serial number {code}')
+        return _response({'data': [match._asdict() for match in matches]})
+
+    def stocktake_or_404(stocktake_id: int):
+        row = stocktake.get(db_session, stocktake_id)
+        if row is None:
+            raise ApiError(404, f'No stocktake with id {stocktake_id}')
+        return row
+
+    @blueprint.route('/stocktakes', methods=['GET'])
+    def list_stocktakes():
+        return _response({'data': [row._asdict() for row in stocktake.list_all(db_session)]})
+
+    @blueprint.route('/stocktakes', methods=['POST'])
+    def create_stocktake():
+        body = _json_body()
+        name = body.get('name') if isinstance(body, dict) else None
+        try:
+            stocktake_id = stocktake.create(db_session, name, audit.current_user())
+        except stocktake.CountError as exc:
+            raise ApiError(400, str(exc)) from None
+        return _response({'data': stocktake_or_404(stocktake_id)._asdict()}, 201)
+
+    @blueprint.route('/stocktakes/<int:stocktake_id>/counts', methods=['POST'])
+    def add_counts(stocktake_id):
+        """Add count lines: a JSON list of objects, or a CSV or plain list of codes streamed as ``text/csv``.
+
+        Each request is applied in one transaction; counts of the same code
+        from several requests add up.
+        """
+        stocktake_or_404(stocktake_id)
+        if request.mimetype in ('text/csv', 'text/plain'):
+            records = stocktake.read_counts(io.TextIOWrapper(request.stream, encoding='utf-8', newline=''))
+        else:
+            records = _batch_list(_json_body(), 'body')
+            if len(records) > stocktake.MAX_POSTED_LINES:
+                raise ApiError(413, f'At most {stocktake.MAX_POSTED_LINES} JSON lines per request; stream larger counts as text/csv')
+            if not all(isinstance(record, dict) for record in records):
+                raise ApiError(400, 'Expected a list of objects')
+        try:
+            lines = stocktake.add_counts(db_session, stocktake_id, records)
+        except (stocktake.CountError, UnicodeDecodeError, csv.Error) as exc:
+            raise ApiError(400, str(exc)) from None
+        return _response({'lines': lines}, 201)
+
+    @blueprint.route('/stocktakes/<int:stocktake_id>/report', methods=['GET'])
+    def stocktake_report(stocktake_id):
+        """Totals per kind, category and location, and the lines with ``?status=`` (default every variance)."""
+        stocktake_or_404(stocktake_id)
+        statuses = [name.strip() for name in request.args.get('status', '').split(',') if name.strip()]
+        unknown = [name for name in statuses if name not in stocktake.STATUSES]
+        if unknown:
+            raise ApiError(400, f'Unknown status: {", ".join(unknown)}', available=list(stocktake.STATUSES))
+        result = stocktake.report(db_session, stocktake_id, statuses or stocktake.VARIANCES)
+        return _response({
+            'summary': [group._asdict() for group in result.summary],
+            'data': [line._asdict() for line in result.variances],
+        })
+
+    @blueprint.route('/changes', methods=['GET'])
+    def changes():
+        """Logged writes after sequence number ``?since=``, optionally of one ``?resource=``.
+
+        Clients keep the returned ``next`` and pass it as ``since`` to poll for
+        more; ``410 Gone`` means they fell behind pruning and must resync.
+        """
+        try:
+            since = int(request.args.get('since', 0))
+            limit = int(request.args.get('limit', audit.DEFAULT_LIMIT))
+        except ValueError:
+            raise ApiError(400, 'since and limit must be integers') from None
+        resource = request.args.get('resource')
+        if resource is not None and resource not in specs:
+            raise ApiError(400, f'Unknown resource: {resource}', available=list(specs))
+        tables = [specs[resource].model.__tablename__] if resource else None
+        limit = max(1, min(limit, MAX_BATCH))
+        try:
+            entries = audit.changes_since(db_session, since, limit + 1, tables)
+        except audit.ChangesPruned as exc:
+            raise ApiError(410, str(exc), pruned_through=exc.pruned_through) from None
+        more = len(entries) > limit
+        entries = entries[:limit]
+        return _response({
+            'data': [entry._asdict() for entry in entries],
+            'next': entries[-1].seq if entries else since,
+            'more': more,
+            'latest': audit.latest_seq(db_session),
+        })
+
+    return blueprint
@@ -1,245 +1,521 @@
+import csv
+import functools
+import hashlib
+import io
 import os
 from datetime import datetime
 
-from flask import Flask, render_template, request, redirect, url_for, session, send_file
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-import pandas as pd
-from docx import Document
-from fpdf import FPDF
+from flask import Flask, Response, abort, flash, g, jsonify, render_template, request, redirect, url_for, session, send_file, stream_with_context
+from sqlalchemy import func, select
+from sqlalchemy.orm import scoped_session
+
+import api
+import audit
+import auth
+import database
+import docxreport
+import exports
+import httpcache
+import importer
+import jobs
+import labels
+import listing
+import metrics
+import repository
+import scan
+import search
+import stock
+import stocktake
+import summary
+import valuation
+from listing import asset_listing, inventory_listing
+from models import Asset, InventoryItem
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'change-this-key'
 
-db = SQLAlchemy(app)
-
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
-
-    def set_password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
-
-    def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
-
-class Asset(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    asset_code = db.Column(db.String(50), nullable=False)
-    sub_code = db.Column(db.String(50))
-    budget_year = db.Column(db.String(10))
-    name = db.Column(db.String(200), nullable=False)
-    details = db.Column(db.Text)
-    serial_number = db.Column(db.String(100))
-    category = db.Column(db.String(100))
-    quantity = db.Column(db.Integer, default=1)
-    acquisition_date = db.Column(db.Date)
-    unit = db.Column(db.String(100))
-    price = db.Column(db.Float)
-    note = db.Column(db.Text)
-
-
-class InventoryItem(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(200), nullable=False)
-    quantity = db.Column(db.Integer, default=0)
-    location = db.Column(db.String(100))
-    note = db.Column(db.Text)
+database.ensure_schema()
+db_session = scoped_session(database.get_sessionmaker())
+export_jobs = jobs.ExportJobQueue(os.path.join(app.instance_path, 'exports'))
+metrics.init_app(app)
+# ETags and a rendered page cache for views keyed on the table versions.
+conditional = httpcache.ConditionalViews(db_session, os.path.join(app.root_path, app.template_folder))
+# Scanned codes resolved recently by this worker process.
+scanner = scan.ScanIndex()
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    db_session.remove()
+    # Request threads are reused, so the next request must not inherit a user.
+    audit.set_user(None)
+
+def get_or_404(model, object_id):
+    return db_session.get(model, object_id) or abort(404)
+
+app.register_blueprint(api.create_blueprint(
+    db_session, conditional, {'assets': asset_listing, 'items': inventory_listing}, scanner=scanner
+))
+
+@app.template_global()
+def listing_url(endpoint, **overrides):
+    """Build a listing URL that keeps the current filters and sort."""
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.update(overrides)
+    return url_for(endpoint, **{k: v for k, v in args.items() if v not in (None, '')})
+
+@app.template_filter('timestamp')
+def format_timestamp(value):
+    return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M') if value else ''
+
+def _load_user():
+    """Set ``g.user`` from the login session; ``False`` when nobody is logged in."""
+    if 'user_id' not in session:
+        return False
+    g.user = auth.current_user(db_session, session)
+    if g.user is None:
+        session.clear()
+        return False
+    audit.set_user(g.user.username)
+    return True
 
 def login_required(view_func):
     def wrapper(*args, **kwargs):
-        if 'user_id' not in session:
+        if not _load_user():
             return redirect(url_for('login'))
         return view_func(*args, **kwargs)
     wrapper.__name__ = view_func.__name__
     return wrapper
 
+def admin_required(view_func):
+    def wrapper(*args, **kwargs):
+        if not _load_user():
+            return redirect(url_for('login'))
+        if not g.user.is_admin:
+            abort(403)
+        return view_func(*args, **kwargs)
+    wrapper.__name__ = view_func.__name__
+    return wrapper
+
 @app.route('/initdb')
 def initdb():
-    db.create_all()
-    if not User.query.filter_by(username='admin').first():
-        admin = User(username='admin')
-        admin.set_password('admin')
-        db.session.add(admin)
-        db.session.commit()
+    database.ensure_schema(force=True)
     return 'Database initialized with admin/admin'
 
+@app.route('/metrics')
+@admin_required
+def metrics_view():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        user = User.query.filter_by(username=username).first()
-        if user and user.check_password(password):
+        try:
+            user = auth.authenticate(db_session, username, password, request.remote_addr)
+        except auth.Throttled as exc:
+            return render_template('login.html', error=str(exc)), 429, {'Retry-After': str(exc.retry_after)}
+        if user:
             session['user_id'] = user.id
+            session['auth_token'] = auth.remember(user)
             return redirect(url_for('asset_list'))
         return render_template('login.html', error='Invalid credentials')
     return render_template('login.html')
 
 @app.route('/logout')
 def logout():
+    auth.forget(session.pop('auth_token', None))
     session.pop('user_id', None)
     return redirect(url_for('login'))
 
+def _values_variant():
+    # Book values change with the month and the configured useful lives, so
+    # exported files are kept per both.
+    period, lives = valuation.stamp()
+    return f'{period}-{lives[:12]}'
+
 @app.route('/')
 @login_required
+@conditional(Asset.__tablename__, vary=valuation.stamp)
 def asset_list():
-    assets = Asset.query.all()
-    return render_template('asset_list.html', assets=assets)
+    options = listing.parse_args(asset_listing, request.args)
+    query = request.args.get('q', '').strip()
+    if query and not request.args.get('sort'):
+        # Without an explicit sort, show the best matches first.
+        criteria = listing.filter_criteria(asset_listing, options['filters'])
+        rows = search.search_assets(db_session, Asset, query, limit=options['limit'], criteria=criteria)
+        page = listing.Page(rows=rows, sort='rank', direction='asc', filters=options['filters'], limit=options['limit'])
+    else:
+        if query:
+            options['criteria'] = search.match_criteria(db_session, Asset, query)
+        page = listing.fetch_page(db_session, asset_listing, **options)
+    # Bringing the cache up to date costs two small queries when no asset
+    # changed since; the first list of a month values the whole register.
+    valuation.refresh(db_session)
+    values = valuation.cached_values(db_session, [row.id for row in page.rows])
+    return render_template('asset_list.html', assets=page.rows, page=page, query=query, values=values)
 
 @app.route('/assets/add', methods=['GET', 'POST'])
 @login_required
 def asset_add():
     if request.method == 'POST':
-        asset = Asset(
-            asset_code=request.form['asset_code'],
-            sub_code=request.form.get('sub_code'),
-            budget_year=request.form.get('budget_year'),
-            name=request.form['name'],
-            details=request.form.get('details'),
-            serial_number=request.form.get('serial_number'),
-            category=request.form.get('category'),
-            quantity=int(request.form.get('quantity', 1)),
-            acquisition_date=datetime.strptime(request.form.get('acquisition_date'), '%Y-%m-%d') if request.form.get('acquisition_date') else None,
-            unit=request.form.get('unit'),
-            price=float(request.form.get('price')) if request.form.get('price') else None,
-            note=request.form.get('note')
-        )
-        db.session.add(asset)
-        db.session.commit()
+        try:
+            fields = repository.asset_fields(request.form)
+        except ValueError as exc:
+            flash(f'Invalid value: {exc}')
+            return render_template('asset_form.html', asset=None)
+        repository.create_asset(db_session, **fields)
         return redirect(url_for('asset_list'))
     return render_template('asset_form.html', asset=None)
 
+@app.route('/assets/import', methods=['GET', 'POST'])
+@login_required
+def asset_import():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            return render_template('asset_import.html', error='Choose a file to import')
+        try:
+            result = importer.import_assets(
+                db_session, Asset, upload.stream, upload.filename, upsert=bool(request.form.get('upsert'))
+            )
+        except ValueError as exc:
+            return render_template('asset_import.html', error=str(exc))
+        flash(f'Imported: {result.summary()}')
+        if result.errors:
+            return render_template('asset_import.html', result=result)
+        return redirect(url_for('asset_list'))
+    return render_template('asset_import.html')
+
 @app.route('/assets/<int:asset_id>/edit', methods=['GET', 'POST'])
 @login_required
 def asset_edit(asset_id):
-    asset = Asset.query.get_or_404(asset_id)
+    asset = get_or_404(Asset, asset_id)
     if request.method == 'POST':
-        asset.asset_code = request.form['asset_code']
-        asset.sub_code = request.form.get('sub_code')
-        asset.budget_year = request.form.get('budget_year')
-        asset.name = request.form['name']
-        asset.details = request.form.get('details')
-        asset.serial_number = request.form.get('serial_number')
-        asset.category = request.form.get('category')
-        asset.quantity = int(request.form.get('quantity', 1))
-        asset.acquisition_date = datetime.strptime(request.form.get('acquisition_date'), '%Y-%m-%d') if request.form.get('acquisition_date') else None
-        asset.unit = request.form.get('unit')
-        asset.price = float(request.form.get('price')) if request.form.get('price') else None
-        asset.note = request.form.get('note')
-        db.session.commit()
+        try:
+            fields = repository.asset_fields(request.form)
+        except ValueError as exc:
+            flash(f'Invalid value: {exc}')
+            return render_template('asset_form.html', asset=asset)
+        repository.update_asset(db_session, asset, **fields)
         return redirect(url_for('asset_list'))
     return render_template('asset_form.html', asset=asset)
 
 @app.route('/assets/<int:asset_id>/delete', methods=['POST'])
 @login_required
 def asset_delete(asset_id):
-    asset = Asset.query.get_or_404(asset_id)
-    db.session.delete(asset)
-    db.session.commit()
+    asset = get_or_404(Asset, asset_id)
+    repository.delete_asset(db_session, asset)
     return redirect(url_for('asset_list'))
 
 
 @app.route('/inventory')
 @login_required
+@conditional(InventoryItem.__tablename__)
 def inventory_list():
-    items = InventoryItem.query.all()
-    return render_template('inventory_list.html', items=items)
+    page = listing.fetch_page(db_session, inventory_listing, **listing.parse_args(inventory_listing, request.args))
+    return render_template('inventory_list.html', items=page.rows, page=page)
 
 
 @app.route('/inventory/add', methods=['GET', 'POST'])
 @login_required
 def inventory_add():
     if request.method == 'POST':
-        item = InventoryItem(
-            name=request.form['name'],
-            quantity=int(request.form.get('quantity', 0)),
-            location=request.form.get('location'),
-            note=request.form.get('note'),
-        )
-        db.session.add(item)
-        db.session.commit()
+        try:
+            fields = repository.item_fields(request.form)
+        except ValueError as exc:
+            flash(f'Invalid value: {exc}')
+            return render_template('inventory_form.html', item=None)
+        # The opening quantity goes through the ledger so the history is
+        # complete, in the same transaction as the item.
+        quantity = fields.pop('quantity', 0)
+        item = repository.create_item(db_session, commit=False, quantity=0, **fields)
+        try:
+            if quantity:
+                stock.post(db_session, [stock.Movement(item.id, 'receive', quantity, note='Opening stock')], g.user.username)
+            db_session.commit()
+        except stock.StockError as exc:
+            db_session.rollback()
+            flash(str(exc))
+            return render_template('inventory_form.html', item=None)
         return redirect(url_for('inventory_list'))
     return render_template('inventory_form.html', item=None)
 
 
+def _item_form(item):
+    return render_template('inventory_form.html', item=item, movements=stock.history(db_session, item.id), kinds=stock.KINDS)
+
+
 @app.route('/inventory/<int:item_id>/edit', methods=['GET', 'POST'])
 @login_required
 def inventory_edit(item_id):
-    item = InventoryItem.query.get_or_404(item_id)
+    item = get_or_404(InventoryItem, item_id)
     if request.method == 'POST':
-        item.name = request.form['name']
-        item.quantity = int(request.form.get('quantity', 0))
-        item.location = request.form.get('location')
-        item.note = request.form.get('note')
-        db.session.commit()
+        try:
+            fields = repository.item_fields(request.form)
+            expected = int(request.form.get('expected_quantity') or item.quantity or 0)
+        except ValueError as exc:
+            flash(f'Invalid value: {exc}')
+            return _item_form(item)
+        # Post the difference from the quantity the form showed rather than
+        # overwriting it, so a concurrent change by someone else is kept.
+        # The other fields are committed with the adjustment, or not at all.
+        quantity = fields.pop('quantity', expected)
+        repository.update_item(db_session, item, commit=False, **fields)
+        try:
+            stock.adjust_to(db_session, item.id, quantity, expected, g.user.username)
+            db_session.commit()
+        except stock.StockError as exc:
+            db_session.rollback()
+            flash(str(exc))
+            return redirect(url_for('inventory_edit', item_id=item_id))
         return redirect(url_for('inventory_list'))
-    return render_template('inventory_form.html', item=item)
+    return _item_form(item)
+
+
+@app.route('/inventory/<int:item_id>/movements', methods=['POST'])
+@login_required
+def inventory_move(item_id):
+    get_or_404(InventoryItem, item_id)
+    try:
+        movement = stock.Movement(
+            item_id,
+            request.form.get('kind', ''),
+            int(request.form.get('quantity') or 0),
+            to_location=request.form.get('to_location') or None,
+            note=request.form.get('note') or None,
+        )
+        stock.post(db_session, [movement], g.user.username)
+    except ValueError as exc:
+        flash(f'Invalid movement: {exc}')
+    return redirect(url_for('inventory_edit', item_id=item_id))
 
 
 @app.route('/inventory/<int:item_id>/delete', methods=['POST'])
 @login_required
 def inventory_delete(item_id):
-    item = InventoryItem.query.get_or_404(item_id)
-    db.session.delete(item)
-    db.session.commit()
+    item = get_or_404(InventoryItem, item_id)
+    repository.delete_item(db_session, item)
     return redirect(url_for('inventory_list'))
 
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    totals = {dimension: summary.asset_totals(db_session, dimension) for dimension in summary.ASSET_DIMENSIONS}
+    return render_template('dashboard.html', totals=totals, locations=summary.inventory_totals(db_session))
+
+# Formats slow enough to be built by the background job queue, so they never
+# tie up a request thread.
+JOB_FORMATS = ('excel', 'word', 'pdf')
+# Formats answered from the cache directly, with ETags, once built.
+DIRECT_FORMATS = ('csv', 'excel')
+
 @app.route('/export/<string:fmt>')
 @login_required
 def export(fmt):
-    assets = Asset.query.all()
-    data = [
-        {
-            'ลำดับ': a.id,
-            'รหัสครุภัณฑ์': a.asset_code,
-            'รหัสย่อย': a.sub_code,
-            'ปีงบประมาณที่ได้มา': a.budget_year,
-            'ชื่อครุภัณฑ์': a.name,
-            'รายละเอียด': a.details,
-            'หมายเลขเครื่อง/SN': a.serial_number,
-            'ประเภท': a.category,
-            'จำนวน': a.quantity,
-            'วันที่ได้มา': a.acquisition_date.strftime('%Y-%m-%d') if a.acquisition_date else '',
-            'หน่วยเบิก': a.unit,
-            'ราคา': a.price,
-            'หมายเหตุ': a.note,
-        }
-        for a in assets
-    ]
-    if fmt == 'excel':
-        df = pd.DataFrame(data)
-        path = 'assets.xlsx'
-        df.to_excel(path, index=False)
-        return send_file(path, as_attachment=True)
-    elif fmt == 'word':
-        doc = Document()
-        table = doc.add_table(rows=1, cols=len(data[0]) if data else 1)
-        hdr_cells = table.rows[0].cells
-        for i, key in enumerate(data[0].keys() if data else ['รายการ']):
-            hdr_cells[i].text = key
-        for item in data:
-            row_cells = table.add_row().cells
-            for i, key in enumerate(item.keys()):
-                row_cells[i].text = str(item[key])
-        path = 'assets.docx'
-        doc.save(path)
-        return send_file(path, as_attachment=True)
-    elif fmt == 'pdf':
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font('Arial', size=10)
-        for item in data:
-            line = ' | '.join([f"{k}: {v}" for k, v in item.items()])
-            pdf.multi_cell(0, 5, line)
-            pdf.ln(1)
-        path = 'assets.pdf'
-        pdf.output(path)
-        return send_file(path, as_attachment=True)
-    return redirect(url_for('asset_list'))
+    if fmt not in exports.MIMETYPES:
+        return redirect(url_for('asset_list'))
+    stamp = conditional.stamp(Asset.__tablename__)
+    version = stamp.versions[0]
+    extension = exports.EXTENSIONS[fmt]
+    values = _values_variant()
+    path = None
+    if fmt in DIRECT_FORMATS:
+        # Built once per version of the assets table; later requests get the
+        # cached file, or 304 if the client already has it.
+        etag = conditional.etag(stamp, fmt, values)
+        if conditional.not_modified(etag, stamp.last_modified):
+            return conditional.set_headers(Response(status=304), etag, stamp.last_modified)
+        path = export_jobs.lookup(export_jobs.artifact_key(fmt, version, values), extension)
+    if path is None and fmt in JOB_FORMATS:
+        # Word exports can be split into one section per category or budget year.
+        group_by = request.args.get('by') if fmt == 'word' else None
+        if group_by not in docxreport.GROUP_COLUMNS:
+            group_by = None
+        work = functools.partial(_run_export, group_by=group_by)
+        job = export_jobs.submit(fmt, version, extension, work, variant='-'.join(filter(None, (group_by, values))))
+        return redirect(url_for('export_job', job_id=job.id))
+    if path is None:
+        key = export_jobs.artifact_key(fmt, version, values)
+        rows = exports.iter_rows(db_session, Asset)
+        body = export_jobs.tee(key, extension, (chunk.encode('utf-8') for chunk in exports.iter_csv(exports.HEADERS, rows)))
+        headers = {'Content-Disposition': f'attachment; filename=assets.{extension}'}
+        response = Response(stream_with_context(body), mimetype=exports.MIMETYPES[fmt], headers=headers)
+        return conditional.set_headers(response, etag, stamp.last_modified)
+    response = send_file(
+        path,
+        mimetype=exports.MIMETYPES[fmt],
+        as_attachment=True,
+        download_name=f'assets.{extension}',
+        etag=False,
+        conditional=False,
+    )
+    return conditional.set_headers(response, etag, stamp.last_modified)
+
+def _run_export(job, path, group_by=None):
+    with database.get_session() as session:
+        job.total = session.scalar(select(func.count()).select_from(Asset))
+        job.save_progress()
+        order_by = [getattr(Asset, group_by)] if group_by else []
+        rows = job.track(exports.iter_rows(session, Asset, order_by=order_by))
+        with open(path, 'wb') as handle:
+            if group_by:
+                exports.write_docx(rows, handle, group_by=group_by)
+            else:
+                exports.WRITERS[job.fmt](rows, handle)
+
+@app.route('/labels')
+@login_required
+def asset_labels():
+    """Label sheets for the assets matching the asset list filters, built as a job."""
+    kind = request.args.get('kind')
+    if kind not in labels.KINDS:
+        kind = labels.KINDS[0]
+    filters = listing.parse_args(asset_listing, request.args)['filters']
+    # Each filter combination gets its own artifact.
+    variant = kind
+    if filters:
+        variant += '-' + hashlib.sha1(repr(sorted(filters.items())).encode('utf-8')).hexdigest()[:12]
+    version = conditional.stamp(Asset.__tablename__).versions[0]
+    work = functools.partial(_run_labels, kind=kind, filters=filters)
+    job = export_jobs.submit('labels', version, 'pdf', work, variant=variant)
+    return redirect(url_for('export_job', job_id=job.id))
+
+def _run_labels(job, path, kind, filters):
+    with database.get_session() as session:
+        criteria = listing.filter_criteria(asset_listing, filters)
+        job.total = session.scalar(select(func.count()).select_from(Asset).where(*criteria))
+        job.save_progress()
+        with open(path, 'wb') as handle:
+            labels.write_labels(job.track(labels.iter_labels(session, criteria)), handle, kind)
+
+@app.route('/scan')
+@login_required
+def scan_lookup():
+    """Resolve a scanned label or serial number; the form stays focused for the next scan."""
+    code = request.args.get('code', '').strip()
+    matches = scanner.lookup(db_session, code) if code else []
+    return render_template('scan.html', code=code, matches=matches)
+
+@app.route('/stocktakes', methods=['GET', 'POST'])
+@login_required
+def stocktake_list():
+    if request.method == 'POST':
+        try:
+            stocktake_id = stocktake.create(db_session, request.form.get('name'), g.user.username)
+        except stocktake.CountError as exc:
+            flash(str(exc))
+            return redirect(url_for('stocktake_list'))
+        return redirect(url_for('stocktake_view', stocktake_id=stocktake_id))
+    return render_template('stocktakes.html', stocktakes=stocktake.list_all(db_session))
+
+# Variance lines shown on the report page; the CSV download has them all.
+STOCKTAKE_PAGE_LINES = 500
+
+@app.route('/stocktakes/<int:stocktake_id>', methods=['GET', 'POST'])
+@login_required
+def stocktake_view(stocktake_id):
+    take = stocktake.get(db_session, stocktake_id) or abort(404)
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a count file to upload')
+        else:
+            try:
+                lines = stocktake.add_counts(db_session, stocktake_id, stocktake.read_counts(
+                    io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+                ))
+                flash(f'Added {lines} count lines')
+            except (stocktake.CountError, UnicodeDecodeError, csv.Error) as exc:
+                flash(f'Nothing was added: {exc}')
+        return redirect(url_for('stocktake_view', stocktake_id=stocktake_id))
+    result = stocktake.report(db_session, stocktake_id)
+    return render_template(
+        'stocktake.html',
+        take=take,
+        summary=result.summary,
+        variances=result.variances[:STOCKTAKE_PAGE_LINES],
+        total_variances=len(result.variances),
+    )
+
+@app.route('/stocktakes/<int:stocktake_id>/variances.csv')
+@login_required
+def stocktake_variances(stocktake_id):
+    stocktake.get(db_session, stocktake_id) or abort(404)
+
+    variances = (line for line in stocktake.reconcile(db_session, stocktake_id) if line.status != 'ok')
+    body = (chunk.encode('utf-8') for chunk in exports.iter_csv(stocktake.Variance._fields, variances))
+    headers = {'Content-Disposition': f'attachment; filename=stocktake-{stocktake_id}-variances.csv'}
+    return Response(stream_with_context(body), mimetype=exports.MIMETYPES['csv'], headers=headers)
+
+def _valuation_args():
+    period = request.args.get('period') or valuation.current_period()
+    method = request.args.get('method') or valuation.DEFAULT_METHOD
+    valuation.period_end(period)
+    valuation.check_method(method)
+    return period, method
+
+@app.route('/valuation')
+@login_required
+def valuation_view():
+    """Book values per category at a month end, brought up to date from the change log first."""
+    try:
+        period, method = _valuation_args()
+    except ValueError as exc:
+        flash(str(exc))
+        return redirect(url_for('valuation_view'))
+    page = functools.partial(render_template, 'valuation.html', period=period, method=method, methods=valuation.METHODS)
+    try:
+        result = valuation.refresh(db_session, period, method)
+    except (OSError, ValueError) as exc:
+        # An unreadable or invalid useful-life file fails the same way on
+        # every request, so it is shown here rather than redirected to.
+        return page(result=None, totals=[], error=str(exc)), 500
+    return page(result=result, totals=valuation.category_totals(db_session, period, method))
+
+@app.route('/valuation.csv')
+@login_required
+def valuation_csv():
+    try:
+        period, method = _valuation_args()
+    except ValueError as exc:
+        flash(str(exc))
+        return redirect(url_for('valuation_view'))
+    try:
+        valuation.refresh(db_session, period, method)
+    except (OSError, ValueError):
+        # The valuation page reports the broken useful-life file.
+        return redirect(url_for('valuation_view', period=period, method=method))
+
+    rows = valuation.iter_values(db_session, period, method)
+    body = (chunk.encode('utf-8') for chunk in exports.iter_csv(valuation.ROW_FIELDS, rows))
+    headers = {'Content-Disposition': f'attachment; filename=valuation-{period}-{method}.csv'}
+    return Response(stream_with_context(body), mimetype=exports.MIMETYPES['csv'], headers=headers)
+
+@app.route('/export/jobs/<string:job_id>')
+@login_required
+def export_job(job_id):
+    job = export_jobs.get(job_id) or abort(404)
+    return render_template('export_job.html', job=job)
+
+@app.route('/export/jobs/<string:job_id>/status')
+@login_required
+def export_job_status(job_id):
+    job = export_jobs.get(job_id) or abort(404)
+    return jsonify(job.as_dict())
+
+@app.route('/export/jobs/<string:job_id>/download')
+@login_required
+def export_job_download(job_id):
+    job = export_jobs.get(job_id) or abort(404)
+    if job.status != 'done' or not os.path.exists(job.path):
+        return redirect(url_for('export_job', job_id=job_id))
+    if job.fmt == 'labels':
+        mimetype, download_name = labels.MIMETYPE, 'asset-labels.pdf'
+    else:
+        mimetype, download_name = exports.MIMETYPES[job.fmt], f'assets.{exports.EXTENSIONS[job.fmt]}'
+    return send_file(job.path, mimetype=mimetype, as_attachment=True, download_name=download_name)
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import re
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set
+
+from sqlalchemy import Column, Float, Index, Integer, MetaData, String, Table, Text, event, func, insert, select, text
+
+from models import Asset, InventoryItem
+
+AUDITED_MODELS = (Asset, InventoryItem)
+# Bookkeeping columns that are not part of a record's logged values.
+UNLOGGED_COLUMNS = ('row_version',)
+# Changes older than this are collapsed to the last one per record, and
+# older than RETAIN_SECONDS dropped, by compact().
+COMPACT_AFTER = 24 * 60 * 60
+RETAIN_SECONDS = 90 * 24 * 60 * 60
+# Compaction works through the log this many sequence numbers per
+# transaction, so writers never wait long for it.
+SEGMENT_SIZE = 20000
+DEFAULT_LIMIT = 1000
+
+metadata = MetaData()
+change_log = Table(
+    'change_log',
+    metadata,
+    # AUTOINCREMENT so sequence numbers are never reused after pruning.
+    Column('seq', Integer, primary_key=True),
+    Column('table_name', String(50), nullable=False),
+    Column('row_id', Integer, nullable=False),
+    Column('op', String(10), nullable=False),
+    # The whole record before and after the change, as JSON objects.
+    Column('old', Text),
+    Column('new', Text),
+    Column('username', String(80)),
+    Column('created', Float, nullable=False),
+    Index('ix_change_log_row', 'table_name', 'row_id', 'seq'),
+    Index('ix_change_log_created', 'created'),
+    sqlite_autoincrement=True,
+)
+change_log_state = Table(
+    'change_log_state',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    # Changes up to this sequence number were dropped; a feed reader that
+    # is further behind has to start again from a full export.
+    Column('pruned_through', Integer, nullable=False, default=0),
+    Column('compacted_through', Integer, nullable=False, default=0),
+)
+# The user making the current write transaction's changes, read by the
+# triggers. Engines from ``database.get_engine()`` fill the row in before
+# the first write of a transaction and empty it again before the commit,
+# so other connections never see it and their writes are logged without a
+# user.
+audit_context = Table(
+    'audit_context',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(80)),
+)
+
+_user: ContextVar[Optional[str]] = ContextVar('audit_user', default=None)
+_process_user: Optional[str] = None
+
+
+def set_user(username: Optional[str]) -> None:
+    """Record ``username`` as the author of writes from this thread or task."""
+    _user.set(username)
+
+
+def set_process_user(username: Optional[str]) -> None:
+    """The author of writes from any thread that has not called ``set_user``."""
+    global _process_user
+    _process_user = username
+
+
+@contextlib.contextmanager
+def acting_as(username: Optional[str]) -> Iterator[None]:
+    token = _user.set(username)
+    try:
+        yield
+    finally:
+        _user.reset(token)
+
+
+def current_user() -> Optional[str]:
+    return _user.get() or _process_user
+
+
+_WRITE = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_SET_CONTEXT = 'INSERT OR REPLACE INTO audit_context (id, username) VALUES (1, ?)'
+_CLEAR_CONTEXT = 'DELETE FROM audit_context'
+# Key in the pooled connection's info of the user its open transaction wrote.
+_CONTEXT_KEY = 'audit_user'
+
+
+def _raw_execute(conn, statement: str, parameters: Sequence[Any] = ()) -> None:
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(statement, parameters)
+    finally:
+        cursor.close()
+
+
+def _set_context(conn, cursor, statement, parameters, context, executemany) -> None:
+    if not _WRITE.match(statement):
+        return
+    user = current_user()
+    if conn.info.get(_CONTEXT_KEY) != user:
+        try:
+            _raw_execute(conn, _SET_CONTEXT, (user,))
+        except conn.dialect.dbapi.OperationalError as exc:
+            # Writes made by migrations before the table exists.
+            if 'no such table' not in str(exc):
+                raise
+            return
+        conn.info[_CONTEXT_KEY] = user
+
+
+def _clear_context(conn) -> None:
+    if conn.info.pop(_CONTEXT_KEY, None) is not None:
+        _raw_execute(conn, _CLEAR_CONTEXT)
+
+
+def _forget_context(conn, *args) -> None:
+    # The row goes with the rolled back transaction or savepoint.
+    conn.info.pop(_CONTEXT_KEY, None)
+
+
+def _reset_context(dbapi_connection, connection_record, reset_state) -> None:
+    connection_record.info.pop(_CONTEXT_KEY, None)
+
+
+def instrument_engine(engine) -> None:
+    """Record the current user in ``audit_context`` for writes made through ``engine``."""
+    event.listen(engine, 'before_cursor_execute', _set_context)
+    event.listen(engine, 'commit', _clear_context)
+    event.listen(engine, 'rollback', _forget_context)
+    event.listen(engine, 'rollback_savepoint', _forget_context)
+    event.listen(engine.pool, 'reset', _reset_context)
+
+
+_NOW = "(julianday('now') - 2440587.5) * 86400.0"
+_USERNAME = '(SELECT username FROM audit_context WHERE id = 1)'
+
+
+def _row_json(columns: Sequence[str], row: str) -> str:
+    return 'json_object(' + ', '.join(f"'{name}', {row}.{name}" for name in columns) + ')'
+
+
+def _triggers(table: str, columns: Sequence[str]) -> List[str]:
+    def record(op: str, row: str, old: str, new: str) -> str:
+        return (
+            'INSERT INTO change_log (table_name, row_id, op, old, new, username, created) '
+            f"VALUES ('{table}', {row}.id, '{op}', {old}, {new}, {_USERNAME}, {_NOW});"
+        )
+
+    old, new = _row_json(columns, 'old'), _row_json(columns, 'new')
+    changed = ' OR '.join(f'old.{name} IS NOT new.{name}' for name in columns)
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS change_log_{table}_ai AFTER INSERT ON {table} BEGIN '
+        + record('insert', 'new', 'NULL', new) + ' END',
+        f'CREATE TRIGGER IF NOT EXISTS change_log_{table}_au AFTER UPDATE ON {table} WHEN {changed} BEGIN '
+        + record('update', 'new', old, new) + ' END',
+        f'CREATE TRIGGER IF NOT EXISTS change_log_{table}_ad AFTER DELETE ON {table} BEGIN '
+        + record('delete', 'old', old, 'NULL') + ' END',
+    ]
+
+
+# Every write to the audited tables, whether through the ORM, Core bulk
+# statements, imports or other triggers, is logged in its own transaction.
+# The column lists are fixed when the triggers are created, so a migration
+# that adds columns to an audited table must run ``install`` again.
+CREATE_TRIGGERS = tuple(
+    ddl
+    for model in AUDITED_MODELS
+    for ddl in _triggers(
+        model.__tablename__,
+        [column.name for column in model.__table__.c if column.name not in UNLOGGED_COLUMNS],
+    )
+)
+
+
+class ChangesPruned(LookupError):
+    """The changes after the requested sequence number are no longer all kept."""
+
+    def __init__(self, pruned_through: int):
+        super().__init__(f'Changes up to {pruned_through} were pruned; start again from a full export')
+        self.pruned_through = pruned_through
+
+
+class Change(NamedTuple):
+    seq: int
+    table: str
+    row_id: int
+    op: str
+    old: Optional[Dict[str, Any]]
+    new: Optional[Dict[str, Any]]
+    username: Optional[str]
+    created: float
+
+
+class CompactResult(NamedTuple):
+    compacted: int
+    pruned: int
+
+
+def latest_seq(session) -> int:
+    """The sequence number of the last change, even when it has been pruned."""
+    latest = session.execute(select(func.max(change_log.c.seq))).scalar()
+    if latest is None:
+        latest = session.execute(select(change_log_state.c.pruned_through)).scalar()
+    return latest or 0
+
+
+def changes_since(
+    session,
+    since: int = 0,
+    limit: int = DEFAULT_LIMIT,
+    tables: Optional[Sequence[str]] = None,
+) -> List[Change]:
+    """Up to ``limit`` changes after sequence number ``since``, oldest first.
+
+    Raises ``ChangesPruned`` when some changes after ``since`` were dropped.
+    Compacted history keeps the last change of each record, so applying the
+    entries in order as upserts and deletes by ``row_id`` gives the current
+    state.
+    """
+    pruned_through = session.execute(select(change_log_state.c.pruned_through)).scalar() or 0
+    if since < pruned_through:
+        raise ChangesPruned(pruned_through)
+    stmt = select(change_log).where(change_log.c.seq > since)
+    if tables:
+        stmt = stmt.where(change_log.c.table_name.in_(tables))
+    rows = session.execute(stmt.order_by(change_log.c.seq).limit(limit))
+    return [
+        Change(
+            seq=row.seq,
+            table=row.table_name,
+            row_id=row.row_id,
+            op=row.op,
+            old=json.loads(row.old) if row.old else None,
+            new=json.loads(row.new) if row.new else None,
+            username=row.username,
+            created=row.created,
+        )
+        for row in rows
+    ]
+
+
+def changed_ids(session, table: str, since: int) -> Set[int]:
+    """Ids of the ``table`` records written after sequence number ``since``.
+
+    Raises ``ChangesPruned`` like ``changes_since``.
+    """
+    pruned_through = session.execute(select(change_log_state.c.pruned_through)).scalar() or 0
+    if since < pruned_through:
+        raise ChangesPruned(pruned_through)
+    rows = session.execute(
+        select(change_log.c.row_id).distinct().where(change_log.c.seq > since, change_log.c.table_name == table)
+    )
+    return set(rows.scalars())
+
+
+# Collapse every chain of changes to one record within a segment into its
+# last entry, carrying over the values from before the first. An insert
+# followed by updates stays an insert.
+_MERGE = text(
+    "UPDATE change_log SET old = first.old, "
+    "op = CASE WHEN first.op = 'insert' AND change_log.op = 'update' THEN 'insert' ELSE change_log.op END "
+    'FROM (SELECT min(seq) AS first_seq, max(seq) AS last_seq FROM change_log '
+    'WHERE seq BETWEEN :low AND :high GROUP BY table_name, row_id HAVING count(*) > 1) AS chain '
+    'JOIN change_log AS first ON first.seq = chain.first_seq '
+    'WHERE change_log.seq = chain.last_seq'
+)
+_DROP_MERGED = text(
+    'DELETE FROM change_log WHERE seq BETWEEN :low AND :high AND seq NOT IN ('
+    'SELECT max(seq) FROM change_log WHERE seq BETWEEN :low AND :high GROUP BY table_name, row_id)'
+)
+
+
+def compact(session, now: Optional[float] = None) -> CompactResult:
+    """Collapse changes older than ``COMPACT_AFTER`` and drop those older than ``RETAIN_SECONDS``."""
+    now = time.time() if now is None else now
+    state = session.execute(select(change_log_state.c.pruned_through, change_log_state.c.compacted_through)).one()
+    through = session.execute(
+        select(func.max(change_log.c.seq)).where(change_log.c.created < now - COMPACT_AFTER)
+    ).scalar() or 0
+    compacted = 0
+    low = max(state.pruned_through, state.compacted_through) + 1
+    while low <= through:
+        high = min(low + SEGMENT_SIZE - 1, through)
+        params = {'low': low, 'high': high}
+        try:
+            session.execute(_MERGE, params)
+            compacted += session.execute(_DROP_MERGED, params).rowcount
+            session.execute(change_log_state.update().values(compacted_through=high))
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        low = high + 1
+
+    pruned = 0
+    horizon = session.execute(
+        select(func.max(change_log.c.seq)).where(change_log.c.created < now - RETAIN_SECONDS)
+    ).scalar()
+    if horizon is not None:
+        try:
+            pruned = session.execute(change_log.delete().where(change_log.c.seq <= horizon)).rowcount
+            session.execute(change_log_state.update().values(
+                pruned_through=func.max(change_log_state.c.pruned_through, horizon)
+            ))
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+    return CompactResult(compacted=compacted, pruned=pruned)
+
+
+def install(connection) -> None:
+    """Create the change log and (re)create its triggers; earlier history is not recorded."""
+    metadata.create_all(connection)
+    if connection.execute(select(change_log_state.c.id)).first() is None:
+        connection.execute(insert(change_log_state).values(id=1, pruned_through=0, compacted_through=0))
+    for model in AUDITED_MODELS:
+        for suffix in ('ai', 'au', 'ad'):
+            connection.execute(text(f'DROP TRIGGER IF EXISTS change_log_{model.__tablename__}_{suffix}'))
+    for ddl in CREATE_TRIGGERS:
+        connection.execute(text(ddl))
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import os
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Mapping, NamedTuple, Optional
+
+from sqlalchemy import Column, Float, MetaData, String, Table, text
+from werkzeug.security import check_password_hash
+
+from models import User
+
+# Password hashing is deliberately slow; at most this many run at once and
+# a few more may wait, so a burst of logins cannot take every core.
+PASSWORD_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+PASSWORD_QUEUE = PASSWORD_WORKERS * 4
+PASSWORD_TIMEOUT = 30
+# Seconds a login that timed out waiting for the pool is asked to wait.
+PASSWORD_RETRY = 5
+
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 300
+
+metadata = MetaData()
+login_throttle = Table(
+    'login_throttle',
+    metadata,
+    Column('bucket', String(200), primary_key=True),
+    Column('tokens', Float, nullable=False),
+    Column('updated', Float, nullable=False),
+)
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f'Too many login attempts. Try again in {self.retry_after} seconds.')
+
+
+class TokenBucket:
+    """Allow ``capacity`` attempts per key, refilled one per ``refill_seconds``.
+
+    Buckets live in memory, so a process that is already over the limit
+    rejects without touching the database. When an engine is given, the
+    bucket is also kept in the ``login_throttle`` table so the web app, CLI
+    and GUI share one limit.
+    """
+
+    # Chance per attempt of deleting stored buckets that have refilled.
+    PRUNE_CHANCE = 0.01
+
+    def __init__(self, capacity: int, refill_seconds: float, max_keys: int = 10000):
+        self.capacity = capacity
+        self.rate = 1.0 / refill_seconds
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _take_memory(self, key: str, now: float) -> float:
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def _take_stored(self, engine, key: str, now: float) -> float:
+        params = {'bucket': key, 'capacity': self.capacity, 'rate': self.rate, 'now': now}
+        refilled = 'min(:capacity, tokens + (:now - updated) * :rate)'
+        with engine.begin() as connection:
+            connection.execute(text(
+                'INSERT INTO login_throttle (bucket, tokens, updated) VALUES (:bucket, :capacity, :now) '
+                'ON CONFLICT (bucket) DO NOTHING'
+            ), params)
+            taken = connection.execute(text(
+                f'UPDATE login_throttle SET tokens = {refilled} - 1, updated = :now '
+                f'WHERE bucket = :bucket AND {refilled} >= 1'
+            ), params).rowcount
+            if taken:
+                wait = 0.0
+            else:
+                tokens = connection.execute(
+                    text(f'SELECT {refilled} FROM login_throttle WHERE bucket = :bucket'), params
+                ).scalar()
+                wait = (1 - tokens) / self.rate
+            if random.random() < self.PRUNE_CHANCE:
+                connection.execute(text(
+                    f'DELETE FROM login_throttle WHERE updated < :now - {self.capacity} / :rate'
+                ), params)
+        return wait
+
+    def take(self, key: str, engine=None) -> float:
+        """Use one attempt; return 0, or the seconds to wait if none is left."""
+        now = time.time()
+        wait = self._take_memory(key, now)
+        if wait or engine is None:
+            return wait
+        return self._take_stored(engine, key, now)
+
+    def reset(self, key: str, engine=None) -> None:
+        with self._lock:
+            self._buckets.pop(key, None)
+        if engine is not None:
+            with engine.begin() as connection:
+                connection.execute(login_throttle.delete().where(login_throttle.c.bucket == key))
+
+
+# Five tries per account, then one a minute; addresses get more room for
+# shared offices behind one NAT.
+USER_ATTEMPTS = TokenBucket(capacity=5, refill_seconds=60)
+ADDRESS_ATTEMPTS = TokenBucket(capacity=20, refill_seconds=6)
+
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix='password')
+_password_slots = threading.BoundedSemaphore(PASSWORD_WORKERS + PASSWORD_QUEUE)
+
+
+def check_password(user: User, password: str) -> bool:
+    """Verify ``password`` on the bounded hashing pool.
+
+    Raises ``Throttled`` when the pool and its queue are already full, or
+    the check does not finish within ``PASSWORD_TIMEOUT`` seconds.
+    """
+    if not _password_slots.acquire(blocking=False):
+        raise Throttled(1)
+    try:
+        # Read the hash here: the pool thread must not touch the ORM session.
+        future = _password_pool.submit(check_password_hash, user.password_hash, password)
+    except BaseException:
+        _password_slots.release()
+        raise
+    future.add_done_callback(lambda _: _password_slots.release())
+    try:
+        return future.result(timeout=PASSWORD_TIMEOUT)
+    except FutureTimeout:
+        future.cancel()
+        raise Throttled(PASSWORD_RETRY) from None
+
+
+class UserRecord(NamedTuple):
+    """The parts of a ``User`` views need, safe to share between threads."""
+
+    id: int
+    username: str
+
+    @property
+    def is_admin(self) -> bool:
+        return self.username == 'admin'
+
+
+class UserCache:
+    """A small LRU of authenticated users whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[UserRecord]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires, record = entry
+            if expires < time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return record
+
+    def put(self, token: str, record: UserRecord) -> None:
+        with self._lock:
+            self._entries[token] = (time.monotonic() + self.ttl, record)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, token: Optional[str]) -> None:
+        with self._lock:
+            self._entries.pop(token, None)
+
+
+user_cache = UserCache()
+
+
+def authenticate(session, username: str, password: str, address: Optional[str] = None) -> Optional[User]:
+    """Return the user for valid credentials, or ``None``.
+
+    Raises ``Throttled`` when the username or ``address`` has used up its
+    attempts; a successful login refills the username's bucket.
+    """
+    engine = session.get_bind()
+    user_key = f'user:{username.strip().lower()}'
+    wait = USER_ATTEMPTS.take(user_key, engine)
+    if address and not wait:
+        wait = ADDRESS_ATTEMPTS.take(f'address:{address}', engine)
+    if wait:
+        raise Throttled(wait)
+    user = session.query(User).filter_by(username=username).first()
+    if user is None or not check_password(user, password):
+        return None
+    USER_ATTEMPTS.reset(user_key, engine)
+    return user
+
+
+def remember(user: User) -> str:
+    """Cache ``user`` under a new token to keep in the login session."""
+    token = secrets.token_urlsafe(16)
+    user_cache.put(token, UserRecord(user.id, user.username))
+    return token
+
+
+def current_user(session, login: Mapping) -> Optional[UserRecord]:
+    """The user for a login session (``user_id`` and ``auth_token``), cached by token."""
+    token = login.get('auth_token')
+    record = user_cache.get(token) if token else None
+    if record is None:
+        if login.get('user_id') is None:
+            return None
+        user = session.get(User, login['user_id'])
+        if user is None:
+            return None
+        record = UserRecord(user.id, user.username)
+        if token:
+            user_cache.put(token, record)
+    return record
+
+
+def forget(token: Optional[str]) -> None:
+    user_cache.discard(token)
@@ -0,0 +1,411 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Callable, Dict, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(BASE_DIR, 'instance', 'benchmarks')
+SIZES = (10000, 100000, 1000000)
+# One inventory item for every ten assets.
+ITEMS_PER_ASSET = 0.1
+SEARCH_TERM = 'คอมพิวเตอร์'
+FILTER_CATEGORY = 'ครุภัณฑ์คอมพิวเตอร์'
+ASSET_FORM = {
+    'asset_code': '7440-001-BENCH',
+    'sub_code': '1',
+    'budget_year': '2567',
+    'name': 'เครื่องคอมพิวเตอร์ทดสอบ',
+    'details': 'ใช้สำหรับวัดประสิทธิภาพ',
+    'serial_number': 'BENCH0001',
+    'category': FILTER_CATEGORY,
+    'quantity': '1',
+    'acquisition_date': '2024-01-15',
+    'unit': 'งานพัสดุ',
+    'price': '25900',
+    'note': '',
+}
+# Requests cycled through by each client of the load test.
+LOAD_PATHS = (
+    '/',
+    '/?sort=name',
+    f'/?q={urllib.parse.quote(SEARCH_TERM)}',
+    f'/?category={urllib.parse.quote(FILTER_CATEGORY)}',
+    '/inventory',
+    '/dashboard',
+    '/api/v1/assets?limit=100',
+    '/api/v1/items?limit=100',
+)
+LOAD_PORT = 8765
+# How each server mode is started for the load test; ``{port}`` is filled in.
+LOAD_SERVERS = {
+    # What app.py runs on its own: the debug development server.
+    'dev': [sys.executable, '-c', 'import app; app.app.run(debug=True, port={port})'],
+    'serve': [sys.executable, 'serve.py', '--bind', '127.0.0.1:{port}'],
+}
+
+
+class Suite:
+    """Collects timings as ``{name: {min, median, max, repeat}}``."""
+
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, name: str, durations) -> None:
+        durations = list(durations)
+        self.results[name] = {
+            'min': min(durations),
+            'median': statistics.median(durations),
+            'max': max(durations),
+            'repeat': len(durations),
+        }
+        print(f'  {name}: {self.results[name]["median"] * 1000:.1f} ms', file=sys.stderr)
+
+    def time(self, name: str, func: Callable[[], Any], repeat: Optional[int] = None) -> None:
+        durations = []
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - start)
+        self.record(name, durations)
+
+    def skip(self, name: str, reason: str) -> None:
+        self.results[name] = {'skipped': reason}
+        print(f'  {name}: skipped ({reason})', file=sys.stderr)
+
+
+def _write_to_temp(writer, rows) -> None:
+    with tempfile.TemporaryFile() as handle:
+        writer(rows, handle)
+
+
+def run_size(size: int, seed: int, repeat: int) -> Dict[str, Any]:
+    """Benchmark the database named by ``INVENTORY_DATABASE_URL``.
+
+    Must run in a fresh process: ``app`` binds its session to that database
+    when it is imported.
+    """
+    import database
+    import synthetic_data
+    from models import Asset
+
+    suite = Suite(repeat)
+    engine = database.get_engine()
+    database.ensure_schema(engine)
+    with database.get_session() as session:
+        existing = session.query(Asset).count()
+    if existing < size:
+        start = time.perf_counter()
+        synthetic_data.populate(engine, size - existing, int((size - existing) * ITEMS_PER_ASSET), seed)
+        suite.record('seed', [time.perf_counter() - start])
+
+    import app as webapp
+    import exports
+    import pdfreport
+    import repository
+    import search
+
+    # Time real work: keep this run's export files apart from any cached ones,
+    # and drop rendered pages before each request.
+    export_dir = webapp.export_jobs.cache_dir = tempfile.mkdtemp(prefix='benchmark-exports-')
+    client = webapp.app.test_client()
+    suite.time('login', lambda: client.post('/login', data={'username': 'admin', 'password': 'admin'}))
+
+    pages = {
+        'asset_list': '/',
+        'asset_list.sorted': '/?sort=name',
+        'asset_list.filtered': f'/?category={FILTER_CATEGORY}',
+        'asset_list.search': f'/?q={SEARCH_TERM}',
+        'asset_list.search_sorted': f'/?q={SEARCH_TERM}&sort=id',
+        'inventory_list': '/inventory',
+        'dashboard': '/dashboard',
+    }
+    for name, url in pages.items():
+        suite.time(name, lambda url=url: (webapp.conditional.pages.clear(), client.get(url).get_data()))
+    suite.time('asset_list.cached', lambda: client.get('/').get_data())
+    etag = client.get('/').headers['ETag']
+    suite.time('asset_list.not_modified', lambda: client.get('/', headers={'If-None-Match': etag}))
+
+    # Export files are slow on big registers; time each once.
+    suite.time('export.csv', lambda: client.get('/export/csv').get_data(), repeat=1)
+    suite.time('export.csv.cached', lambda: client.get('/export/csv').get_data())
+    with database.get_session() as session:
+        suite.time('export.excel', lambda: _write_to_temp(exports.write_xlsx, exports.iter_rows(session, Asset)), repeat=1)
+        suite.time('export.word', lambda: _write_to_temp(exports.write_docx, exports.iter_rows(session, Asset)), repeat=1)
+        suite.time(
+            'export.word_by_category',
+            lambda: _write_to_temp(
+                lambda rows, handle: exports.write_docx(rows, handle, group_by='category'),
+                exports.iter_rows(session, Asset, order_by=[Asset.category]),
+            ),
+            repeat=1,
+        )
+        try:
+            font = pdfreport.find_font()
+        except pdfreport.FontNotFoundError as exc:
+            suite.skip('export.pdf', str(exc))
+        else:
+            suite.time(
+                'export.pdf',
+                lambda: _write_to_temp(
+                    lambda rows, handle: pdfreport.write_report(rows, handle, font), exports.iter_rows(session, Asset)
+                ),
+                repeat=1,
+            )
+
+        suite.time('search', lambda: search.search_assets(session, Asset, SEARCH_TERM))
+        try:
+            import inventory_gui
+        except ImportError as exc:
+            suite.skip('gui.refresh_assets', str(exc))
+            suite.skip('gui.search', str(exc))
+        else:
+            # The work the GUI's worker threads do; no display is needed.
+            view_source = inventory_gui.AllAssets()
+            block = inventory_gui.VirtualAssetView.BLOCK_SIZE
+            suite.time(
+                'gui.refresh_assets',
+                lambda: (view_source.count(session), view_source.fetch(session, 0, block)),
+            )
+            live_search = inventory_gui.LiveSearch(None, None, None)
+            suite.time('gui.search', lambda: live_search._query(session, live_search._generation, SEARCH_TERM))
+
+    created = []
+
+    def web_create():
+        client.post('/assets/add', data=ASSET_FORM)
+        with database.get_session() as session:
+            created.append(session.query(Asset.id).order_by(Asset.id.desc()).limit(1).scalar())
+
+    suite.time('crud.web.create', web_create)
+    suite.time('crud.web.read', lambda: client.get(f'/assets/{created[-1]}/edit').get_data())
+    suite.time('crud.web.update', lambda: client.post(f'/assets/{created[-1]}/edit', data=dict(ASSET_FORM, note='แก้ไข')))
+    suite.time('crud.web.delete', lambda: client.post(f'/assets/{created.pop()}/delete'), repeat=len(created))
+
+    with database.get_session() as session:
+        fields = repository.asset_fields(ASSET_FORM)
+        assets = []
+        suite.time('crud.session.create', lambda: assets.append(repository.create_asset(session, **fields)))
+        suite.time('crud.session.read', lambda: repository.get_asset(session, assets[-1].id))
+        suite.time('crud.session.update', lambda: repository.update_asset(session, assets[-1], note='แก้ไข'))
+        suite.time('crud.session.delete', lambda: repository.delete_asset(session, assets.pop()), repeat=len(assets))
+    shutil.rmtree(export_dir, ignore_errors=True)
+    return suite.results
+
+
+def _percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def _wait_for(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(url, timeout=5).read()
+            return
+        except (OSError, urllib.error.URLError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def _login(base: str) -> str:
+    """Log in as admin and return the session cookie the clients share."""
+
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    data = urllib.parse.urlencode({'username': 'admin', 'password': 'admin'}).encode()
+    try:
+        urllib.request.build_opener(NoRedirect).open(f'{base}/login', data, timeout=30)
+    except urllib.error.HTTPError as exc:  # the 302 after a successful login
+        return exc.headers['Set-Cookie'].split(';', 1)[0]
+    raise RuntimeError('login failed')
+
+
+def load_test(base: str, concurrency: int, duration: float) -> Dict[str, Any]:
+    """Have ``concurrency`` clients request ``LOAD_PATHS`` in turn for ``duration`` seconds."""
+    cookie = _login(base)
+    latencies: list = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(offset: int) -> None:
+        mine, failed, number = [], 0, offset
+        while time.monotonic() < deadline:
+            request = urllib.request.Request(base + LOAD_PATHS[number % len(LOAD_PATHS)], headers={'Cookie': cookie})
+            number += 1
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(request, timeout=60).read()
+            except (OSError, urllib.error.URLError):
+                failed += 1
+                continue
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    result = {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'per_second': len(latencies) / elapsed,
+        'p50': _percentile(latencies, 0.5),
+        'p95': _percentile(latencies, 0.95),
+        'p99': _percentile(latencies, 0.99),
+    }
+    print(
+        f'  {result["per_second"]:.1f} req/s, p50 {result["p50"] * 1000:.1f} ms, '
+        f'p95 {result["p95"] * 1000:.1f} ms, {result["errors"]} errors',
+        file=sys.stderr,
+    )
+    return result
+
+
+def run_load(size: int, seed: int, data_dir: str, concurrency: int, duration: float) -> Dict[str, Any]:
+    """Load test each of ``LOAD_SERVERS`` on the seeded database of ``size`` assets."""
+    import database
+    import synthetic_data
+
+    path = os.path.join(data_dir, f'assets-{size}-seed{seed}.db')
+    url = f'sqlite:///{path}'
+    engine = database.get_engine(url)
+    database.ensure_schema(engine)
+    with engine.connect() as connection:
+        existing = connection.exec_driver_sql('SELECT count(*) FROM asset').scalar()
+    if existing < size:
+        synthetic_data.populate(engine, size - existing, int((size - existing) * ITEMS_PER_ASSET), seed)
+    engine.dispose()
+
+    env = dict(os.environ, INVENTORY_DATABASE_URL=url, INVENTORY_PROFILE_RATE='0')
+    results = {}
+    for name, command in LOAD_SERVERS.items():
+        print(f'{name} server, {concurrency} clients', file=sys.stderr)
+        command = [part.format(port=LOAD_PORT) for part in command]
+        process = subprocess.Popen(command, cwd=BASE_DIR, env=env, start_new_session=True,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base = f'http://127.0.0.1:{LOAD_PORT}'
+            _wait_for(f'{base}/login')
+            results[name] = load_test(base, concurrency, duration)
+        finally:
+            # The dev server's reloader runs the app in a child process.
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+    return results
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> None:
+    """Print median timings of ``current`` relative to ``baseline``."""
+    for size, results in current['sizes'].items():
+        before = baseline.get('sizes', {}).get(size, {})
+        print(f'{size} assets ({baseline.get("commit")} -> {current.get("commit")}):')
+        for name, result in results.items():
+            if 'median' not in result or 'median' not in before.get(name, {}):
+                continue
+            ratio = result['median'] / before[name]['median'] if before[name]['median'] else float('inf')
+            flag = '  SLOWER' if ratio > 1.2 else ''
+            print(f'  {name:28} {before[name]["median"] * 1000:10.1f} ms {result["median"] * 1000:10.1f} ms  x{ratio:.2f}{flag}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the inventory hot paths on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[SIZES[0]], help=f'asset counts, e.g. {SIZES}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='where seeded databases are kept for reuse')
+    parser.add_argument('--output', help='JSON results file (default: <data-dir>/results-<commit>.json)')
+    parser.add_argument('--compare', metavar='JSON', help='print the change against an earlier results file')
+    parser.add_argument('--load', action='store_true',
+                        help='instead, load test the dev server against serve.py on the first size')
+    parser.add_argument('--concurrency', type=int, default=16, help='clients in the load test')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per server in the load test')
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size:
+        json.dump(run_size(args.run_size, args.seed, args.repeat), sys.stdout)
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    commit = _commit()
+    if args.load:
+        size = args.sizes[0]
+        report = {
+            'commit': commit,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'cpus': os.cpu_count(),
+            'size': size,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'servers': run_load(size, args.seed, args.data_dir, args.concurrency, args.duration),
+        }
+        output_path = args.output or os.path.join(args.data_dir, f'load-{commit or "unknown"}.json')
+        with open(output_path, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+        print(f'Results written to {output_path}', file=sys.stderr)
+        return
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'sizes': {},
+    }
+    for size in args.sizes:
+        print(f'{size} assets', file=sys.stderr)
+        path = os.path.join(args.data_dir, f'assets-{size}-seed{args.seed}.db')
+        env = dict(os.environ, INVENTORY_DATABASE_URL=f'sqlite:///{path}')
+        command = [sys.executable, os.path.abspath(__file__), '--run-size', str(size), '--seed', str(args.seed),
+                   '--repeat', str(args.repeat)]
+        output = subprocess.run(command, env=env, cwd=BASE_DIR, stdout=subprocess.PIPE, check=True).stdout
+        report['sizes'][str(size)] = json.loads(output)
+
+    output_path = args.output or os.path.join(args.data_dir, f'results-{commit or "unknown"}.json')
+    with open(output_path, 'w', encoding='utf-8') as handle:
+        json.dump(report, handle, indent=2, ensure_ascii=False)
+    print(f'Results written to {output_path}', file=sys.stderr)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as handle:
+            compare(json.load(handle), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import os
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+import audit
+import metrics
+import migrations
+import querycheck
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATABASE_URL = 'sqlite:///' + os.path.join(BASE_DIR, 'instance', 'inventory.db')
+DATABASE_URL = os.environ.get('INVENTORY_DATABASE_URL', DEFAULT_DATABASE_URL)
+
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+
+# WAL lets readers carry on while one writer commits, and busy_timeout makes
+# a second writer wait instead of failing with "database is locked".
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('busy_timeout', 15000),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -64000),
+    ('temp_store', 'MEMORY'),
+    ('foreign_keys', 'ON'),
+)
+
+_engines: Dict[str, Engine] = {}
+_sessionmakers: Dict[str, sessionmaker] = {}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+def get_engine(url: Optional[str] = None) -> Engine:
+    """Return the process-wide engine for ``url`` (the configured database by default)."""
+    url = url or DATABASE_URL
+    engine = _engines.get(url)
+    if engine is None:
+        if url.startswith('sqlite:///') and not url.startswith('sqlite:///:memory:'):
+            os.makedirs(os.path.dirname(os.path.abspath(url[len('sqlite:///'):])), exist_ok=True)
+        engine = create_engine(url, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_pre_ping=True)
+        metrics.instrument_engine(engine)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', _set_sqlite_pragmas)
+            audit.instrument_engine(engine)
+            if os.environ.get('INVENTORY_WARN_FULL_SCANS'):
+                querycheck.warn_on_full_scans(engine)
+        _engines[url] = engine
+    return engine
+
+
+def dispose_engines() -> None:
+    """Drop pooled connections inherited from a parent process after ``fork``.
+
+    The parent keeps using its own; the child opens fresh ones on demand.
+    """
+    for engine in _engines.values():
+        engine.dispose(close=False)
+
+
+def get_sessionmaker(url: Optional[str] = None) -> sessionmaker:
+    url = url or DATABASE_URL
+    factory = _sessionmakers.get(url)
+    if factory is None:
+        factory = sessionmaker(bind=get_engine(url))
+        _sessionmakers[url] = factory
+    return factory
+
+
+def get_session(url: Optional[str] = None):
+    return get_sessionmaker(url)()
+
+
+def schema_version(engine: Engine) -> int:
+    with engine.connect() as connection:
+        return migrations.current_version(connection)
+
+
+def ensure_schema(engine: Optional[Engine] = None, force: bool = False) -> bool:
+    """Apply pending migrations; a no-op when the database is already current.
+
+    Returns ``True`` when any migration ran. ``force`` re-applies them all.
+    """
+    engine = engine or get_engine()
+    applied = migrations.migrate(engine, rerun=force)
+    if applied:
+        # Pooled connections can keep statements (FTS5's internal ones in
+        # particular) prepared against the old schema and statistics.
+        engine.dispose()
+    return bool(applied)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import io
+import itertools
+import os
+import re
+import zipfile
+from typing import Iterable, Iterator, Optional
+from xml.sax.saxutils import escape
+
+from docx import Document
+from docx.shared import Length
+
+from exports import EXPORT_COLUMNS, GROUP_COLUMNS, HEADERS
+
+# Optional .docx whose styles, page setup, headers and footers are reused.
+TEMPLATE_ENV = 'INVENTORY_WORD_TEMPLATE'
+# A paragraph with exactly this text (in one run) marks where the tables go;
+# without one they are appended to the end of the template's body.
+PLACEHOLDER = '{{assets}}'
+NO_VALUE = 'ไม่ระบุ'
+
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_PLACEHOLDER_PARAGRAPH = re.compile(
+    r'<w:p[ >](?:(?!<w:p[ >]).)*?' + re.escape(PLACEHOLDER) + r'.*?</w:p>', re.S
+)
+
+
+def _text(value) -> str:
+    """Escape a value for ``<w:t>``, mapping newlines and tabs as python-docx does."""
+    text = escape(_INVALID_XML.sub('', str(value)))
+    text = text.replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">')
+    return text.replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+
+
+def _paragraph(text: str, style: Optional[str] = None) -> str:
+    properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+    return f'<w:p>{properties}<w:r><w:t xml:space="preserve">{_text(text)}</w:t></w:r></w:p>'
+
+
+class TableWriter:
+    """Produce WordprocessingML for the export table as strings.
+
+    The markup is the same python-docx writes for ``add_table`` plus
+    ``cell.text``, without building an object per cell.
+    """
+
+    def __init__(self, column_width: int):
+        self.cell_open = f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{column_width}"/></w:tcPr>'
+        self.empty_cell = self.cell_open + '<w:p/></w:tc>'
+        grid = f'<w:gridCol w:w="{column_width}"/>' * len(HEADERS)
+        self.table_open = (
+            '<w:tbl><w:tblPr><w:tblW w:type="auto" w:w="0"/>'
+            '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+            'w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr>'
+            f'<w:tblGrid>{grid}</w:tblGrid>'
+        )
+        header = ''.join(self.cell(value) for value in HEADERS)
+        # tblHeader repeats the header row at the top of every page.
+        self.header_row = f'<w:tr><w:trPr><w:tblHeader/></w:trPr>{header}</w:tr>'
+
+    def cell(self, value) -> str:
+        if value is None or value == '':
+            return self.empty_cell
+        return f'{self.cell_open}<w:p><w:r><w:t xml:space="preserve">{_text(value)}</w:t></w:r></w:p></w:tc>'
+
+    def table(self, rows: Iterable[tuple], chunk_size: int = 500) -> Iterator[str]:
+        yield self.table_open + self.header_row
+        cell = self.cell
+        for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+            yield ''.join('<w:tr>' + ''.join(map(cell, row)) + '</w:tr>' for row in chunk)
+        yield '</w:tbl>'
+
+
+def _split(document: str):
+    """Split document.xml around the point where the tables are inserted."""
+    match = _PLACEHOLDER_PARAGRAPH.search(document)
+    if match:
+        return document[:match.start()], document[match.end():]
+    end = document.rfind('<w:sectPr')
+    if end == -1:
+        end = document.rindex('</w:body>')
+    return document[:end], document[end:]
+
+
+def _heading_style(doc) -> Optional[str]:
+    try:
+        return doc.styles['Heading 1'].style_id
+    except KeyError:
+        return None
+
+
+def _body(doc, rows: Iterable[tuple], group_by: Optional[str]) -> Iterator[str]:
+    section = doc.sections[-1]
+    text_width = Length(section.page_width - section.left_margin - section.right_margin)
+    writer = TableWriter(text_width.twips // len(HEADERS))
+    rows = iter(rows)
+    if group_by is None:
+        yield from writer.table(rows)
+        return
+    index = [attr for _, attr in EXPORT_COLUMNS].index(group_by)
+    label = HEADERS[index]
+    style = _heading_style(doc)
+    for number, (value, group) in enumerate(itertools.groupby(rows, key=lambda row: row[index] or '')):
+        if number:
+            yield '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+        yield _paragraph(f'{label}: {value or NO_VALUE}', style)
+        yield from writer.table(group)
+
+
+def write_report(
+    rows: Iterable[tuple],
+    fileobj,
+    template: Optional[str] = None,
+    group_by: Optional[str] = None,
+) -> None:
+    """Write export rows as a Word table, streaming the XML into the package.
+
+    ``template`` defaults to ``$INVENTORY_WORD_TEMPLATE`` or python-docx's
+    blank document. With ``group_by`` (one of ``GROUP_COLUMNS``) each value
+    gets its own heading and table on a new page; rows must already be
+    sorted by that column.
+    """
+    if group_by is not None and group_by not in GROUP_COLUMNS:
+        raise ValueError(f'Cannot group by {group_by}')
+    doc = Document(template or os.environ.get(TEMPLATE_ENV) or None)
+    package = io.BytesIO()
+    doc.save(package)
+    with zipfile.ZipFile(package) as source, zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            if item.filename != 'word/document.xml':
+                target.writestr(item, source.read(item.filename))
+                continue
+            head, tail = _split(source.read(item.filename).decode('utf-8'))
+            with target.open(item.filename, 'w', force_zip64=True) as out:
+                out.write(head.encode('utf-8'))
+                for chunk in _body(doc, rows, group_by):
+                    out.write(chunk.encode('utf-8'))
+                out.write(tail.encode('utf-8'))
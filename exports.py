@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import csv
+import io
+import os
+from datetime import date
+from typing import IO, Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, select
+
+import valuation
+
+# (header, attribute) pairs in the column order every export uses.
+EXPORT_COLUMNS: List[Tuple[str, str]] = [
+    ('ลำดับ', 'id'),
+    ('รหัสครุภัณฑ์', 'asset_code'),
+    ('รหัสย่อย', 'sub_code'),
+    ('ปีงบประมาณที่ได้มา', 'budget_year'),
+    ('ชื่อครุภัณฑ์', 'name'),
+    ('รายละเอียด', 'details'),
+    ('หมายเลขเครื่อง/SN', 'serial_number'),
+    ('ประเภท', 'category'),
+    ('จำนวน', 'quantity'),
+    ('วันที่ได้มา', 'acquisition_date'),
+    ('หน่วยเบิก', 'unit'),
+    ('ราคา', 'price'),
+    ('หมายเหตุ', 'note'),
+]
+# Straight-line depreciation to the end of this month, from the valuation
+# cache; they follow the asset columns and are not imported.
+VALUE_COLUMNS: List[Tuple[str, str]] = [
+    ('ค่าเสื่อมราคาสะสม', 'accumulated'),
+    ('มูลค่าตามบัญชี', 'book_value'),
+]
+HEADERS = [header for header, _ in EXPORT_COLUMNS + VALUE_COLUMNS]
+# Columns a word export can be split by, one table per value.
+GROUP_COLUMNS = ('category', 'budget_year')
+
+CHUNK_SIZE = 1000
+FILE_BLOCK_SIZE = 64 * 1024
+
+MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'word': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'pdf': 'application/pdf',
+}
+EXTENSIONS = {'csv': 'csv', 'excel': 'xlsx', 'word': 'docx', 'pdf': 'pdf'}
+
+
+def format_value(value: Any) -> Any:
+    """A cell value as exports write it: dates as ``YYYY-MM-DD``, anything else unchanged."""
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+def iter_rows(
+    session,
+    model,
+    chunk_size: int = CHUNK_SIZE,
+    criteria: Sequence[Any] = (),
+    order_by: Sequence[Any] = (),
+) -> Iterator[tuple]:
+    """Yield export rows as plain tuples, fetching ``chunk_size`` at a time.
+
+    Rows are ordered by ``order_by`` (if given) and then by id. The
+    ``VALUE_COLUMNS`` are joined from the valuation cache, which is brought
+    up to date for this month before the first row is read.
+    """
+    period = valuation.current_period()
+    valuation.refresh(session, period)
+    cached = valuation.asset_valuation.c
+    stmt = (
+        select(*(getattr(model, attr) for _, attr in EXPORT_COLUMNS), *(cached[attr] for _, attr in VALUE_COLUMNS))
+        .outerjoin(valuation.asset_valuation, and_(
+            cached.asset_id == model.id, cached.period == period, cached.method == valuation.DEFAULT_METHOD
+        ))
+        .where(*criteria)
+        .order_by(*order_by, model.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    split = len(EXPORT_COLUMNS)
+    for row in session.execute(stmt):
+        yield (
+            tuple(format_value(value) for value in row[:split])
+            + tuple(valuation.round_amount(amount) for amount in row[split:])
+        )
+
+
+def iter_csv(header: Sequence[str], rows: Iterable[Sequence], block_size: int = FILE_BLOCK_SIZE) -> Iterator[str]:
+    """Render ``header`` and ``rows`` as CSV text in chunks of about ``block_size`` characters.
+
+    The first chunk starts with a UTF-8 BOM so Excel opens Thai text
+    correctly. Values are written as ``format_value`` gives them, None as
+    an empty cell.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(['' if value is None else format_value(value) for value in row])
+        if buffer.tell() > block_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_csv(rows: Iterable[tuple], fileobj: IO[str]) -> None:
+    for chunk in iter_csv(HEADERS, rows):
+        fileobj.write(chunk)
+
+
+def write_xlsx(rows: Iterable[tuple], fileobj) -> None:
+    """Write rows with openpyxl's write-only mode so cells are not kept in memory."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADERS)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(fileobj)
+
+
+def write_docx(rows: Iterable[tuple], fileobj, group_by: Optional[str] = None) -> None:
+    import docxreport
+
+    docxreport.write_report(rows, fileobj, group_by=group_by)
+
+
+def write_pdf(rows: Iterable[tuple], fileobj) -> None:
+    import pdfreport
+
+    pdfreport.write_report(rows, fileobj)
+
+
+WRITERS = {
+    'excel': write_xlsx,
+    'word': write_docx,
+    'pdf': write_pdf,
+}
+
+
+def iter_file(path: str, remove: bool = True, block_size: int = FILE_BLOCK_SIZE) -> Iterator[bytes]:
+    """Stream a file in blocks, deleting it afterwards when ``remove`` is set."""
+    try:
+        with open(path, 'rb') as handle:
+            while True:
+                block = handle.read(block_size)
+                if not block:
+                    break
+                yield block
+    finally:
+        if remove:
+            os.remove(path)
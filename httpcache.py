@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional, Tuple
+
+from flask import current_app, g, request, session
+from werkzeug.http import is_resource_modified
+
+import versions
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Browsers may keep pages but must ask whether they are still current.
+CACHE_CONTROL = 'private, no-cache'
+
+
+class PageCache:
+    """An LRU of rendered pages, bounded by their total size in bytes.
+
+    Keys include the table versions a page was rendered from, so a write
+    makes the old entries unreachable and they age out of the LRU.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, body: bytes, content_type: str) -> None:
+        if len(body) > self.max_bytes // 4:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (body, content_type)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+def _template_stamp(folder: Optional[str]) -> str:
+    # Part of every ETag so that deploying new templates invalidates pages
+    # browsers already hold; the same on every worker of one deployment.
+    latest = 0.0
+    if folder and os.path.isdir(folder):
+        for root, _, files in os.walk(folder):
+            for name in files:
+                latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+    return f'{latest:.0f}'
+
+
+def make_etag(stamp: versions.Stamp, *parts) -> str:
+    digest = hashlib.sha1(repr((stamp.versions,) + parts).encode('utf-8')).hexdigest()
+    return digest[:32]
+
+
+class ConditionalViews:
+    """Answer list pages with ``304 Not Modified`` while their tables are unchanged.
+
+    Decorated views get an ETag from the versions of the tables they read,
+    the full request URL and the logged-in user, and a ``Last-Modified``
+    time from the latest version bump. Pages rendered for a new ETag are
+    kept in a ``PageCache`` so other clients are served without a query.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable,
+        template_folder: Optional[str] = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.session_factory = session_factory
+        self.template_stamp = _template_stamp(template_folder)
+        self.pages = PageCache(max_bytes)
+
+    def stamp(self, *tables: str) -> versions.Stamp:
+        return versions.get_stamp(self.session_factory(), *tables)
+
+    def etag(self, stamp: versions.Stamp, *parts) -> str:
+        user = getattr(g, 'user', None)
+        return make_etag(stamp, self.template_stamp, user.id if user else None, *parts)
+
+    @staticmethod
+    def not_modified(etag: str, last_modified: Optional[datetime]) -> bool:
+        return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+    @staticmethod
+    def set_headers(response, etag: str, last_modified: Optional[datetime]):
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return response
+
+    def cacheable(self) -> bool:
+        # Flashed messages are shown once, and the metrics footer differs on
+        # every request, so neither kind of page may be replayed.
+        return (
+            request.method == 'GET'
+            and not session.get('_flashes')
+            and not current_app.config.get('METRICS_FOOTER')
+        )
+
+    def __call__(self, *tables: str, vary: Optional[Callable[[], tuple]] = None) -> Callable:
+        """Decorate a view that reads ``tables``.
+
+        ``vary`` returns anything else the page depends on, such as the
+        current date, to be made part of the ETag.
+        """
+        def decorator(view_func):
+            @functools.wraps(view_func)
+            def wrapper(*args, **kwargs):
+                if not self.cacheable():
+                    return view_func(*args, **kwargs)
+                stamp = self.stamp(*tables)
+                etag = self.etag(stamp, request.full_path, *(vary() if vary else ()))
+                if self.not_modified(etag, stamp.last_modified):
+                    return self.set_headers(current_app.response_class(status=304), etag, stamp.last_modified)
+                cached = self.pages.get(etag)
+                if cached is not None:
+                    body, content_type = cached
+                    response = current_app.response_class(body, content_type=content_type)
+                else:
+                    response = current_app.make_response(view_func(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    self.pages.put(etag, response.get_data(), response.content_type)
+                return self.set_headers(response, etag, stamp.last_modified)
+            return wrapper
+        return decorator
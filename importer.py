@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from typing import IO, Dict, Iterator, List, Tuple, Union
+
+import pandas as pd
+from openpyxl import load_workbook
+from sqlalchemy import bindparam, insert, select, update
+
+import versions
+from exports import EXPORT_COLUMNS
+
+DEFAULT_CHUNK_SIZE = 5000
+# Errors kept per import; the counts stay exact beyond this.
+MAX_REPORTED_ERRORS = 1000
+
+HEADER_TO_ATTR: Dict[str, str] = {header: attr for header, attr in EXPORT_COLUMNS}
+TEXT_COLUMNS = ('asset_code', 'sub_code', 'budget_year', 'name', 'details', 'serial_number', 'category', 'unit', 'note')
+REQUIRED_COLUMNS = ('asset_code', 'name')
+# Values for blank cells of new assets; updated assets keep what they had.
+INSERT_DEFAULTS = {'quantity': 1}
+
+
+@dataclass
+class ImportResult:
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    errors: List[Tuple[int, str]] = field(default_factory=list)
+
+    def add_error(self, row: int, message: str) -> None:
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row, message))
+
+    def summary(self) -> str:
+        return f'{self.inserted} inserted, {self.updated} updated, {self.skipped} rows with errors'
+
+
+Source = Union[str, IO[bytes]]
+
+
+def _iter_csv(source: Source, chunk_size: int) -> Iterator[pd.DataFrame]:
+    yield from pd.read_csv(
+        source,
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunk_size,
+        encoding='utf-8-sig',
+    )
+
+
+def _iter_xlsx(source: Source, chunk_size: int) -> Iterator[pd.DataFrame]:
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = [str(h).strip() if h is not None else '' for h in next(rows, ())]
+        width = len(headers)
+        batch = []
+        for row in rows:
+            batch.append(tuple(row[:width]) + (None,) * (width - len(row)))
+            if len(batch) >= chunk_size:
+                yield pd.DataFrame(batch, columns=headers)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=headers)
+    finally:
+        workbook.close()
+
+
+def iter_chunks(source: Source, filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Read an export-layout spreadsheet in DataFrame chunks of ``chunk_size`` rows."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        return _iter_csv(source, chunk_size)
+    if extension in ('.xlsx', '.xlsm'):
+        return _iter_xlsx(source, chunk_size)
+    raise ValueError(f'Unsupported file type: {extension or filename}')
+
+
+def coerce_chunk(frame: pd.DataFrame, first_row: int, result: ImportResult) -> List[dict]:
+    """Validate and convert one chunk, returning the rows that can be saved.
+
+    ``first_row`` is the spreadsheet row number of the chunk's first data row
+    and is used for error messages.
+    """
+    frame = frame.rename(columns=lambda c: HEADER_TO_ATTR.get(str(c).strip(), str(c).strip()))
+    frame = frame.loc[:, ~frame.columns.duplicated()]
+    frame.index = pd.RangeIndex(first_row, first_row + len(frame))
+    out = pd.DataFrame(index=frame.index)
+    bad = pd.Series('', index=frame.index)
+
+    # Only columns present in the file are written, so an upsert from a
+    # partial sheet leaves the other columns alone.
+    for name in TEXT_COLUMNS:
+        if name in frame:
+            values = frame[name].astype('string').str.strip()
+            # Whole numbers read from Excel come back as floats ("2566.0");
+            # text, such as every CSV cell, is kept as written.
+            floats = _float_cells(frame[name])
+            if floats.any():
+                values[floats] = values[floats].str.replace(r'^(-?\d+)\.0$', r'\1', regex=True)
+            out[name] = values.mask(values == '')
+
+    for name in REQUIRED_COLUMNS:
+        missing = out[name].isna() if name in out else pd.Series(True, index=frame.index)
+        bad = bad.mask(missing & (bad == ''), f'{name} is required')
+
+    if 'quantity' in frame:
+        raw = _blank_to_na(frame['quantity'])
+        quantity = pd.to_numeric(raw, errors='coerce')
+        invalid = raw.notna() & (quantity.isna() | (quantity % 1 != 0))
+        bad = bad.mask(invalid & (bad == ''), 'quantity must be a whole number')
+        out['quantity'] = quantity
+
+    if 'price' in frame:
+        raw = _blank_to_na(frame['price'])
+        price = pd.to_numeric(raw, errors='coerce')
+        bad = bad.mask(raw.notna() & price.isna() & (bad == ''), 'price must be a number')
+        out['price'] = price
+
+    if 'acquisition_date' in frame:
+        raw = _blank_to_na(frame['acquisition_date'])
+        acquired = pd.to_datetime(raw, errors='coerce', format='mixed')
+        bad = bad.mask(raw.notna() & acquired.isna() & (bad == ''), 'acquisition_date must be YYYY-MM-DD')
+        out['acquisition_date'] = acquired.dt.date
+
+    for row, message in bad[bad != ''].items():
+        result.add_error(int(row), message)
+    valid = out[bad == '']
+    if valid.empty:
+        return []
+    records = valid.astype(object).where(valid.notna(), None).to_dict('records')
+    if 'quantity' in valid:
+        for record in records:
+            if record['quantity'] is not None:
+                record['quantity'] = int(record['quantity'])
+    return records
+
+
+def _float_cells(series: pd.Series) -> pd.Series:
+    if pd.api.types.is_float_dtype(series):
+        return series.notna()
+    if series.dtype == object:
+        return series.map(lambda value: isinstance(value, float)).astype(bool)
+    return pd.Series(False, index=series.index)
+
+
+def _blank_to_na(series: pd.Series) -> pd.Series:
+    if series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+        stripped = series.astype('string').str.strip()
+        return series.mask(stripped.isna() | (stripped == ''))
+    return series
+
+
+def _key(record: dict) -> Tuple[str, str]:
+    return record['asset_code'], record.get('sub_code') or ''
+
+
+def save_chunk(session, model, records: List[dict], upsert: bool, result: ImportResult) -> None:
+    """Insert ``records`` (or update the ones whose key already exists) in bulk.
+
+    Core statements are used so each chunk becomes a few executemany calls.
+    An update only sets the columns a row has values for, so blank cells
+    keep what the asset had; updates are grouped by the columns they set.
+    """
+    if not records:
+        return
+    asset = model.__table__
+    if upsert:
+        latest = {}
+        for record in records:
+            latest[_key(record)] = record
+        records = list(latest.values())
+        codes = sorted({code for code, _ in latest})
+        existing = {}
+        stmt = select(model.id, model.asset_code, model.sub_code).where(model.asset_code.in_(codes))
+        for row_id, code, sub_code in session.execute(stmt):
+            existing[(code, sub_code or '')] = row_id
+        updates = [dict(record, row_id=existing[_key(record)]) for record in records if _key(record) in existing]
+        records = [record for record in records if _key(record) not in existing]
+        groups: Dict[Tuple[str, ...], List[dict]] = {}
+        for record in updates:
+            names = tuple(name for name, value in record.items() if value is not None and name != 'row_id')
+            # Only these keys: an update also sets any other column named in its parameters.
+            groups.setdefault(names, []).append({name: record[name] for name in (*names, 'row_id')})
+        for names, rows in groups.items():
+            stmt = update(asset).where(asset.c.id == bindparam('row_id')).values({name: bindparam(name) for name in names})
+            session.execute(stmt, rows)
+        result.updated += len(updates)
+    if records:
+        defaults = {name: value for name, value in INSERT_DEFAULTS.items() if name in records[0]}
+        for record in records:
+            for name, value in defaults.items():
+                if record[name] is None:
+                    record[name] = value
+        session.execute(insert(asset), records)
+        result.inserted += len(records)
+
+
+def import_assets(
+    session,
+    model,
+    source: Source,
+    filename: str,
+    upsert: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> ImportResult:
+    """Import assets from a CSV or Excel file laid out like the export.
+
+    Each chunk is validated with vectorized pandas operations and written in
+    its own transaction. Rows that fail validation are skipped and reported;
+    with ``upsert`` rows whose ``(asset_code, sub_code)`` already exists are
+    updated instead of inserted, leaving the columns of blank cells as they were.
+    """
+    result = ImportResult()
+    first_row = 2  # row 1 holds the headers
+    for frame in iter_chunks(source, filename, chunk_size):
+        records = coerce_chunk(frame, first_row, result)
+        first_row += len(frame)
+        try:
+            save_chunk(session, model, records, upsert, result)
+            versions.bump(session.connection(), model.__table__.name)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+    return result
@@ -1,41 +1,74 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import csv
 import getpass
-from datetime import datetime
+import json
+import os
+import sys
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence
 
-import pandas as pd
-from docx import Document
-from fpdf import FPDF
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import Float, Integer, select
+from sqlalchemy.orm import Session
 
-from models import Asset, Base, User, init_db
+import audit
+import auth
+import database
+import exports
+import listing
+import metrics
+import migrations
+import querycheck
+import records
+import repository
+import scan
+import search
+import stock
+import stocktake
+import summary
+import valuation
+from models import Asset, InventoryItem
 
 
 def login(session: Session) -> bool:
     username = input("Username: ")
     password = getpass.getpass("Password: ")
-    user = session.query(User).filter_by(username=username).first()
-    if user and user.check_password(password):
+    try:
+        user = auth.authenticate(session, username, password)
+    except auth.Throttled as exc:
+        print(exc)
+        return False
+    if user:
+        audit.set_process_user(user.username)
         print("Login successful")
         return True
     print("Invalid credentials")
     return False
 
 
-def list_assets(session: Session) -> None:
-    assets = session.query(Asset).all()
-    if not assets:
-        print("No assets found")
-        return
+def print_assets(assets) -> None:
+    found = False
     for a in assets:
+        found = True
         print(
             f"{a.id}: code {a.asset_code}, sub {a.sub_code}, year {a.budget_year},"
             f" name {a.name}, details {a.details}, SN {a.serial_number},"
             f" category {a.category}, qty {a.quantity}, acquired {a.acquisition_date},"
             f" unit {a.unit}, price {a.price}, note {a.note}"
         )
+    if not found:
+        print("No assets found")
+
+
+def list_assets(session: Session) -> None:
+    print_assets(repository.iter_assets(session))
+
+
+def search_assets(session: Session) -> None:
+    query = input("Search: ")
+    print_assets(search.search_assets(session, Asset, query))
 
 
 def add_asset(session: Session) -> None:
@@ -46,125 +79,778 @@ def add_asset(session: Session) -> None:
     details = input("Details: ")
     serial_number = input("Serial number: ")
     category = input("Category: ")
-    quantity = int(input("Quantity: ") or 1)
-    acq_str = input("Acquisition date (YYYY-MM-DD): ")
-    acquisition_date = (
-        datetime.strptime(acq_str, "%Y-%m-%d").date() if acq_str else None
-    )
+    quantity = input("Quantity: ")
+    acquisition_date = input("Acquisition date (YYYY-MM-DD): ")
     unit = input("Unit: ")
-    price_str = input("Price: ")
-    price = float(price_str) if price_str else None
+    price = input("Price: ")
     note = input("Note: ")
-    asset = Asset(
-        asset_code=asset_code,
-        sub_code=sub_code or None,
-        budget_year=budget_year or None,
-        name=name,
-        details=details or None,
-        serial_number=serial_number or None,
-        category=category or None,
-        quantity=quantity,
-        acquisition_date=acquisition_date,
-        unit=unit or None,
-        price=price,
-        note=note or None,
-    )
-    session.add(asset)
-    session.commit()
+    try:
+        fields = repository.asset_fields({
+            "asset_code": asset_code,
+            "sub_code": sub_code,
+            "budget_year": budget_year,
+            "name": name,
+            "details": details,
+            "serial_number": serial_number,
+            "category": category,
+            "quantity": quantity,
+            "acquisition_date": acquisition_date,
+            "unit": unit,
+            "price": price,
+            "note": note,
+        })
+    except ValueError as exc:
+        print(f"Invalid value: {exc}")
+        return
+    repository.create_asset(session, **fields)
     print("Asset added")
 
 
 def delete_asset(session: Session) -> None:
     asset_id = input("Asset ID to delete: ")
-    asset = session.get(Asset, int(asset_id)) if asset_id else None
+    asset = repository.get_asset(session, int(asset_id)) if asset_id.isdigit() else None
     if not asset:
         print("Asset not found")
         return
-    session.delete(asset)
-    session.commit()
+    repository.delete_asset(session, asset)
     print("Asset deleted")
 
 
+def _output(path: str, binary: bool = False):
+    """Open ``path`` for writing; ``-`` is stdout, left open afterwards."""
+    if path == "-":
+        return contextlib.nullcontext(sys.stdout.buffer if binary else sys.stdout)
+    if binary:
+        return open(path, "wb")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def write_export(session: Session, fmt: str, path: str, group_by: Optional[str] = None, font=None):
+    """Write every asset to ``path`` (``-`` for stdout) and return the metrics span."""
+    order_by = [getattr(Asset, group_by)] if group_by else []
+    with metrics.observe(f"cli_export_{fmt}") as span:
+        rows = exports.iter_rows(session, Asset, order_by=order_by)
+        with _output(path, binary=fmt != "csv") as handle:
+            if fmt == "csv":
+                exports.write_csv(rows, handle)
+            elif fmt == "word":
+                exports.write_docx(rows, handle, group_by=group_by)
+            elif fmt == "pdf":
+                import pdfreport
+
+                pdfreport.write_report(rows, handle, font)
+            else:
+                exports.WRITERS[fmt](rows, handle)
+    return span
+
+
 def export_assets(session: Session) -> None:
-    fmt = input("Format (excel/word/pdf): ").lower()
-    assets = session.query(Asset).all()
-    data = [
-        {
-            "ลำดับ": a.id,
-            "รหัสครุภัณฑ์": a.asset_code,
-            "รหัสย่อย": a.sub_code,
-            "ปีงบประมาณที่ได้มา": a.budget_year,
-            "ชื่อครุภัณฑ์": a.name,
-            "รายละเอียด": a.details,
-            "หมายเลขเครื่อง/SN": a.serial_number,
-            "ประเภท": a.category,
-            "จำนวน": a.quantity,
-            "วันที่ได้มา": a.acquisition_date.strftime("%Y-%m-%d") if a.acquisition_date else "",
-            "หน่วยเบิก": a.unit,
-            "ราคา": a.price,
-            "หมายเหตุ": a.note,
-        }
-        for a in assets
-    ]
-    if fmt == "excel":
-        df = pd.DataFrame(data)
-        df.to_excel("assets.xlsx", index=False)
-        print("Exported to assets.xlsx")
-    elif fmt == "word":
-        doc = Document()
-        table = doc.add_table(rows=1, cols=len(data[0]) if data else 1)
-        hdr_cells = table.rows[0].cells
-        for i, key in enumerate(data[0].keys() if data else ["รายการ"]):
-            hdr_cells[i].text = key
-        for item in data:
-            row_cells = table.add_row().cells
-            for i, key in enumerate(item.keys()):
-                row_cells[i].text = str(item[key])
-        doc.save("assets.docx")
-        print("Exported to assets.docx")
-    elif fmt == "pdf":
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=10)
-        for item in data:
-            line = " | ".join([f"{k}: {v}" for k, v in item.items()])
-            pdf.multi_cell(0, 5, line)
-            pdf.ln(1)
-        pdf.output("assets.pdf")
-        print("Exported to assets.pdf")
-    else:
+    fmt = input("Format (excel/csv/word/pdf): ").lower()
+    if fmt not in exports.EXTENSIONS:
         print("Unknown format")
+        return
+    default = f"assets.{exports.EXTENSIONS[fmt]}"
+    path = input(f"Output file [{default}]: ") or default
+    group_by = None
+    if fmt == "word":
+        group_by = input("Split by (category/budget_year, blank for none): ").strip() or None
+        if group_by is not None and group_by not in exports.GROUP_COLUMNS:
+            print("Unknown column")
+            return
+    font = None
+    if fmt == "pdf":
+        import pdfreport
+
+        try:
+            font = pdfreport.find_font()
+        except pdfreport.FontNotFoundError as exc:
+            print(exc)
+            return
+    span = write_export(session, fmt, path, group_by, font)
+    print(f"Exported to {path} in {span.summary()}")
+    for statement, count in span.repeated:
+        print(f"  Warning: one query ran {count} times")
+    if span.profile_path:
+        print(f"  Profile saved to {span.profile_path}")
+
+
+def summary_report(session: Session) -> None:
+    for dimension in summary.ASSET_DIMENSIONS:
+        print(f"\nAssets by {dimension}:")
+        for value, count, quantity, total in summary.asset_totals(session, dimension):
+            print(f"  {value or '(none)'}: {count} assets, qty {quantity}, value {total:,.2f}")
+    print("\nInventory by location:")
+    for location, count, quantity in summary.inventory_totals(session):
+        print(f"  {location or '(none)'}: {count} items, qty {quantity}")
+
+
+def stock_report(when: str) -> None:
+    try:
+        timestamp = datetime.fromisoformat(when).timestamp()
+    except ValueError:
+        print("Use an ISO date and time, e.g. 2024-01-31T17:00")
+        return
+    with database.get_session() as session:
+        try:
+            levels = stock.stock_at(session, timestamp)
+        except stock.StockError as exc:
+            print(exc)
+            return
+        names = dict(session.query(InventoryItem.id, InventoryItem.name))
+    for item_id, quantity in levels:
+        print(f"{item_id}: {names.get(item_id, '(deleted)')}, qty {quantity}")
+
+
+def import_assets(session: Session, path: str, upsert: bool) -> None:
+    import importer
+
+    try:
+        result = importer.import_assets(session, Asset, path, path, upsert=upsert)
+    except (OSError, ValueError) as exc:
+        print(f"Import failed: {exc}")
+        return
+    for row, message in result.errors:
+        print(f"Row {row}: {message}")
+    print(f"Imported: {result.summary()}")
+
+
+TOKEN_ENV = "INVENTORY_TOKEN"
+USER_ENV = "INVENTORY_USER"
+PASSWORD_ENV = "INVENTORY_PASSWORD"
+RESOURCES = {"assets": listing.asset_listing, "items": listing.inventory_listing}
+OUTPUT_FORMATS = ("json", "ndjson", "csv")
+INPUT_FORMATS = ("auto", "json", "ndjson", "csv")
+
+
+def authorize(session: Session, token: Optional[str], username: Optional[str]) -> Optional[str]:
+    """Check the credentials of a subcommand and return the user name, if any.
+
+    A token from ``--token`` or ``$INVENTORY_TOKEN`` must be one of the API
+    tokens; otherwise ``--user``/``$INVENTORY_USER`` logs in with
+    ``$INVENTORY_PASSWORD`` or a password prompt. Exits when neither works.
+    """
+    token = token or os.environ.get(TOKEN_ENV)
+    if token:
+        if records.check_token(token, records.configured_tokens()):
+            audit.set_process_user(records.TOKEN_USER)
+            return None
+        sys.exit(f"Invalid token; it must be one of ${records.TOKENS_ENV}")
+    username = username or os.environ.get(USER_ENV)
+    if not username:
+        sys.exit(f"Pass --token or --user, or set ${TOKEN_ENV} or ${USER_ENV}")
+    password = os.environ.get(PASSWORD_ENV)
+    if password is None:
+        if not sys.stdin.isatty():
+            sys.exit(f"Set ${PASSWORD_ENV} when not running in a terminal")
+        password = getpass.getpass("Password: ")
+    try:
+        user = auth.authenticate(session, username, password)
+    except auth.Throttled as exc:
+        sys.exit(str(exc))
+    if user is None:
+        sys.exit("Invalid credentials")
+    audit.set_process_user(user.username)
+    return user.username
+
+
+def _fields(spec: listing.ListingSpec, requested: Optional[str]) -> List[str]:
+    available = [column.name for column in spec.model.__table__.c]
+    names = [name.strip() for name in (requested or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        sys.exit(f"Unknown fields: {', '.join(unknown)} (available: {', '.join(available)})")
+    return names or available
+
+
+def _filters(spec: listing.ListingSpec, pairs: Sequence[str]) -> Dict[str, str]:
+    allowed = list(spec.filters)
+    if spec.date_range:
+        allowed += [f"{spec.date_range}_from", f"{spec.date_range}_to"]
+    filters = {}
+    for pair in pairs:
+        name, _, value = pair.partition("=")
+        if name not in allowed:
+            sys.exit(f"Cannot filter on {name} (use one of: {', '.join(allowed)})")
+        if spec.date_range and name.startswith(spec.date_range):
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                sys.exit(f"{name} must be a YYYY-MM-DD date")
+        filters[name] = value
+    return filters
+
+
+def typed_values(model, values: Mapping[str, Any], drop_blank: bool = False) -> Dict[str, Any]:
+    """Convert the strings of CSV input or ``--set`` options to column types.
+
+    Blank strings become ``None``, or are left out with ``drop_blank`` so new
+    records get the column defaults. The API validation checks the result.
+    """
+    columns = model.__table__.c
+    fields = {}
+    for name, value in values.items():
+        if isinstance(value, str) and name in columns:
+            value = value.strip() or None
+            column_type = columns[name].type
+            try:
+                if value is not None and isinstance(column_type, Integer):
+                    value = int(value)
+                elif value is not None and isinstance(column_type, Float):
+                    value = float(value)
+            except ValueError:
+                raise ValueError(f"{name} must be a number") from None
+        if value is not None or not drop_blank:
+            fields[name] = value
+    return fields
+
+
+def read_records(stream, fmt: str, model, drop_blank: bool = False) -> List[Any]:
+    """Records from a JSON list, JSON lines or CSV with column name headers."""
+    text = stream.read()
+    if fmt == "auto":
+        start = text.lstrip()[:1]
+        fmt = "json" if start == "[" else "ndjson" if start == "{" else "csv"
+    if fmt == "csv":
+        records = []
+        for number, row in enumerate(csv.DictReader(text.lstrip("\ufeff").splitlines()), 2):
+            try:
+                records.append(typed_values(model, row, drop_blank))
+            except ValueError as exc:
+                raise ValueError(f"line {number}: {exc}") from None
+        return records
+    if fmt == "json":
+        try:
+            records = json.loads(text)
+        except ValueError as exc:
+            raise ValueError(f"invalid JSON: {exc}") from None
+        return records if isinstance(records, list) else [records]
+    records = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if line.strip():
+            try:
+                records.append(json.loads(line))
+            except ValueError as exc:
+                raise ValueError(f"line {number}: {exc}") from None
+    return records
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return exports.format_value(value)
+
+
+def write_records(fields: Sequence[str], rows: Iterable[tuple], fmt: str) -> int:
+    """Write ``rows`` to stdout as they arrive and return how many there were."""
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(sys.stdout, lineterminator="\n")
+        writer.writerow(fields)
+        for count, row in enumerate(rows, 1):
+            writer.writerow([_csv_value(value) for value in row])
+        return count
+    out = sys.stdout.buffer
+    separator = b"[\n" if fmt == "json" else b""
+    end = b"\n" if fmt == "ndjson" else b",\n"
+    for count, row in enumerate(rows, 1):
+        out.write(separator + records.dumps(dict(zip(fields, row))))
+        separator = end
+    if fmt == "json":
+        out.write(b"\n]\n" if count else b"[]\n")
+    elif count:
+        out.write(b"\n")
+    return count
+
+
+def emit(payload: Any) -> None:
+    sys.stdout.buffer.write(records.dumps(payload) + b"\n")
+
+
+def command_list(session: Session, args) -> None:
+    spec = RESOURCES[args.resource]
+    fields = _fields(spec, args.fields)
+    criteria = listing.filter_criteria(spec, _filters(spec, args.where))
+    if args.search:
+        if spec.model is not Asset:
+            sys.exit("--search only applies to assets")
+        criteria += search.match_criteria(session, Asset, args.search)
+    sort = args.sort or spec.default_sort
+    if sort not in spec.sort_keys:
+        sys.exit(f"Cannot sort by {sort} (use one of: {', '.join(spec.sort_keys)})")
+    id_column = spec.column("id")
+    order = [spec.column(sort), id_column] if sort != "id" else [id_column]
+    stmt = (
+        select(*(spec.column(name) for name in fields))
+        .where(*criteria)
+        .order_by(*(column.desc() if args.desc else column.asc() for column in order))
+        .execution_options(yield_per=exports.CHUNK_SIZE)
+    )
+    if args.limit:
+        stmt = stmt.limit(args.limit)
+    write_records(fields, session.execute(stmt), args.format)
+
+
+def command_get(session: Session, args) -> None:
+    spec = RESOURCES[args.resource]
+    fields = _fields(spec, args.fields)
+    stmt = select(*(spec.column(name) for name in fields), spec.column("id")).where(spec.column("id").in_(args.ids))
+    rows = {row[-1]: row[:-1] for row in session.execute(stmt)}
+    missing = [record_id for record_id in args.ids if record_id not in rows]
+    write_records(fields, (rows[record_id] for record_id in args.ids if record_id in rows), args.format)
+    if missing:
+        sys.exit(f"No records with id {', '.join(map(str, missing))}")
+
+
+def _assignments(model, pairs: Sequence[str], drop_blank: bool = False) -> Dict[str, Any]:
+    values = {}
+    for pair in pairs:
+        name, separator, value = pair.partition("=")
+        if not separator:
+            sys.exit(f"Expected NAME=VALUE, got {pair}")
+        values[name.strip()] = value
+    return typed_values(model, values, drop_blank)
+
+
+def _batch_input(model, args, drop_blank: bool = False) -> List[Any]:
+    try:
+        return read_records(sys.stdin, args.input, model, drop_blank)
+    except ValueError as exc:
+        sys.exit(f"Invalid input: {exc}")
+
+
+def _apply(session: Session, model, **batch) -> repository.BatchResult:
+    try:
+        return repository.apply_batch(session, model, **batch)
+    except repository.StaleRecords as exc:
+        sys.exit(f"{exc}; nothing was changed")
+    except LookupError as exc:
+        sys.exit(f"No records with id {', '.join(map(str, exc.args[0]))}; nothing was changed")
+
+
+def _validated(validate, batch: Sequence[Any]) -> List[Dict[str, Any]]:
+    try:
+        return [validate(data, f"record {index}") for index, data in enumerate(batch, 1)]
+    except ValueError as exc:
+        sys.exit(f"Invalid input: {exc}; nothing was changed")
+
+
+def command_add(session: Session, args) -> None:
+    model = RESOURCES[args.resource].model
+    try:
+        batch = [_assignments(model, args.set, drop_blank=True)] if args.set else _batch_input(model, args, True)
+    except ValueError as exc:
+        sys.exit(f"Invalid input: {exc}")
+    rows = _validated(lambda data, where: records.record_fields(model, data, where=where), batch)
+    emit({"created": _apply(session, model, create=rows).created})
+
+
+def command_update(session: Session, args) -> None:
+    model = RESOURCES[args.resource].model
+    if args.id is not None:
+        try:
+            batch = [{**_assignments(model, args.set), "id": args.id}]
+        except ValueError as exc:
+            sys.exit(f"Invalid input: {exc}")
+    elif args.set:
+        sys.exit("--set needs the id of the record to change")
+    else:
+        batch = _batch_input(model, args)
+    rows = _validated(lambda data, where: records.update_fields(model, data, where), batch)
+    emit({"updated": _apply(session, model, update_rows=rows).updated})
+
+
+def command_delete(session: Session, args) -> None:
+    model = RESOURCES[args.resource].model
+    ids: List[int] = []
+    for value in args.ids:
+        if value != "-":
+            if not value.isdigit():
+                sys.exit(f"Not an id: {value}")
+            ids.append(int(value))
+            continue
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                # Accept bare ids or the records that list/get print as JSON lines.
+                try:
+                    record_id = json.loads(line).get("id") if line.startswith("{") else line
+                except ValueError:
+                    record_id = None
+                if not str(record_id).isdigit():
+                    sys.exit(f"Not an id: {line}")
+                ids.append(int(record_id))
+    emit({"deleted": _apply(session, model, delete_ids=ids).deleted})
+
+
+def command_import(session: Session, args) -> None:
+    import importer
+
+    try:
+        result = importer.import_assets(session, Asset, args.file, args.file, upsert=args.upsert)
+    except (OSError, ValueError) as exc:
+        sys.exit(f"Import failed: {exc}")
+    emit({
+        "inserted": result.inserted,
+        "updated": result.updated,
+        "skipped": result.skipped,
+        "errors": [{"row": row, "error": message} for row, message in result.errors],
+    })
+    if result.errors:
+        sys.exit(1)
+
+
+def command_export(session: Session, args) -> None:
+    if args.group_by and args.format != "word":
+        sys.exit("--group-by only applies to word exports")
+    font = None
+    if args.format == "pdf":
+        import pdfreport
+
+        try:
+            font = pdfreport.find_font()
+        except pdfreport.FontNotFoundError as exc:
+            sys.exit(str(exc))
+    path = args.output or f"assets.{exports.EXTENSIONS[args.format]}"
+    span = write_export(session, args.format, path, args.group_by, font)
+    print(f"Exported to {path} in {span.summary()}", file=sys.stderr)
+
+
+def command_labels(session: Session, args) -> None:
+    import labels
+    import pdfreport
+
+    try:
+        font = pdfreport.find_font()
+    except pdfreport.FontNotFoundError as exc:
+        sys.exit(str(exc))
+    kind = args.kind or labels.KINDS[0]
+    criteria = listing.filter_criteria(listing.asset_listing, _filters(listing.asset_listing, args.where))
+    with metrics.observe(f"cli_labels_{kind}") as span:
+        with _output(args.output, binary=True) as handle:
+            try:
+                count = labels.write_labels(labels.iter_labels(session, criteria), handle, kind, font, args.workers)
+            except labels.LabelError as exc:
+                sys.exit(str(exc))
+    print(f"Wrote {count} labels to {args.output} in {span.summary()}", file=sys.stderr)
+
+
+def command_scan(session: Session, args) -> None:
+    index = scan.ScanIndex()
+    codes = args.codes or (line.strip() for line in sys.stdin)
+    missing = 0
+    for code in codes:
+        if not code:
+            continue
+        matches = index.lookup(session, code)
+        # End the read so the next scan sees writes made in the meantime.
+        session.commit()
+        for match in matches:
+            emit(match._asdict())
+        if not matches:
+            missing += 1
+            print(f"No asset with code or serial number {code}", file=sys.stderr)
+        sys.stdout.flush()
+    if missing:
+        sys.exit(1)
+
+
+def command_changes(session: Session, args) -> None:
+    tables = [RESOURCES[args.resource].model.__tablename__] if args.resource else None
+
+    def rows():
+        since, remaining = args.since, args.limit
+        while remaining is None or remaining > 0:
+            size = audit.DEFAULT_LIMIT if remaining is None else min(remaining, audit.DEFAULT_LIMIT)
+            entries = audit.changes_since(session, since, size, tables)
+            yield from entries
+            if len(entries) < size:
+                return
+            since = entries[-1].seq
+            if remaining is not None:
+                remaining -= len(entries)
+
+    try:
+        write_records(audit.Change._fields, rows(), args.format)
+    except audit.ChangesPruned as exc:
+        sys.exit(str(exc))
+
+
+def command_stats(session: Session, args) -> None:
+    def rows():
+        for dimension in summary.ASSET_DIMENSIONS:
+            for value, count, quantity, total in summary.asset_totals(session, dimension):
+                yield "assets", dimension, value, count, quantity, total
+        for location, count, quantity in summary.inventory_totals(session):
+            yield "items", "location", location, count, quantity, None
+
+    write_records(("table", "dimension", "value", "count", "quantity", "total_value"), rows(), args.format)
+
+
+def command_stocktake(session: Session, args) -> None:
+    if args.action == "new":
+        try:
+            emit({"id": stocktake.create(session, " ".join(args.args), audit.current_user())})
+        except stocktake.CountError as exc:
+            sys.exit(str(exc))
+        return
+    if args.action == "list":
+        write_records(stocktake.Stocktake._fields, stocktake.list_all(session), args.format)
+        return
+    if not args.args or not args.args[0].isdigit():
+        sys.exit(f"stocktake {args.action} needs a stocktake id")
+    stocktake_id = int(args.args[0])
+    if stocktake.get(session, stocktake_id) is None:
+        sys.exit(f"No stocktake with id {stocktake_id}")
+    if args.action == "count":
+        total = 0
+        for path in args.args[1:] or ["-"]:
+            handle = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+            try:
+                total += stocktake.add_counts(session, stocktake_id, stocktake.read_counts(handle))
+            except (OSError, csv.Error, stocktake.CountError) as exc:
+                sys.exit(f"{path}: {exc}")
+            finally:
+                if handle is not sys.stdin:
+                    handle.close()
+        print(f"Added {total} count lines", file=sys.stderr)
+        return
+    statuses = args.status.split(",") if args.status else stocktake.VARIANCES
+    unknown = [name for name in statuses if name not in stocktake.STATUSES]
+    if unknown:
+        sys.exit(f"Unknown status {', '.join(unknown)} (use: {', '.join(stocktake.STATUSES)})")
+    result = stocktake.report(session, stocktake_id, statuses)
+    if args.summary:
+        write_records(stocktake.GroupSummary._fields, result.summary, args.format)
+    else:
+        write_records(stocktake.Variance._fields, result.variances, args.format)
+
+
+def command_valuation(session: Session, args) -> None:
+    period = args.period or valuation.current_period()
+    criteria = listing.filter_criteria(listing.asset_listing, _filters(listing.asset_listing, args.where))
+    if criteria and args.summary:
+        sys.exit("--summary covers every asset; leave out --where")
+    try:
+        with metrics.observe("cli_valuation") as span:
+            result = valuation.refresh(session, period, args.method)
+    except (OSError, ValueError) as exc:
+        sys.exit(str(exc))
+    if result.full:
+        print(f"Valued every asset for {period} in {span.summary()}", file=sys.stderr)
+    elif result.revalued:
+        print(f"Revalued {result.revalued} changed assets for {period} in {span.summary()}", file=sys.stderr)
+    if args.summary:
+        write_records(valuation.CategoryValue._fields, valuation.category_totals(session, period, args.method),
+                      args.format)
+    else:
+        write_records(valuation.ROW_FIELDS, valuation.iter_values(session, period, args.method, criteria), args.format)
+
+
+COMMANDS = {
+    "list": command_list,
+    "get": command_get,
+    "add": command_add,
+    "update": command_update,
+    "delete": command_delete,
+    "import": command_import,
+    "export": command_export,
+    "stats": command_stats,
+    "changes": command_changes,
+    "labels": command_labels,
+    "scan": command_scan,
+    "stocktake": command_stocktake,
+    "valuation": command_valuation,
+}
+
+
+def add_subcommands(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--token", help=f"API token from ${records.TOKENS_ENV} (default ${TOKEN_ENV})")
+    parser.add_argument("--user", help=f"Log in as this user (default ${USER_ENV}) with ${PASSWORD_ENV} or a prompt")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND",
+                                     help="Run one command without the menu (see COMMAND --help)")
+
+    def resource(sub: argparse.ArgumentParser) -> None:
+        sub.add_argument("resource", choices=RESOURCES)
+
+    def output(sub: argparse.ArgumentParser) -> None:
+        sub.add_argument("--format", choices=OUTPUT_FORMATS, default="json", help="Output format (default json)")
+
+    def batch_input(sub: argparse.ArgumentParser) -> None:
+        sub.add_argument("--input", choices=INPUT_FORMATS, default="auto",
+                         help="Format of records on stdin: a JSON list, JSON lines or CSV with column headers")
+
+    sub = commands.add_parser("list", help="Stream records to stdout")
+    resource(sub)
+    output(sub)
+    sub.add_argument("--fields", help="Comma separated columns (default all)")
+    sub.add_argument("--where", action="append", default=[], metavar="NAME=VALUE",
+                     help="Filter, e.g. category=... or acquisition_date_from=2024-01-01")
+    sub.add_argument("--search", help="Full text search (assets only)")
+    sub.add_argument("--sort", help="Sort column (default id)")
+    sub.add_argument("--desc", action="store_true", help="Sort in descending order")
+    sub.add_argument("--limit", type=int, help="Stop after this many records")
+
+    sub = commands.add_parser("get", help="Print records by id")
+    resource(sub)
+    sub.add_argument("ids", type=int, nargs="+", metavar="ID")
+    output(sub)
+    sub.add_argument("--fields", help="Comma separated columns (default all)")
+
+    sub = commands.add_parser("add", help="Create one record from --set options or many from stdin")
+    resource(sub)
+    sub.add_argument("--set", action="append", default=[], metavar="NAME=VALUE")
+    batch_input(sub)
+
+    sub = commands.add_parser("update", help="Change one record with --set options, or many from stdin records with an id")
+    resource(sub)
+    sub.add_argument("id", type=int, nargs="?", metavar="ID")
+    sub.add_argument("--set", action="append", default=[], metavar="NAME=VALUE")
+    batch_input(sub)
+
+    sub = commands.add_parser("delete", help="Delete records by id; - reads ids or JSON lines from stdin")
+    resource(sub)
+    sub.add_argument("ids", nargs="+", metavar="ID")
+
+    sub = commands.add_parser("import", help="Import assets from an Excel/CSV export")
+    sub.add_argument("file")
+    sub.add_argument("--upsert", action="store_true", help="Update assets whose code and sub code already exist")
+
+    sub = commands.add_parser("export", help="Export every asset")
+    sub.add_argument("format", choices=exports.EXTENSIONS)
+    sub.add_argument("-o", "--output", help="Output file, - for stdout (default assets.<extension>)")
+    sub.add_argument("--group-by", choices=exports.GROUP_COLUMNS, help="Split a word export by this column")
+
+    sub = commands.add_parser("stats", help="Print the summary totals")
+    output(sub)
+
+    sub = commands.add_parser("changes", help="Print logged writes after a sequence number, oldest first")
+    sub.add_argument("resource", choices=RESOURCES, nargs="?", help="Only changes to assets or items")
+    sub.add_argument("--since", type=int, default=0, metavar="SEQ",
+                     help="Last sequence number already processed (default 0)")
+    sub.add_argument("--limit", type=int, help="Stop after this many changes")
+    output(sub)
+
+    sub = commands.add_parser("labels", help="Print label sheets (A4, 24 per page) for assets as a PDF")
+    sub.add_argument("-o", "--output", default="labels.pdf", help="Output file, - for stdout (default labels.pdf)")
+    # Checked by labels.write_labels; importing labels here would load fpdf for every command.
+    sub.add_argument("--kind", help="barcode for Code 39 (default), or qr (needs the qrcode package)")
+    sub.add_argument("--where", action="append", default=[], metavar="NAME=VALUE",
+                     help="Only assets matching a filter, e.g. category=... or unit=...")
+    sub.add_argument("--workers", type=int, help="Processes encoding the symbols (default one per CPU for QR codes)")
+
+    sub = commands.add_parser("scan", help="Print the assets whose label or serial number is each code, as JSON lines")
+    sub.add_argument("codes", nargs="*", metavar="CODE", help="Codes to look up (default one per line from stdin)")
+
+    sub = commands.add_parser("stocktake", help="Record stocktake counts and report how they differ from the register")
+    sub.add_argument("action", choices=("new", "list", "count", "report"),
+                     help="new NAME; list; count ID [FILE ...] (CSV or one code per line, default stdin); report ID")
+    sub.add_argument("args", nargs="*", metavar="ARG")
+    sub.add_argument("--status", help=f"Report lines with these comma separated statuses "
+                                      f"(default {','.join(stocktake.VARIANCES)})")
+    sub.add_argument("--summary", action="store_true", help="Report totals per kind, category and location instead")
+    output(sub)
+
+    sub = commands.add_parser("valuation", help="Print each asset's cost, depreciation and book value at a month end")
+    sub.add_argument("--period", metavar="YYYY-MM", help="Value at the end of this month (default the current one)")
+    sub.add_argument("--method", choices=valuation.METHODS, default=valuation.DEFAULT_METHOD,
+                     help=f"Depreciation method (default {valuation.DEFAULT_METHOD})")
+    sub.add_argument("--where", action="append", default=[], metavar="NAME=VALUE",
+                     help="Only assets matching a filter, e.g. category=... or unit=...")
+    sub.add_argument("--summary", action="store_true", help="Print totals per category instead")
+    output(sub)
+
+
+def run_command(args) -> None:
+    """Run one subcommand; batches of writes share one transaction."""
+    with database.get_session() as session:
+        authorize(session, args.token, args.user)
+        try:
+            COMMANDS[args.command](session, args)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader (e.g. ``head``) stopped early; that is not an error.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Simple inventory CLI program")
     parser.add_argument("--initdb", action="store_true", help="Initialize the database and exit")
+    parser.add_argument("--import", dest="import_path", metavar="FILE", help="Import assets from an Excel/CSV export and exit")
+    parser.add_argument("--migrate", action="store_true", help="Apply pending schema migrations and exit")
+    parser.add_argument("--check-queries", action="store_true", help="Report common queries that need a full table scan and exit")
+    parser.add_argument("--rebuild-summaries", action="store_true", help="Recompute the summary tables from scratch and exit")
+    parser.add_argument("--stock-snapshot", action="store_true", help="Record current stock levels for point-in-time queries and exit")
+    parser.add_argument("--stock-at", metavar="DATETIME", help="Print inventory quantities at an ISO date and time and exit")
+    parser.add_argument("--compact-changes", action="store_true", help="Compact and prune old change log entries and exit")
+    parser.add_argument("--upsert", action="store_true", help="With --import, update assets whose code and sub code already exist")
+    add_subcommands(parser)
     args = parser.parse_args()
 
-    engine = create_engine("sqlite:///inventory.db")
     if args.initdb:
-        init_db(engine)
+        database.ensure_schema(force=True)
+        return
+    if args.migrate:
+        applied = migrations.migrate(database.get_engine())
+        for migration in applied:
+            print(f"Applied {migration.version}: {migration.description}")
+        print(f"Schema is at version {migrations.LATEST_VERSION}")
         return
 
-    init_db(engine)
-    SessionLocal = sessionmaker(bind=engine)
-    with SessionLocal() as session:
+    database.ensure_schema()
+    if args.check_queries:
+        with database.get_session() as session:
+            problems = querycheck.check(session)
+        for name, tables in problems:
+            print(f"Full scan of {', '.join(tables)}: {name}")
+        print("No full scans found" if not problems else f"{len(problems)} queries scan whole tables")
+        return
+    if args.stock_snapshot:
+        with database.get_session() as session:
+            print(f"Snapshot {stock.take_snapshot(session)} taken")
+        return
+    if args.stock_at:
+        stock_report(args.stock_at)
+        return
+    if args.rebuild_summaries:
+        with database.get_engine().begin() as connection:
+            summary.rebuild(connection)
+        print("Summaries rebuilt")
+        return
+    if args.compact_changes:
+        with database.get_session() as session:
+            result = audit.compact(session)
+        print(f"Compacted {result.compacted} and pruned {result.pruned} change log entries")
+        return
+    if args.command:
+        run_command(args)
+        return
+    with database.get_session() as session:
         if not login(session):
             return
+        if args.import_path:
+            import_assets(session, args.import_path, args.upsert)
+            return
         while True:
             print(
-                "\n1. List assets\n2. Add asset\n3. Delete asset\n4. Export assets\n5. Quit"
+                "\n1. List assets\n2. Search assets\n3. Add asset\n4. Delete asset"
+                "\n5. Export assets\n6. Summary report\n7. Quit"
             )
             choice = input("Select: ")
             if choice == "1":
                 list_assets(session)
             elif choice == "2":
-                add_asset(session)
+                search_assets(session)
             elif choice == "3":
-                delete_asset(session)
+                add_asset(session)
             elif choice == "4":
-                export_assets(session)
+                delete_asset(session)
             elif choice == "5":
+                export_assets(session)
+            elif choice == "6":
+                summary_report(session)
+            elif choice == "7":
                 break
 
 
@@ -1,22 +1,37 @@
+import argparse
+import os
+import queue
+import threading
 import tkinter as tk
+from collections import OrderedDict
+from types import SimpleNamespace
 from tkinter import messagebox, ttk
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import func, select
 
-from models import Asset, User, init_db
+import audit
+import auth
+import database
+import offline
+import repository
+import scan
+import search
+from models import Asset
 
 
 def get_session():
-    engine = create_engine('sqlite:///inventory.db')
-    init_db(engine)
-    SessionLocal = sessionmaker(bind=engine)
-    return SessionLocal()
+    database.ensure_schema()
+    return database.get_session()
+
+
+# Edits made in cached mode wait here until they reach the database.
+JOURNAL_PATH = os.path.join(database.BASE_DIR, 'instance', 'offline-queue.json')
 
 
 class LoginWindow:
-    def __init__(self, session):
+    def __init__(self, session, cached=False):
         self.session = session
+        self.cached = cached
         self.root = tk.Tk()
         self.root.title('Login')
         tk.Label(self.root, text='Username').grid(row=0, column=0, padx=5, pady=5)
@@ -30,11 +45,19 @@ class LoginWindow:
     def attempt_login(self):
         username = self.username_var.get()
         password = self.password_var.get()
-        user = self.session.query(User).filter_by(username=username).first()
-        if user and user.check_password(password):
+        try:
+            user = auth.authenticate(self.session, username, password)
+        except auth.Throttled as exc:
+            messagebox.showerror('Error', str(exc))
+            return
+        if user:
+            audit.set_process_user(user.username)
             self.root.destroy()
             main_root = tk.Tk()
-            InventoryGUI(main_root, self.session)
+            if self.cached:
+                CachedInventoryGUI(main_root, self.session)
+            else:
+                InventoryGUI(main_root, self.session)
             main_root.mainloop()
         else:
             messagebox.showerror('Error', 'Invalid credentials')
@@ -43,13 +66,505 @@ class LoginWindow:
         self.root.mainloop()
 
 
+class QueryWorker:
+    """Run database calls on a background thread.
+
+    Each job gets its own session; results are handed back to the Tk thread
+    by polling with ``after`` so widgets are only ever touched from there.
+    Without a ``session_factory`` jobs get ``None`` and never touch the
+    database, for work on the local cache.
+    """
+
+    POLL_MS = 30
+
+    def __init__(self, root, session_factory):
+        self.root = root
+        self.session_factory = session_factory
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._connection = None
+        threading.Thread(target=self._run, daemon=True).start()
+        self.root.after(self.POLL_MS, self._poll)
+
+    def submit(self, func, callback, errback=None):
+        self._jobs.put((func, callback, errback))
+
+    def interrupt(self):
+        """Abort the SQL statement the current job is running, if any."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.interrupt()
+
+    def _run(self):
+        while True:
+            func, callback, errback = self._jobs.get()
+            if self.session_factory is None:
+                try:
+                    self._results.put((callback, func(None)))
+                except Exception as exc:  # handed to the Tk thread
+                    self._results.put((errback, exc))
+                continue
+            try:
+                with self.session_factory() as session:
+                    with self._lock:
+                        self._connection = session.connection().connection.dbapi_connection
+                    try:
+                        result = func(session)
+                    finally:
+                        with self._lock:
+                            self._connection = None
+            except Exception as exc:  # handed to the Tk thread
+                self._results.put((errback, exc))
+            else:
+                self._results.put((callback, result))
+
+    def _poll(self):
+        try:
+            while True:
+                callback, result = self._results.get_nowait()
+                if isinstance(result, Exception):
+                    if callback is None:
+                        messagebox.showerror('Error', str(result))
+                    else:
+                        callback(result)
+                else:
+                    callback(result)
+        except queue.Empty:
+            pass
+        self.root.after(self.POLL_MS, self._poll)
+
+
+class LiveSearch:
+    """Search as the user types without blocking the Tk thread.
+
+    Keystrokes are debounced, each query runs on its own worker and a query
+    made stale by newer input is interrupted. When the new text only extends
+    the previous one, the previous complete result set is filtered in memory
+    instead of asking the database again.
+    """
+
+    DEBOUNCE_MS = 250
+    # Result sets larger than this are not kept for in-memory refinement.
+    MAX_CACHED = 20000
+    FETCH_CHUNK = 900
+
+    def __init__(self, root, worker, on_results):
+        self.root = root
+        self.worker = worker
+        self.on_results = on_results
+        self._after_id = None
+        self._generation = 0
+        self._cached_text = None
+        self._cached_rows = None
+
+    def schedule(self, text):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+        self._after_id = self.root.after(self.DEBOUNCE_MS, lambda: self.run(text))
+
+    def run(self, text):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        self._generation += 1
+        generation = self._generation
+        text = text.strip()
+        if not text:
+            self.worker.interrupt()
+            self.on_results(None)
+            return
+        if self._cached_rows is not None and text.casefold().startswith(self._cached_text.casefold()):
+            terms = [term.casefold() for term in text.split()]
+            rows = [row for row in self._cached_rows if all(term in row[1] for term in terms)]
+            self._cached_text, self._cached_rows = text, rows
+            self.on_results([row[0] for row in rows])
+            return
+        self.worker.interrupt()
+        self.worker.submit(
+            lambda session: self._query(session, generation, text),
+            lambda result: self._finished(generation, text, result),
+            lambda error: self._failed(generation, error),
+        )
+
+    def invalidate(self):
+        """Forget cached results, e.g. after an asset was edited."""
+        self._cached_text = self._cached_rows = None
+
+    def _query(self, session, generation, text):
+        if generation != self._generation:
+            return None
+        ids = search.search_ids(session, Asset, text, limit=self.MAX_CACHED + 1)
+        if len(ids) > self.MAX_CACHED:
+            return ids, None
+        haystacks = {}
+        columns = [getattr(Asset, name) for name in search.FTS_COLUMNS]
+        for start in range(0, len(ids), self.FETCH_CHUNK):
+            if generation != self._generation:
+                return None
+            chunk = ids[start:start + self.FETCH_CHUNK]
+            for row in session.execute(select(Asset.id, *columns).where(Asset.id.in_(chunk))):
+                haystacks[row[0]] = '\n'.join(value for value in row[1:] if value).casefold()
+        return ids, [(i, haystacks.get(i, '')) for i in ids]
+
+    def _finished(self, generation, text, result):
+        if generation != self._generation or result is None:
+            return
+        ids, rows = result
+        self._cached_text, self._cached_rows = (text, rows) if rows is not None else (None, None)
+        self.on_results(ids)
+
+    def _failed(self, generation, error):
+        # An interrupted query was superseded on purpose; only report real failures.
+        if generation == self._generation:
+            messagebox.showerror('Error', str(error))
+
+
+class CachedSearch(LiveSearch):
+    """``LiveSearch`` over the codes and names in the local cache."""
+
+    def __init__(self, root, worker, on_results, assets):
+        super().__init__(root, worker, on_results)
+        self.assets = assets
+
+    def _query(self, session, generation, text):
+        if generation != self._generation:
+            return None
+        # The whole cache is scanned anyway, so keep nothing for refinement.
+        return self.assets.search(text), None
+
+
+ROW_COLUMNS = (Asset.id, Asset.asset_code, Asset.name, Asset.quantity)
+
+
+class AllAssets:
+    """Every asset in id order, fetched a block at a time."""
+
+    def count(self, session):
+        return session.scalar(select(func.count()).select_from(Asset))
+
+    def fetch(self, session, start, size, after_id=None):
+        stmt = select(*ROW_COLUMNS).order_by(Asset.id).limit(size)
+        # Continue from the previous block's last id when it is known so the
+        # query seeks straight to the block instead of skipping an OFFSET.
+        stmt = stmt.where(Asset.id > after_id) if after_id is not None else stmt.offset(start)
+        return [tuple(row) for row in session.execute(stmt)]
+
+
+class AssetIds:
+    """A fixed list of asset ids, such as search results, in display order."""
+
+    def __init__(self, ids):
+        self.ids = list(ids)
+
+    def count(self, session):
+        return len(self.ids)
+
+    def fetch(self, session, start, size, after_id=None):
+        ids = self.ids[start:start + size]
+        rows = {row[0]: tuple(row) for row in session.execute(select(*ROW_COLUMNS).where(Asset.id.in_(ids)))}
+        return [rows[i] for i in ids if i in rows]
+
+
+class CachedAssets:
+    """Every asset in the local cache, then the ones not yet saved."""
+
+    def __init__(self, assets):
+        self.assets = assets
+
+    def count(self, session):
+        return self.assets.count()
+
+    def fetch(self, session, start, size, after_id=None):
+        return self.assets.fetch(start, size)
+
+
+class CachedIds(AssetIds):
+    """Search results read from the local cache."""
+
+    def __init__(self, assets, ids):
+        super().__init__(ids)
+        self.assets = assets
+
+    def fetch(self, session, start, size, after_id=None):
+        rows = (self.assets.row(i) for i in self.ids[start:start + size])
+        return [row for row in rows if row is not None]
+
+
+class VirtualAssetView:
+    """A Treeview that only holds the rows currently on screen.
+
+    Rows are loaded in blocks around the visible window on a worker thread,
+    so scrolling through a large register never inserts more than a screenful
+    of items into Tk.
+    """
+
+    BLOCK_SIZE = 100
+    PREFETCH_BLOCKS = 1
+    MAX_BLOCKS = 50
+    # Pixels per row, set on the tree's own style so the rows that fit in
+    # the window can be worked out from its height.
+    ROW_HEIGHT = 20
+    STYLE = 'Assets.Treeview'
+
+    def __init__(self, master, worker, columns):
+        self.worker = worker
+        self.columns = columns
+        self.source = AllAssets()
+        self.total = 0
+        self.top = 0
+        self.visible = 1
+        self.blocks = OrderedDict()
+        self.pending = set()
+        self.generation = 0
+
+        frame = tk.Frame(master)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        ttk.Style(master).configure(self.STYLE, rowheight=self.ROW_HEIGHT)
+        self.tree = ttk.Treeview(frame, columns=columns, show='headings', selectmode='browse', style=self.STYLE)
+        for col in columns:
+            self.tree.heading(col, text=col)
+        self.scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.tree.bind('<Configure>', self._on_resize)
+        self.tree.bind('<MouseWheel>', lambda e: self.scroll_by(-1 if e.delta > 0 else 1, 'units'))
+        self.tree.bind('<Button-4>', lambda e: self.scroll_by(-1, 'units'))
+        self.tree.bind('<Button-5>', lambda e: self.scroll_by(1, 'units'))
+        self.tree.bind('<Prior>', lambda e: self.scroll_by(-1, 'pages'))
+        self.tree.bind('<Next>', lambda e: self.scroll_by(1, 'pages'))
+
+    def set_source(self, source):
+        """Show ``source`` from the top, dropping everything cached for the old one."""
+        self.source = source
+        self.generation += 1
+        self.blocks.clear()
+        self.pending.clear()
+        self.top = 0
+        generation = self.generation
+        self.worker.submit(source.count, lambda total: self._on_count(generation, total))
+
+    def reload(self):
+        self.set_source(self.source)
+
+    def refresh(self):
+        """Load the rows again, keeping the scroll position."""
+        self.generation += 1
+        self.blocks.clear()
+        self.pending.clear()
+        generation, top = self.generation, self.top
+        self.worker.submit(self.source.count, lambda total: self._on_count(generation, total, top))
+
+    def selected_id(self):
+        selected = self.tree.selection()
+        if not selected:
+            return None
+        values = self.tree.item(selected[0])['values']
+        return values[0] if values and values[0] != '' else None
+
+    def scroll_by(self, amount, what):
+        step = self.visible if what == 'pages' else 3
+        self.scroll_to(self.top + int(amount) * step)
+        return 'break'
+
+    def scroll_to(self, top):
+        self.top = max(0, min(int(top), max(0, self.total - self.visible)))
+        self._render()
+
+    def update_row(self, asset_id):
+        """Refresh one asset's cached row and on-screen item after an edit."""
+        generation = self.generation
+
+        def load(session):
+            row = session.execute(select(*ROW_COLUMNS).where(Asset.id == asset_id)).first()
+            return tuple(row) if row else None
+
+        def apply(row):
+            if generation != self.generation or row is None:
+                return
+            for rows in self.blocks.values():
+                for i, cached in enumerate(rows):
+                    if cached[0] == asset_id:
+                        rows[i] = row
+            for iid in self.tree.get_children():
+                if self.tree.item(iid)['values'][:1] == [asset_id]:
+                    self.tree.item(iid, values=row)
+
+        self.worker.submit(load, apply)
+
+    def row_added(self, asset_id):
+        if isinstance(self.source, AssetIds):
+            self.source.ids.append(asset_id)
+        self.total += 1
+        self._forget_from(self.total - 1)
+        self._render()
+
+    def row_deleted(self, asset_id):
+        position = self._position(asset_id)
+        if isinstance(self.source, AssetIds) and asset_id in self.source.ids:
+            self.source.ids.remove(asset_id)
+        self.total = max(0, self.total - 1)
+        self._forget_from(position if position is not None else 0)
+        self.scroll_to(self.top)
+
+    def _position(self, asset_id):
+        for index, rows in self.blocks.items():
+            for offset, row in enumerate(rows):
+                if row[0] == asset_id:
+                    return index * self.BLOCK_SIZE + offset
+        return None
+
+    def _forget_from(self, position):
+        first = position // self.BLOCK_SIZE
+        for index in [i for i in self.blocks if i >= first]:
+            del self.blocks[index]
+        self.generation += 1
+        self.pending.clear()
+
+    def _on_count(self, generation, total, top=0):
+        if generation != self.generation:
+            return
+        self.total = total
+        self.scroll_to(top)
+
+    def _on_resize(self, event):
+        visible = max(1, event.height // self.ROW_HEIGHT - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.scroll_to(self.top)
+
+    def _on_scrollbar(self, action, amount, what=None):
+        if action == 'moveto':
+            self.scroll_to(float(amount) * self.total)
+        else:
+            self.scroll_by(amount, what)
+
+    def _render(self):
+        items = self.tree.get_children()
+        wanted = min(self.visible, max(0, self.total - self.top))
+        for iid in items[wanted:]:
+            self.tree.delete(iid)
+        for _ in range(len(items), wanted):
+            self.tree.insert('', tk.END, values=('',) * len(self.columns))
+        missing = False
+        for offset, iid in enumerate(self.tree.get_children()):
+            row = self._cached_row(self.top + offset)
+            if row is None:
+                missing = True
+                row = ('',) + ('...',) * (len(self.columns) - 1)
+            self.tree.item(iid, values=row)
+        if self.total:
+            self.scrollbar.set(self.top / self.total, (self.top + wanted) / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+        self._prefetch(force=missing)
+
+    def _cached_row(self, position):
+        rows = self.blocks.get(position // self.BLOCK_SIZE)
+        if rows is None:
+            return None
+        offset = position % self.BLOCK_SIZE
+        return rows[offset] if offset < len(rows) else None
+
+    def _prefetch(self, force=False):
+        first = max(0, self.top // self.BLOCK_SIZE - self.PREFETCH_BLOCKS)
+        last = (self.top + self.visible) // self.BLOCK_SIZE + self.PREFETCH_BLOCKS
+        last = min(last, max(0, (self.total - 1) // self.BLOCK_SIZE))
+        for index in range(first, last + 1):
+            if index in self.blocks:
+                self.blocks.move_to_end(index)
+            elif index not in self.pending:
+                self._load_block(index)
+
+    def _load_block(self, index):
+        self.pending.add(index)
+        generation = self.generation
+        previous = self.blocks.get(index - 1)
+        after_id = previous[-1][0] if previous and len(previous) == self.BLOCK_SIZE else None
+        source = self.source
+        start = index * self.BLOCK_SIZE
+
+        def loaded(rows):
+            if generation != self.generation:
+                return
+            self.pending.discard(index)
+            self.blocks[index] = rows
+            while len(self.blocks) > self.MAX_BLOCKS:
+                self.blocks.popitem(last=False)
+            first = self.top // self.BLOCK_SIZE
+            if first <= index <= (self.top + self.visible) // self.BLOCK_SIZE:
+                self._render()
+
+        self.worker.submit(lambda session: source.fetch(session, start, self.BLOCK_SIZE, after_id), loaded)
+
+
+class ScanWindow:
+    """Look assets up by label, one scan after another.
+
+    A barcode scanner types the code and presses Enter. The entry is
+    cleared at once and the code resolved on a worker through a
+    ``scan.ScanIndex``, so the next label can be scanned while the answer
+    for the last one arrives. Closing the window only hides it, keeping the
+    history and the cache for the next round.
+    """
+
+    HISTORY = 200
+
+    def __init__(self, master, on_found):
+        self.on_found = on_found
+        self.index = scan.ScanIndex()
+        self.worker = QueryWorker(master, database.get_sessionmaker())
+        self.window = tk.Toplevel(master)
+        self.window.title('Scan')
+        self.window.protocol('WM_DELETE_WINDOW', self.window.withdraw)
+        self.code_var = tk.StringVar()
+        self.entry = tk.Entry(self.window, textvariable=self.code_var, width=40)
+        self.entry.pack(fill=tk.X, padx=10, pady=5)
+        self.entry.bind('<Return>', lambda event: self.lookup())
+        self.result_var = tk.StringVar(value='Scan a label or type a code and press Enter')
+        tk.Label(self.window, textvariable=self.result_var, anchor=tk.W).pack(fill=tk.X, padx=10)
+        self.history = tk.Listbox(self.window, height=12)
+        self.history.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.entry.focus_set()
+
+    def show(self):
+        self.window.deiconify()
+        self.window.lift()
+        self.entry.focus_set()
+
+    def lookup(self):
+        code = self.code_var.get().strip()
+        self.code_var.set('')
+        if code:
+            self.worker.submit(lambda session: self.index.lookup(session, code), lambda matches: self._found(code, matches))
+
+    def _found(self, code, matches):
+        if not matches:
+            self.window.bell()
+            text = f'{code}: not found'
+        elif len(matches) == 1:
+            match = matches[0]
+            text = f'{code}: {match.name} (id {match.id}, quantity {match.quantity}, {match.unit or "no unit"})'
+        else:
+            text = f'{code}: {len(matches)} assets'
+        self.result_var.set(text)
+        self.history.insert(0, text)
+        self.history.delete(self.HISTORY, tk.END)
+        if matches:
+            self.on_found([match.id for match in matches])
+
+
 class InventoryGUI:
     def __init__(self, root, session):
         self.root = root
         self.session = session
         self.root.title('Inventory Manager')
         self.search_var = tk.StringVar()
+        self.scan_window = None
+        self.worker = QueryWorker(root, database.get_sessionmaker())
+        self.live_search = LiveSearch(root, QueryWorker(root, database.get_sessionmaker()), self.show_results)
         self._build_ui()
+        self.search_var.trace_add('write', lambda *args: self.live_search.schedule(self.search_var.get()))
         self.refresh_assets()
 
     def _build_ui(self):
@@ -60,51 +575,145 @@ class InventoryGUI:
         tk.Button(search_frame, text='Go', command=self.refresh_assets).pack(side=tk.LEFT, padx=5)
 
         columns = ('id', 'asset_code', 'name', 'quantity')
-        self.tree = ttk.Treeview(self.root, columns=columns, show='headings')
-        for col in columns:
-            self.tree.heading(col, text=col)
-        self.tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.view = VirtualAssetView(self.root, self.worker, columns)
+        self.tree = self.view.tree
 
         btn_frame = tk.Frame(self.root)
         btn_frame.pack(fill=tk.X, padx=10, pady=5)
         tk.Button(btn_frame, text='Add', command=self.add_asset).pack(side=tk.LEFT)
         tk.Button(btn_frame, text='Edit', command=self.edit_asset).pack(side=tk.LEFT, padx=5)
         tk.Button(btn_frame, text='Delete', command=self.delete_asset).pack(side=tk.LEFT)
+        tk.Button(btn_frame, text='Scan', command=self.scan_assets).pack(side=tk.LEFT, padx=5)
 
     def refresh_assets(self):
-        for row in self.tree.get_children():
-            self.tree.delete(row)
-        query = self.session.query(Asset)
-        search = self.search_var.get()
-        if search:
-            like = f"%{search}%"
-            query = query.filter(Asset.name.ilike(like) | Asset.asset_code.ilike(like))
-        for asset in query.all():
-            self.tree.insert('', tk.END, values=(asset.id, asset.asset_code, asset.name, asset.quantity))
+        self.live_search.run(self.search_var.get())
+
+    def show_results(self, ids):
+        self.view.set_source(AllAssets() if ids is None else AssetIds(ids))
+
+    def scan_assets(self):
+        """Open the scan window; each scanned asset is shown in the list."""
+        if self.scan_window is None:
+            self.scan_window = ScanWindow(self.root, self.show_results)
+        else:
+            self.scan_window.show()
+
+    def on_saved(self, asset_id, created):
+        self.live_search.invalidate()
+        if created:
+            self.view.row_added(asset_id)
+        else:
+            self.view.update_row(asset_id)
 
     def add_asset(self):
-        AssetForm(self.root, self.session, callback=self.refresh_assets)
+        AssetForm(self.root, self.session, callback=self.on_saved)
 
     def edit_asset(self):
-        selected = self.tree.selection()
-        if not selected:
+        asset_id = self.view.selected_id()
+        if asset_id is None:
             messagebox.showwarning('Select', 'Please select an asset')
             return
-        asset_id = self.tree.item(selected[0])['values'][0]
-        asset = self.session.get(Asset, asset_id)
-        AssetForm(self.root, self.session, asset, self.refresh_assets)
+        asset = repository.get_asset(self.session, asset_id)
+        AssetForm(self.root, self.session, asset, self.on_saved)
 
     def delete_asset(self):
-        selected = self.tree.selection()
-        if not selected:
+        asset_id = self.view.selected_id()
+        if asset_id is None:
             messagebox.showwarning('Select', 'Please select an asset')
             return
-        asset_id = self.tree.item(selected[0])['values'][0]
-        asset = self.session.get(Asset, asset_id)
+        asset = repository.get_asset(self.session, asset_id)
         if messagebox.askyesno('Delete', f'Delete {asset.name}?'):
-            self.session.delete(asset)
-            self.session.commit()
-            self.refresh_assets()
+            repository.delete_asset(self.session, asset)
+            self.live_search.invalidate()
+            self.view.row_deleted(asset_id)
+
+
+class CachedInventoryGUI(InventoryGUI):
+    """The inventory window working on a local copy of the asset list.
+
+    For databases on slow network shares: lists and searches are answered
+    from memory and edits are written in the background by
+    ``offline.SyncThread``, so the window never waits for the database.
+    """
+
+    def __init__(self, root, session):
+        self.root = root
+        self.session = session
+        self.root.title('Inventory Manager (cached)')
+        self.search_var = tk.StringVar()
+        self.scan_window = None
+        self.status_var = tk.StringVar(value='Loading...')
+        self._status = 'Loading...'
+        self.assets = offline.OfflineAssets(JOURNAL_PATH)
+        self.worker = QueryWorker(root, None)
+        self.live_search = CachedSearch(root, QueryWorker(root, None), self.show_results, self.assets)
+        self._events = queue.Queue()
+        self.sync = offline.SyncThread(self.assets, database.get_sessionmaker(), lambda *event: self._events.put(event))
+        self._build_ui()
+        tk.Label(self.root, textvariable=self.status_var, anchor=tk.W).pack(fill=tk.X, padx=10, pady=(0, 5))
+        self.search_var.trace_add('write', lambda *args: self.live_search.schedule(self.search_var.get()))
+        self.sync.start()
+        self.root.after(QueryWorker.POLL_MS, self._poll_events)
+
+    def show_results(self, ids):
+        self.view.set_source(CachedAssets(self.assets) if ids is None else CachedIds(self.assets, ids))
+
+    def on_saved(self, asset_id, created):
+        self.sync.changed()
+        self.live_search.invalidate()
+        self.view.refresh()
+        self._show_pending()
+
+    def add_asset(self):
+        CachedAssetForm(self.root, self.assets, callback=self.on_saved)
+
+    def edit_asset(self):
+        row = self._selected_row()
+        if row is not None:
+            asset = SimpleNamespace(id=row[0], asset_code=row[1], name=row[2], quantity=row[3])
+            CachedAssetForm(self.root, self.assets, asset, self.on_saved)
+
+    def delete_asset(self):
+        row = self._selected_row()
+        if row is not None and messagebox.askyesno('Delete', f'Delete {row[2]}?'):
+            self.assets.delete(row[0])
+            self.on_saved(row[0], False)
+
+    def _selected_row(self):
+        asset_id = self.view.selected_id()
+        row = self.assets.row(asset_id) if asset_id is not None else None
+        if row is None:
+            messagebox.showwarning('Select', 'Please select an asset')
+        return row
+
+    def _show_pending(self, status=None):
+        if status is not None:
+            self._status = status
+        pending = self.assets.pending_count
+        self.status_var.set(f'{self._status}, {pending} changes not saved yet' if pending else self._status)
+
+    def _poll_events(self):
+        try:
+            while True:
+                kind, payload = self._events.get_nowait()
+                if kind == 'loaded':
+                    self.refresh_assets()
+                elif kind == 'changed':
+                    self.live_search.invalidate()
+                    self.view.refresh()
+                elif kind == 'conflicts':
+                    names = ', '.join(str(row_id) for row_id, _ in payload)
+                    messagebox.showwarning(
+                        'Changed elsewhere',
+                        f'Assets {names} were changed or deleted by someone else; your edits to them were discarded.',
+                    )
+                elif kind == 'status':
+                    self._show_pending(payload)
+                    continue
+                self._show_pending()
+        except queue.Empty:
+            pass
+        self.root.after(QueryWorker.POLL_MS, self._poll_events)
 
 
 class AssetForm:
@@ -136,21 +745,39 @@ class AssetForm:
         if not code or not name:
             messagebox.showerror('Error', 'Code and Name required')
             return
-        if self.asset:
-            self.asset.asset_code = code
-            self.asset.name = name
-            self.asset.quantity = qty
-        else:
-            self.session.add(Asset(asset_code=code, name=name, quantity=qty))
-        self.session.commit()
+        asset_id = self.write(asset_code=code, name=name, quantity=qty)
         if self.callback:
-            self.callback()
+            self.callback(asset_id, self.asset is None)
         self.window.destroy()
 
+    def write(self, **fields):
+        if self.asset:
+            return repository.update_asset(self.session, self.asset, **fields).id
+        return repository.create_asset(self.session, **fields).id
+
+
+class CachedAssetForm(AssetForm):
+    """Queue the edit instead of waiting for the database."""
+
+    def __init__(self, master, assets, asset=None, callback=None):
+        self.assets = assets
+        super().__init__(master, None, asset, callback)
+
+    def write(self, **fields):
+        if self.asset:
+            self.assets.update(self.asset.id, **fields)
+            return self.asset.id
+        return self.assets.create(**fields)
+
 
 def main():
+    parser = argparse.ArgumentParser(description='Inventory desktop program')
+    parser.add_argument('--cached', action='store_true',
+                        help='keep a local copy of the asset list and save in the background, '
+                             'for databases on slow network shares')
+    args = parser.parse_args()
     session = get_session()
-    login = LoginWindow(session)
+    login = LoginWindow(session, cached=args.cached)
     login.run()
 
 
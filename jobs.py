@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 60 * 60
+# Rows between progress updates written for other worker processes.
+PROGRESS_EVERY = 1000
+# A progress file not touched for this long belongs to a worker that died.
+STALE_SECONDS = 120
+# How often a running job touches its progress file, whether or not rows
+# are moving, so a long final save does not look like a dead worker.
+HEARTBEAT_SECONDS = STALE_SECONDS / 4
+# Files beside the artifacts: partly written ones and job state.
+MARKER_SUFFIXES = ('.part', '.progress', '.error')
+
+
+@dataclass
+class ExportJob:
+    # The artifact's file name, so every worker process can find the job.
+    id: str
+    fmt: str
+    status: str = 'queued'
+    done: int = 0
+    total: int = 0
+    path: Optional[str] = None
+    error: Optional[str] = None
+    cached: bool = False
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    progress_path: Optional[str] = None
+
+    @property
+    def percent(self) -> int:
+        if self.status == 'done':
+            return 100
+        if not self.total:
+            return 0
+        return min(99, int(self.done * 100 / self.total))
+
+    def track(self, rows: Iterable) -> Iterator:
+        """Pass rows through while counting them for progress reporting."""
+        for row in rows:
+            self.done += 1
+            if self.done % PROGRESS_EVERY == 0:
+                self.save_progress()
+            yield row
+
+    def save_progress(self) -> None:
+        if self.progress_path is None:
+            return
+        with open(self.progress_path, 'w', encoding='ascii') as handle:
+            handle.write(f'{self.done} {self.total}')
+
+    def as_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'format': self.fmt,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'percent': self.percent,
+            'cached': self.cached,
+            'error': self.error,
+        }
+
+
+class ExportJobQueue:
+    """Run exports on a small thread pool and cache the files they produce.
+
+    Artifacts are stored as ``<cache_dir>/<key>.<ext>`` where the key combines
+    the export format with the version of the data it was built from, so a
+    repeat request for unchanged data is answered from disk immediately.
+
+    The artifact name doubles as the job id. A running job keeps its progress
+    in ``<id>.progress`` and a failed one leaves ``<id>.error``, so with
+    several server processes any of them can report on a job, and only one
+    builds each artifact.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_workers: int = 2,
+        max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+        max_age: float = DEFAULT_MAX_AGE,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.max_age = max_age
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export')
+        self._jobs: Dict[str, ExportJob] = {}
+        self._running: Dict[str, ExportJob] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def artifact_key(fmt: str, version: int, variant: str = '') -> str:
+        return f'{fmt}-{variant}-v{version}' if variant else f'{fmt}-v{version}'
+
+    def artifact_path(self, key: str, extension: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.{extension}')
+
+    def lookup(self, key: str, extension: str) -> Optional[str]:
+        """The cached artifact for ``key``, if any, marked as recently used."""
+        path = self.artifact_path(key, extension)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def _part_path(self) -> str:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+        os.close(fd)
+        return tmp_path
+
+    def tee(self, key: str, extension: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass streamed ``chunks`` through, caching them once the stream completes.
+
+        A client that disconnects early leaves nothing behind.
+        """
+        tmp_path = self._part_path()
+        try:
+            with open(tmp_path, 'wb') as handle:
+                for chunk in chunks:
+                    handle.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, self.artifact_path(key, extension))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    def submit(
+        self,
+        fmt: str,
+        version: int,
+        extension: str,
+        work: Callable[[ExportJob, str], None],
+        variant: str = '',
+    ) -> ExportJob:
+        """Queue ``work(job, path)`` unless an artifact for this version exists.
+
+        ``variant`` distinguishes differently laid out exports of one format.
+        """
+        path = self.artifact_path(self.artifact_key(fmt, version, variant), extension)
+        job_id = os.path.basename(path)
+        with self._lock:
+            self._forget_old_jobs()
+            running = self._running.get(job_id)
+            if running is not None:
+                return running
+            if os.path.exists(path):
+                os.utime(path)
+                job = ExportJob(id=job_id, fmt=fmt, status='done', path=path, cached=True, finished=time.time())
+                self._jobs[job_id] = job
+                return job
+            if not self._claim(job_id):
+                # Another server process is already building it.
+                return self._stored_job(job_id) or ExportJob(id=job_id, fmt=fmt, status='running')
+            job = ExportJob(id=job_id, fmt=fmt, progress_path=self._marker(job_id, 'progress'))
+            self._jobs[job_id] = job
+            self._running[job_id] = job
+        self._executor.submit(self._run, job, path, work)
+        return job
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        if os.path.basename(job_id) != job_id or job_id.startswith('.'):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and (job.status != 'done' or os.path.exists(job.path)):
+            return job
+        return self._stored_job(job_id)
+
+    def _marker(self, job_id: str, kind: str) -> str:
+        return os.path.join(self.cache_dir, f'{job_id}.{kind}')
+
+    def _claim(self, job_id: str) -> bool:
+        """Create the job's progress file, unless a live process holds it."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        progress = self._marker(job_id, 'progress')
+        for _ in range(2):
+            try:
+                fd = os.open(progress, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(progress) < STALE_SECONDS:
+                        return False
+                    os.remove(progress)
+                except FileNotFoundError:
+                    pass
+                continue
+            os.close(fd)
+            error = self._marker(job_id, 'error')
+            if os.path.exists(error):
+                os.remove(error)
+            return True
+        return False
+
+    def _stored_job(self, job_id: str) -> Optional[ExportJob]:
+        """Rebuild a job's state from the files another process left."""
+        fmt = job_id.split('-', 1)[0]
+        path = os.path.join(self.cache_dir, job_id)
+        if os.path.exists(path):
+            return ExportJob(id=job_id, fmt=fmt, status='done', path=path, cached=True)
+        try:
+            with open(self._marker(job_id, 'error'), encoding='utf-8') as handle:
+                return ExportJob(id=job_id, fmt=fmt, status='failed', error=handle.read())
+        except FileNotFoundError:
+            pass
+        progress = self._marker(job_id, 'progress')
+        try:
+            with open(progress, encoding='ascii') as handle:
+                counts = handle.read().split()
+            if time.time() - os.path.getmtime(progress) >= STALE_SECONDS:
+                return None
+        except FileNotFoundError:
+            return None
+        done, total = (int(count) for count in counts) if len(counts) == 2 else (0, 0)
+        return ExportJob(id=job_id, fmt=fmt, status='running', done=done, total=total)
+
+    @staticmethod
+    def _heartbeat(progress_path: str, stop: threading.Event) -> None:
+        while not stop.wait(HEARTBEAT_SECONDS):
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(progress_path)
+
+    def _run(self, job: ExportJob, path: str, work: Callable[[ExportJob, str], None]) -> None:
+        tmp_path = self._part_path()
+        job.status = 'running'
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job.progress_path, stop), name=f'heartbeat-{job.id}', daemon=True
+        )
+        heartbeat.start()
+        try:
+            work(job, tmp_path)
+            os.replace(tmp_path, path)
+            job.path = path
+            job.status = 'done'
+        except Exception as exc:  # reported to the client through the job status
+            job.error = str(exc)
+            job.status = 'failed'
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with open(self._marker(job.id, 'error'), 'w', encoding='utf-8') as handle:
+                handle.write(job.error)
+        finally:
+            stop.set()
+            heartbeat.join()
+            job.finished = time.time()
+            if os.path.exists(job.progress_path):
+                os.remove(job.progress_path)
+            with self._lock:
+                self._running.pop(job.id, None)
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop artifacts older than ``max_age``, then the oldest until under ``max_cache_bytes``.
+
+        Markers and partial files only go once they are older than
+        ``max_age``, which live jobs and streams never are.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            # Other server processes may be evicting the same files.
+            with contextlib.suppress(FileNotFoundError):
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                expired = now - stat.st_mtime > self.max_age
+                if expired:
+                    os.remove(entry.path)
+                elif not entry.name.endswith(MARKER_SUFFIXES):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_cache_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+
+    def _forget_old_jobs(self) -> None:
+        cutoff = time.time() - self.max_age
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from fpdf import FPDF
+from fpdf.enums import RenderStyle
+from sqlalchemy import select
+
+from models import Asset
+from pdfreport import ELLIPSIS, find_font
+from scan import scan_code
+
+try:
+    import qrcode
+    from qrcode.constants import ERROR_CORRECT_M
+except ImportError:  # QR labels need the qrcode package; Code 39 labels do not
+    qrcode = None
+
+KINDS = ('barcode', 'qr')
+MIMETYPE = 'application/pdf'
+
+# 24 labels of 70 x 37 mm per portrait A4 sheet, the common office label stock.
+COLUMNS = 3
+ROWS = 8
+LABEL_WIDTH = 70.0
+LABEL_HEIGHT = 297.0 / ROWS
+PADDING = 3.0
+BAR_HEIGHT = 15.0
+# Narrowest and widest Code 39 module in mm; scanners need at least ~0.19 mm.
+MIN_MODULE = 0.19
+MAX_MODULE = 0.5
+FONT_SIZE = 10
+LINE_HEIGHT = 4.5
+# Any fixed mask gives a valid symbol; choosing the best of the eight, as
+# qrcode does by default, makes encoding several times slower.
+QR_MASK = 2
+
+# Labels encoded per task on the worker processes.
+ENCODE_CHUNK = 500
+
+# Code 39 patterns: bars and spaces alternate, starting with a bar; wide
+# elements are three modules, narrow ones one, and characters are
+# separated by a narrow space.
+CODE39 = {
+    '0': 'nnnwwnwnn', '1': 'wnnwnnnnw', '2': 'nnwwnnnnw', '3': 'wnwwnnnnn',
+    '4': 'nnnwwnnnw', '5': 'wnnwwnnnn', '6': 'nnwwwnnnn', '7': 'nnnwnnwnw',
+    '8': 'wnnwnnwnn', '9': 'nnwwnnwnn', 'A': 'wnnnnwnnw', 'B': 'nnwnnwnnw',
+    'C': 'wnwnnwnnn', 'D': 'nnnnwwnnw', 'E': 'wnnnwwnnn', 'F': 'nnwnwwnnn',
+    'G': 'nnnnnwwnw', 'H': 'wnnnnwwnn', 'I': 'nnwnnwwnn', 'J': 'nnnnwwwnn',
+    'K': 'wnnnnnnww', 'L': 'nnwnnnnww', 'M': 'wnwnnnnwn', 'N': 'nnnnwnnww',
+    'O': 'wnnnwnnwn', 'P': 'nnwnwnnwn', 'Q': 'nnnnnnwww', 'R': 'wnnnnnwwn',
+    'S': 'nnwnnnwwn', 'T': 'nnnnwnwwn', 'U': 'wwnnnnnnw', 'V': 'nwwnnnnnw',
+    'W': 'wwwnnnnnn', 'X': 'nwnnwnnnw', 'Y': 'wwnnwnnnn', 'Z': 'nwwnwnnnn',
+    '-': 'nwnnnnwnw', '.': 'wwnnnnwnn', ' ': 'nwwnnnwnn', '$': 'nwnwnwnnn',
+    '/': 'nwnwnnnwn', '+': 'nwnnnwnwn', '%': 'nnnwnwnwn', '*': 'nwnnwnwnn',
+}
+_WIDTHS = {'n': 1, 'w': 3}
+
+
+class LabelError(ValueError):
+    pass
+
+
+class Label(NamedTuple):
+    code: str
+    title: str
+
+
+class Art(NamedTuple):
+    """A symbol as filled rectangles ``(x, y, width, height)`` in modules."""
+
+    width: int
+    height: int
+    rects: Tuple[Tuple[int, int, int, int], ...]
+
+
+def iter_labels(session, criteria: Sequence = (), chunk_size: int = 1000) -> Iterator[Label]:
+    """One label per asset matching ``criteria``, in asset code order."""
+    stmt = (
+        select(Asset.asset_code, Asset.sub_code, Asset.name)
+        .where(*criteria)
+        .order_by(Asset.asset_code, Asset.sub_code, Asset.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for asset_code, sub_code, name in session.execute(stmt):
+        yield Label(scan_code(asset_code, sub_code), name or '')
+
+
+def code39(code: str) -> Art:
+    """The bars of ``code`` in Code 39, with start and stop characters."""
+    invalid = sorted({char for char in code if char not in CODE39 or char == '*'})
+    if invalid:
+        raise LabelError(f'{code!r} cannot be written in Code 39 (no {"".join(invalid)!r}); use QR labels')
+    rects = []
+    x = 0
+    for char in f'*{code}*':
+        for index, element in enumerate(CODE39[char]):
+            width = _WIDTHS[element]
+            if index % 2 == 0:
+                rects.append((x, 0, width, 1))
+            x += width
+        x += 1
+    return Art(x - 1, 1, tuple(rects))
+
+
+def qr(code: str) -> Art:
+    """The dark modules of ``code`` as a QR symbol, one rectangle per run in a row."""
+    if qrcode is None:
+        raise LabelError('QR labels need the qrcode package: pip install qrcode')
+    symbol = qrcode.QRCode(error_correction=ERROR_CORRECT_M, border=0, mask_pattern=QR_MASK)
+    symbol.add_data(code)
+    matrix = symbol.get_matrix()
+    # Runs of dark modules in a row, extended downwards while the rows
+    # below repeat them, so fewer rectangles have to be drawn.
+    rects = []
+    open_runs = {}
+    for y, row in enumerate(matrix):
+        runs = {}
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            index = open_runs.get((start, x))
+            if index is None:
+                index = len(rects)
+                rects.append([start, y, x - start, 0])
+            rects[index][3] += 1
+            runs[(start, x)] = index
+        open_runs = runs
+    return Art(len(matrix), len(matrix), tuple(map(tuple, rects)))
+
+
+ENCODERS = {'barcode': code39, 'qr': qr}
+
+
+def encode_all(kind: str, codes: Sequence[str]) -> List[Art]:
+    encoder = ENCODERS[kind]
+    return [encoder(code) for code in codes]
+
+
+class LabelSheet(FPDF):
+    """Sheets of asset labels, filled left to right and top to bottom."""
+
+    def __init__(self, font_path: str, kind: str = 'barcode'):
+        super().__init__(orientation='P', unit='mm', format='A4')
+        self.kind = kind
+        self.set_margins(0, 0, 0)
+        self.set_auto_page_break(False)
+        self.add_font('label', '', font_path)
+        self.set_font('label', size=FONT_SIZE)
+        self.set_fill_color(0)
+        self.left = (self.w - COLUMNS * LABEL_WIDTH) / 2
+        self.count = 0
+        self.char_width = lru_cache(maxsize=4096)(self.get_string_width)
+
+    def fit(self, text: str, width: float) -> Tuple[str, float]:
+        used = sum(map(self.char_width, text))
+        if used <= width:
+            return text, used
+        width -= self.char_width(ELLIPSIS)
+        used = 0.0
+        for end, char in enumerate(text):
+            used += self.char_width(char)
+            if used > width:
+                text = text[:end] + ELLIPSIS
+                break
+        return text, sum(map(self.char_width, text))
+
+    def _line(self, text: str, x: float, baseline: float, width: float, centred: bool = False) -> None:
+        text, used = self.fit(text, width)
+        self.text(x + (width - used) / 2 if centred else x, baseline, text)
+
+    def _draw(self, art: Art, x: float, y: float, module_width: float, module_height: float) -> None:
+        # A RenderStyle rather than 'F' saves fpdf2 parsing the style per bar.
+        for left, top, width, height in art.rects:
+            self.rect(x + left * module_width, y + top * module_height,
+                      width * module_width, height * module_height, style=RenderStyle.F)
+
+    def add_label(self, label: Label, art: Art) -> None:
+        position = self.count % (COLUMNS * ROWS)
+        if position == 0:
+            self.add_page()
+        self.count += 1
+        row, column = divmod(position, COLUMNS)
+        x = self.left + column * LABEL_WIDTH + PADDING
+        y = row * LABEL_HEIGHT + PADDING
+        width = LABEL_WIDTH - 2 * PADDING
+        height = LABEL_HEIGHT - 2 * PADDING
+        if self.kind == 'qr':
+            module = height / art.width
+            self._draw(art, x, y, module, module)
+            x += height + PADDING
+            width -= height + PADDING
+            self._line(label.title, x, y + LINE_HEIGHT, width)
+            self._line(label.code, x, y + height, width)
+            return
+        module = min(MAX_MODULE, width / art.width)
+        if module < MIN_MODULE:
+            raise LabelError(f'{label.code!r} is too long for a Code 39 label; use QR labels')
+        self._line(label.title, x, y + LINE_HEIGHT, width, centred=True)
+        self._draw(art, x + (width - art.width * module) / 2, y + LINE_HEIGHT + 1.5, module, BAR_HEIGHT)
+        self._line(label.code, x, y + height, width, centred=True)
+
+
+def _chunks(labels: Iterable[Label], size: int) -> Iterator[List[Label]]:
+    labels = iter(labels)
+    while True:
+        chunk = list(islice(labels, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def default_workers(kind: str) -> int:
+    # Code 39 bars take less time to work out than to send between processes.
+    return (os.cpu_count() or 1) if kind == 'qr' else 1
+
+
+def write_labels(
+    labels: Iterable[Label],
+    fileobj,
+    kind: str = 'barcode',
+    font_path: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> int:
+    """Lay out ``labels`` on A4 label sheets as a PDF in ``fileobj``; returns the label count.
+
+    Symbols are encoded on ``workers`` processes, ``ENCODE_CHUNK`` labels per
+    task, while this process places the finished ones on the pages in order;
+    with one worker everything happens in this process.
+    """
+    if kind not in KINDS:
+        raise LabelError(f'Unknown label kind {kind!r} (use one of: {", ".join(KINDS)})')
+    pdf = LabelSheet(font_path or find_font(), kind)
+    workers = default_workers(kind) if workers is None else workers
+    chunks = _chunks(labels, ENCODE_CHUNK)
+    if workers > 1:
+        # Spawned, not forked: the web server calls this from a thread.
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        encoded = _ordered(executor, kind, chunks, workers)
+    else:
+        executor = None
+        encoded = ((chunk, encode_all(kind, [label.code for label in chunk])) for chunk in chunks)
+    try:
+        for chunk, arts in encoded:
+            for label, art in zip(chunk, arts):
+                pdf.add_label(label, art)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    if pdf.page == 0:
+        pdf.add_page()
+    pdf.output(fileobj)
+    return pdf.count
+
+
+def _ordered(executor, kind: str, chunks: Iterator[List[Label]], workers: int):
+    """Encode chunks on ``executor``, keeping a few ahead of the caller, in order."""
+    pending = []
+    for chunk in chunks:
+        pending.append((chunk, executor.submit(encode_all, kind, [label.code for label in chunk])))
+        if len(pending) > 2 * workers:
+            chunk, future = pending.pop(0)
+            yield chunk, future.result()
+    for chunk, future in pending:
+        yield chunk, future.result()
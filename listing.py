@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import base64
+import json
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import Date, and_, or_, select
+
+from models import Asset, InventoryItem
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+@dataclass
+class ListingSpec:
+    """Describe which columns of a model can be sorted and filtered on."""
+
+    model: Any
+    sort_keys: Sequence[str]
+    filters: Sequence[str] = ()
+    date_range: Optional[str] = None
+    default_sort: str = 'id'
+
+    def column(self, name: str):
+        return getattr(self.model, name)
+
+
+@dataclass
+class Page:
+    rows: List[Any]
+    sort: str
+    direction: str
+    filters: Dict[str, str] = field(default_factory=dict)
+    next_cursor: Optional[str] = None
+    limit: int = DEFAULT_PAGE_SIZE
+
+
+def encode_cursor(value: Any, row_id: int) -> str:
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    return value, int(row_id)
+
+
+def _coerce(column, value: Any) -> Any:
+    if value is None:
+        return None
+    if isinstance(column.type, Date) and isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def _after(column, id_column, value: Any, row_id: int, descending: bool):
+    """Keyset predicate for rows that sort after ``(value, row_id)``.
+
+    SQLite orders NULL before every other value, so NULL sort keys come first
+    in ascending order and last in descending order.
+    """
+    if descending:
+        if value is None:
+            return and_(column.is_(None), id_column < row_id)
+        return or_(
+            column < value,
+            and_(column == value, id_column < row_id),
+            column.is_(None),
+        )
+    if value is None:
+        return or_(
+            and_(column.is_(None), id_column > row_id),
+            column.is_not(None),
+        )
+    return or_(column > value, and_(column == value, id_column > row_id))
+
+
+def parse_args(spec: ListingSpec, args: Mapping[str, str]) -> Dict[str, Any]:
+    """Pick listing options for ``spec`` out of request query arguments."""
+    sort = args.get('sort') or spec.default_sort
+    if sort not in spec.sort_keys:
+        sort = spec.default_sort
+    direction = 'desc' if args.get('dir') == 'desc' else 'asc'
+    filters = {name: args[name] for name in spec.filters if args.get(name)}
+    if spec.date_range:
+        for bound in ('from', 'to'):
+            key = f'{spec.date_range}_{bound}'
+            if args.get(key):
+                filters[key] = args[key]
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    return {
+        'sort': sort,
+        'direction': direction,
+        'filters': filters,
+        'cursor': args.get('after') or None,
+        'limit': max(1, min(limit, MAX_PAGE_SIZE)),
+    }
+
+
+def filter_criteria(spec: ListingSpec, filters: Mapping[str, str]) -> list:
+    criteria = []
+    for name in spec.filters:
+        if filters.get(name):
+            criteria.append(spec.column(name) == filters[name])
+    if spec.date_range:
+        column = spec.column(spec.date_range)
+        start = filters.get(f'{spec.date_range}_from')
+        end = filters.get(f'{spec.date_range}_to')
+        try:
+            if start:
+                criteria.append(column >= date.fromisoformat(start))
+            if end:
+                criteria.append(column <= date.fromisoformat(end))
+        except ValueError:
+            pass
+    return criteria
+
+
+def fetch_page(
+    session,
+    spec: ListingSpec,
+    sort: Optional[str] = None,
+    direction: str = 'asc',
+    filters: Optional[Mapping[str, str]] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    criteria: Sequence[Any] = (),
+    columns: Optional[Sequence[str]] = None,
+) -> Page:
+    """Return one page of ``spec.model`` rows using keyset pagination.
+
+    Rows are ordered by ``(sort, id)`` so the order is stable even when the
+    sort column has duplicates, and the next page starts right after the last
+    row of this one instead of skipping over an ``OFFSET``.
+
+    With ``columns`` the rows are plain tuples of those columns instead of
+    model instances; the sort column and ``id`` are added when missing.
+    """
+    sort = sort if sort in spec.sort_keys else spec.default_sort
+    descending = direction == 'desc'
+    filters = dict(filters or {})
+    column = spec.column(sort)
+    id_column = spec.column('id')
+
+    if columns is not None:
+        names = list(dict.fromkeys([*columns, 'id', sort]))
+        stmt = select(*(spec.column(name) for name in names))
+    else:
+        stmt = select(spec.model)
+    stmt = stmt.where(*filter_criteria(spec, filters), *criteria)
+    if cursor:
+        # A cursor that does not decode, or whose value does not fit the sort
+        # column, is ignored and the first page returned.
+        try:
+            value, row_id = decode_cursor(cursor)
+            value = _coerce(column, value)
+        except (ValueError, TypeError):
+            value, row_id = None, None
+        if row_id is not None:
+            if sort == 'id':
+                stmt = stmt.where(id_column < row_id if descending else id_column > row_id)
+            else:
+                stmt = stmt.where(_after(column, id_column, value, row_id, descending))
+    if sort == 'id':
+        order = [id_column.desc() if descending else id_column.asc()]
+    elif descending:
+        order = [column.desc(), id_column.desc()]
+    else:
+        order = [column.asc(), id_column.asc()]
+    stmt = stmt.order_by(*order).limit(limit + 1)
+
+    result = session.execute(stmt)
+    rows = list(result if columns is not None else result.scalars())
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort), last.id)
+    return Page(
+        rows=rows,
+        sort=sort,
+        direction=direction,
+        filters=filters,
+        next_cursor=next_cursor,
+        limit=limit,
+    )
+
+
+# The listings shared by the web pages, the JSON API and the command line.
+asset_listing = ListingSpec(
+    Asset,
+    sort_keys=('id', 'asset_code', 'name', 'category', 'budget_year', 'acquisition_date', 'quantity', 'price'),
+    filters=('category', 'budget_year', 'unit'),
+    date_range='acquisition_date',
+)
+inventory_listing = ListingSpec(
+    InventoryItem,
+    sort_keys=('id', 'name', 'quantity', 'location'),
+    filters=('location',),
+)
@@ -0,0 +1,356 @@
+from __future__ import annotations
+
+import atexit
+import collections
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROFILE_DIR = os.path.join(BASE_DIR, 'instance', 'profiles')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# The same SELECT run this many times in one request is reported as N+1.
+N_PLUS_ONE_THRESHOLD = 10
+# Requests slower than this keep their profile, if they were sampled.
+SLOW_SECONDS = float(os.environ.get('INVENTORY_SLOW_REQUEST_MS', '500')) / 1000
+# Fraction of requests run under cProfile; none unless asked for.
+PROFILE_RATE = float(os.environ.get('INVENTORY_PROFILE_RATE', '0'))
+MAX_PROFILES = 50
+# With several worker processes (serve.py sets this), each one writes its
+# series to a file here and /metrics adds up the files of every worker.
+MULTIPROCESS_DIR_ENV = 'INVENTORY_METRICS_DIR'
+FLUSH_SECONDS = 5
+
+_lock = threading.Lock()
+
+
+def _labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.series: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels[name] for name in self.labels)
+        with _lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self, series: Optional[Dict[Tuple, float]] = None) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} counter'
+        for key, value in sorted((self.series if series is None else series).items()):
+            yield f'{self.name}{_labels(self.labels, key)} {value:g}'
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.labels)
+        with _lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self, all_series: Optional[Dict[Tuple, List[float]]] = None) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        names = self.labels + ('le',)
+        for key, series in sorted((self.series if all_series is None else all_series).items()):
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket{_labels(names, key + (f"{bound:g}",))} {count}'
+            yield f'{self.name}_bucket{_labels(names, key + ("+Inf",))} {series[-2]}'
+            yield f'{self.name}_sum{_labels(self.labels, key)} {series[-1]:g}'
+            yield f'{self.name}_count{_labels(self.labels, key)} {series[-2]}'
+
+
+REQUEST_SECONDS = Histogram(
+    'inventory_request_seconds', 'Request latency by route.', LATENCY_BUCKETS, ('route', 'method')
+)
+REQUESTS = Counter('inventory_requests_total', 'Requests by route and status.', ('route', 'method', 'status'))
+REQUEST_QUERIES = Histogram('inventory_request_queries', 'SQL statements per request.', QUERY_BUCKETS, ('route',))
+SQL_SECONDS = Counter('inventory_sql_seconds_total', 'Time spent in SQL statements.', ('route',))
+N_PLUS_ONE = Counter('inventory_n_plus_one_total', 'Requests that repeated one SELECT many times.', ('route',))
+OPERATION_SECONDS = Histogram(
+    'inventory_operation_seconds', 'Duration of command-line operations.', LATENCY_BUCKETS, ('operation',)
+)
+PROFILES = Counter('inventory_slow_profiles_total', 'Slow requests saved as cProfile captures.', ('route',))
+METRICS = (REQUEST_SECONDS, REQUESTS, REQUEST_QUERIES, SQL_SECONDS, N_PLUS_ONE, OPERATION_SECONDS, PROFILES)
+
+
+class SharedStore:
+    """Series of every worker process, kept as one JSON file per process in ``directory``.
+
+    Each process rewrites its file every ``FLUSH_SECONDS`` and when it
+    renders, so other workers' numbers may be that much behind. Files of
+    workers that have exited stay, so counters never go backwards.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._pid: Optional[int] = None
+        self._path: Optional[str] = None
+
+    def start(self) -> None:
+        """Begin flushing this process's series; call again after ``fork``."""
+        if self._pid == os.getpid():
+            return
+        if self._pid is not None:
+            # Forked from a process whose file already holds these counts.
+            with _lock:
+                for metric in METRICS:
+                    metric.series.clear()
+        self._pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        # Not the pid alone: a later worker may be given the same one.
+        self._path = os.path.join(self.directory, f'{self._pid}-{uuid.uuid4().hex[:8]}.json')
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self) -> None:
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(FLUSH_SECONDS)
+            self.flush()
+
+    def flush(self) -> None:
+        if self._path is None:
+            return
+        with _lock:
+            snapshot = {metric.name: [[list(key), value] for key, value in metric.series.items()] for metric in METRICS}
+        tmp_path = f'{self._path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as handle:
+            json.dump(snapshot, handle)
+        os.replace(tmp_path, self._path)
+
+    def read(self) -> Dict[str, Dict[Tuple, Any]]:
+        """The series of all processes, summed per metric and labels."""
+        merged: Dict[str, Dict[Tuple, Any]] = collections.defaultdict(dict)
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, encoding='utf-8') as handle:
+                    snapshot = json.load(handle)
+            except FileNotFoundError:
+                continue
+            for name, series in snapshot.items():
+                totals = merged[name]
+                for key, value in series:
+                    key = tuple(key)
+                    previous = totals.get(key)
+                    if previous is None:
+                        totals[key] = value
+                    elif isinstance(value, list):
+                        totals[key] = [a + b for a, b in zip(previous, value)]
+                    else:
+                        totals[key] = previous + value
+        return merged
+
+
+_store = SharedStore(os.environ[MULTIPROCESS_DIR_ENV]) if os.environ.get(MULTIPROCESS_DIR_ENV) else None
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format, across worker processes when shared."""
+    if _store is not None:
+        _store.start()
+        _store.flush()
+        merged = _store.read()
+        lines = [line for metric in METRICS for line in metric.render(merged.get(metric.name, {}))]
+    else:
+        with _lock:
+            lines = [line for metric in METRICS for line in metric.render()]
+    return '\n'.join(lines) + '\n'
+
+
+class Span:
+    """SQL statistics for one request or operation."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.statements: collections.Counter = collections.Counter()
+        self.repeated: List[Tuple[str, int]] = []
+        self.profiler: Optional[cProfile.Profile] = None
+        self.profile_path: Optional[str] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def summary(self) -> str:
+        text = f'{self.elapsed * 1000:.1f} ms, {self.queries} queries ({self.query_seconds * 1000:.1f} ms SQL)'
+        if self.repeated:
+            text += f', possible N+1: {len(self.repeated)} repeated statements'
+        return text
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('inventory_span', default=None)
+# cProfile can only run in one place at a time on newer Pythons.
+_profiling = threading.Lock()
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def instrument_engine(engine) -> None:
+    """Count and time every statement ``engine`` runs inside a span."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        span = _current.get()
+        if span is not None:
+            span.queries += 1
+            span.query_seconds += elapsed
+            span.statements[statement] += 1
+
+
+def start(name: str, profile: Optional[bool] = None) -> Tuple[Span, contextvars.Token]:
+    span = Span(name)
+    if profile is None:
+        profile = random.random() < PROFILE_RATE
+    if profile and _profiling.acquire(blocking=False):
+        span.profiler = cProfile.Profile()
+        try:
+            span.profiler.enable()
+        except ValueError:  # another profiler is active
+            span.profiler = None
+            _profiling.release()
+    return span, _current.set(span)
+
+
+def finish(span: Span, token: contextvars.Token, profile_dir: str = DEFAULT_PROFILE_DIR) -> Span:
+    """Stop ``span``, flag repeated SELECTs and keep its profile if it was slow."""
+    span.finished = time.perf_counter()
+    try:
+        _current.reset(token)
+    except ValueError:  # finished from another context, e.g. after a streamed response
+        _current.set(None)
+    if span.profiler is not None:
+        span.profiler.disable()
+        _profiling.release()
+        if span.elapsed >= SLOW_SECONDS:
+            span.profile_path = _save_profile(span, profile_dir)
+    span.repeated = [
+        (statement, count)
+        for statement, count in span.statements.items()
+        if count >= N_PLUS_ONE_THRESHOLD and statement.lstrip().upper().startswith('SELECT')
+    ]
+    for statement, count in span.repeated:
+        logger.warning('%s ran the same SELECT %d times (N+1?): %s', span.name, count, statement)
+    return span
+
+
+def _save_profile(span: Span, profile_dir: str) -> str:
+    os.makedirs(profile_dir, exist_ok=True)
+    safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in span.name)
+    path = os.path.join(profile_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{safe_name}-{span.elapsed * 1000:.0f}ms.prof')
+    span.profiler.dump_stats(path)
+    profiles = sorted(
+        (entry for entry in os.scandir(profile_dir) if entry.name.endswith('.prof')),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profiles[:-MAX_PROFILES]:
+        os.remove(entry.path)
+    PROFILES.inc(route=span.name)
+    return path
+
+
+@contextmanager
+def observe(operation: str, profile: Optional[bool] = None, profile_dir: str = DEFAULT_PROFILE_DIR) -> Iterator[Span]:
+    """Time a non-web operation, such as a CLI export, with the request hooks."""
+    span, token = start(operation, profile)
+    try:
+        yield span
+    finally:
+        finish(span, token, profile_dir)
+        OPERATION_SECONDS.observe(span.elapsed, operation=operation)
+
+
+def init_app(app, profile_dir: Optional[str] = None, footer: Optional[bool] = None) -> None:
+    """Record latency, SQL and N+1 metrics for every request of ``app``.
+
+    ``footer`` (default: ``$INVENTORY_METRICS_FOOTER``) makes the per-request
+    summary available to templates as ``request_metrics()``.
+    """
+    from flask import g, request
+
+    profile_dir = profile_dir or os.path.join(app.instance_path, 'profiles')
+    if footer is None:
+        footer = bool(os.environ.get('INVENTORY_METRICS_FOOTER'))
+    app.config['METRICS_FOOTER'] = footer
+
+    @app.before_request
+    def _start_span():
+        if _store is not None:
+            _store.start()
+        g.metrics_span = start(request.endpoint or 'unknown')
+
+    @app.after_request
+    def _record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_span(exception=None):
+        started = g.pop('metrics_span', None)
+        if started is None:
+            return
+        span = finish(*started, profile_dir=profile_dir)
+        status = g.pop('metrics_status', 500)
+        REQUEST_SECONDS.observe(span.elapsed, route=span.name, method=request.method)
+        REQUESTS.inc(route=span.name, method=request.method, status=status)
+        REQUEST_QUERIES.observe(span.queries, route=span.name)
+        SQL_SECONDS.inc(span.query_seconds, route=span.name)
+        if span.repeated:
+            N_PLUS_ONE.inc(route=span.name)
+
+    @app.context_processor
+    def _footer():
+        return {'metrics_footer': footer, 'request_metrics': current_span}
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Column, Integer, inspect, text
+
+import audit
+import auth
+import offline
+import search
+import stock
+import stocktake
+import summary
+import valuation
+import versions
+from models import Asset, InventoryItem, init_db
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable
+
+
+def add_column(connection, table: str, column: Column) -> None:
+    """Add ``column`` to ``table`` in place unless it already exists.
+
+    SQLite's ``ALTER TABLE ... ADD COLUMN`` only rewrites the schema entry, so
+    this is instant even on large tables. The column must be nullable or have
+    a constant default.
+    """
+    existing = {c['name'] for c in inspect(connection).get_columns(table)}
+    if column.name in existing:
+        return
+    ddl = column.type.compile(dialect=connection.dialect)
+    clause = f'ALTER TABLE {table} ADD COLUMN {column.name} {ddl}'
+    if column.server_default is not None:
+        clause += f' DEFAULT {column.server_default.arg}'
+    if not column.nullable:
+        clause += ' NOT NULL'
+    connection.execute(text(clause))
+
+
+def create_indexes(connection, model) -> None:
+    for index in model.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _base_schema(connection) -> None:
+    init_db(connection)
+    versions.metadata.create_all(connection)
+    search.create_index(connection)
+
+
+def _indexes(connection) -> None:
+    create_indexes(connection, Asset)
+    create_indexes(connection, InventoryItem)
+    connection.execute(text('ANALYZE'))
+
+
+def _drop_search_index_stats(connection) -> None:
+    # ANALYZE on a new database records the FTS shadow tables as nearly empty.
+    # FTS5 prepares its internal lookups with that plan and every insert then
+    # scans the growing index, so leave those tables to the default estimates.
+    if connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")).first():
+        connection.execute(text("DELETE FROM sqlite_stat1 WHERE tbl LIKE 'asset_fts%'"))
+
+
+def _table_version_updated(connection) -> None:
+    versions.ensure_table(connection)
+    add_column(connection, 'table_version', versions.table_version.c.updated)
+
+
+def _asset_row_version(connection) -> None:
+    add_column(connection, 'asset', Column('row_version', Integer, nullable=False, server_default='0'))
+    offline.install(connection)
+    # Reindex only when an indexed column changes, not on version bumps.
+    connection.execute(text('DROP TRIGGER IF EXISTS asset_fts_au'))
+    search.create_index(connection)
+
+
+def _sort_indexes(connection) -> None:
+    create_indexes(connection, Asset)
+    create_indexes(connection, InventoryItem)
+    # Only these tables: a plain ANALYZE would record the search index's
+    # shadow tables again (see _drop_search_index_stats).
+    connection.execute(text('ANALYZE asset'))
+    connection.execute(text('ANALYZE inventory_item'))
+
+
+# Append new steps at the end; never renumber or edit a released one. Steps
+# must be idempotent because databases created before this list existed are
+# at version 0 even when some tables are already there. A step that adds
+# columns to an audited table must end with audit.install(), which rebuilds
+# the change log triggers with the new column list.
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'base tables, table versions, search index, admin user', _base_schema),
+    Migration(2, 'summary tables', summary.install),
+    Migration(3, 'asset and inventory item indexes', _indexes),
+    Migration(4, 'drop planner statistics for the search index tables', _drop_search_index_stats),
+    Migration(5, 'login throttle table', auth.metadata.create_all),
+    Migration(6, 'last change time of table versions', _table_version_updated),
+    Migration(7, 'stock movement ledger and snapshots', stock.install),
+    Migration(8, 'change log of asset and inventory writes', audit.install),
+    Migration(9, 'asset row versions for conflict detection', _asset_row_version),
+    Migration(10, 'stocktake counts', stocktake.install),
+    Migration(11, 'cached asset valuations per period', valuation.install),
+    Migration(12, 'quantity and price indexes for the list sorts', _sort_indexes),
+    Migration(13, 'change log user from a context table instead of a SQL function', audit.install),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(connection) -> int:
+    return connection.execute(text('PRAGMA user_version')).scalar() or 0
+
+
+def pending(engine) -> List[Migration]:
+    with engine.connect() as connection:
+        version = current_version(connection)
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def migrate(engine, target: int = LATEST_VERSION, rerun: bool = False) -> List[Migration]:
+    """Apply pending migrations up to ``target``, each in its own transaction.
+
+    The schema version is stored in ``PRAGMA user_version`` and updated in the
+    same transaction as the step, so an interrupted run resumes where it
+    stopped. ``rerun`` applies every step again.
+    """
+    applied = []
+    steps = MIGRATIONS if rerun else pending(engine)
+    for migration in steps:
+        if migration.version > target:
+            break
+        with engine.begin() as connection:
+            migration.apply(connection)
+            connection.execute(text(f'PRAGMA user_version = {migration.version}'))
+        applied.append(migration)
+    return applied
@@ -3,7 +3,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Column, Date, Float, Integer, String, Text
+from sqlalchemy import Column, Date, Float, Index, Integer, String, Text
 from sqlalchemy.orm import declarative_base, sessionmaker
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -26,6 +26,20 @@ class User(Base):
 
 class Asset(Base):
     __tablename__ = 'asset'
+    # Match the listing sorts/filters, import upserts and code/serial lookups.
+    # SQLite appends the rowid to every index, so each also serves (column, id)
+    # keyset pagination.
+    __table_args__ = (
+        Index('ix_asset_code', 'asset_code', 'sub_code'),
+        Index('ix_asset_serial_number', 'serial_number'),
+        Index('ix_asset_name', 'name'),
+        Index('ix_asset_category_year', 'category', 'budget_year'),
+        Index('ix_asset_budget_year', 'budget_year'),
+        Index('ix_asset_unit', 'unit'),
+        Index('ix_asset_acquisition_date', 'acquisition_date'),
+        Index('ix_asset_quantity', 'quantity'),
+        Index('ix_asset_price', 'price'),
+    )
 
     id = Column(Integer, primary_key=True)
     asset_code = Column(String(50), nullable=False)
@@ -40,10 +54,31 @@ class Asset(Base):
     unit: Optional[str] = Column(String(100))
     price: Optional[float] = Column(Float)
     note: Optional[str] = Column(Text)
+    # Incremented on every update (see offline.py) to detect conflicting edits.
+    row_version = Column(Integer, nullable=False, default=0, server_default='0')
+
+
+class InventoryItem(Base):
+    __tablename__ = 'inventory_item'
+    __table_args__ = (
+        Index('ix_inventory_item_location', 'location'),
+        Index('ix_inventory_item_name', 'name'),
+        Index('ix_inventory_item_quantity', 'quantity'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(200), nullable=False)
+    quantity = Column(Integer, default=0)
+    location: Optional[str] = Column(String(100))
+    note: Optional[str] = Column(Text)
 
 
 def init_db(engine) -> None:
-    """Create tables and default admin user."""
+    """Create tables and default admin user.
+
+    ``engine`` may also be a connection, in which case the work joins its
+    transaction. Existing databases are brought up to date by ``migrations``.
+    """
     Base.metadata.create_all(engine)
     SessionLocal = sessionmaker(bind=engine)
     with SessionLocal() as session:
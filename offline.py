@@ -0,0 +1,424 @@
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, text, update
+from sqlalchemy.exc import DBAPIError
+
+import audit
+import versions
+from models import Asset
+
+# Asset columns kept in memory, in row tuple order. The GUI shows all but
+# the last.
+CACHED_COLUMNS = ('id', 'asset_code', 'name', 'quantity', 'row_version')
+# Pending writes are sent this long after the last edit, batched together.
+FLUSH_DELAY = 0.5
+# How often the cache pulls other people's changes from the change log.
+SYNC_INTERVAL = 5.0
+# Retry delays grow up to this while the database cannot be reached.
+MAX_BACKOFF = 60.0
+
+# Every update that does not set row_version itself gets it incremented, so
+# clients holding an older version of a row can tell it changed under them.
+CREATE_TRIGGERS = (
+    'CREATE TRIGGER IF NOT EXISTS asset_row_version_au AFTER UPDATE ON asset '
+    'WHEN new.row_version IS old.row_version BEGIN '
+    'UPDATE asset SET row_version = coalesce(old.row_version, 0) + 1 WHERE id = new.id; END',
+)
+
+_table = Asset.__table__
+_columns = [_table.c[name] for name in CACHED_COLUMNS]
+_VERSION = CACHED_COLUMNS.index('row_version')
+
+
+def install(connection) -> None:
+    for ddl in CREATE_TRIGGERS:
+        connection.execute(text(ddl))
+
+
+@dataclass
+class PendingWrite:
+    """A local change waiting to be written; ``row_id`` is negative until created."""
+
+    op: str
+    row_id: int
+    values: Dict[str, Any] = field(default_factory=dict)
+    # The row_version the change was made against; None for creates.
+    expected: Optional[int] = None
+
+    def as_dict(self) -> dict:
+        return {'op': self.op, 'row_id': self.row_id, 'values': self.values, 'expected': self.expected}
+
+
+def merge(first: PendingWrite, second: PendingWrite) -> Optional[PendingWrite]:
+    """One write with the effect of ``first`` followed by ``second``; None if they cancel out."""
+    if first.op == 'delete':
+        return first
+    if second.op == 'delete':
+        return None if first.op == 'create' else PendingWrite('delete', first.row_id, expected=first.expected)
+    return PendingWrite(first.op, first.row_id, {**first.values, **second.values}, first.expected)
+
+
+class FlushResult:
+    def __init__(self) -> None:
+        self.created: Dict[int, int] = {}
+        # (row id, the row as stored now or None when it was deleted).
+        self.conflicts: List[Tuple[int, Optional[tuple]]] = []
+        self.written = 0
+
+
+class OfflineAssets:
+    """A local copy of the asset list with a write-behind queue.
+
+    Reads are answered from memory. Edits change the local copy at once and
+    are queued; ``flush`` writes the queue in one transaction, updating and
+    deleting only rows whose ``row_version`` is still the one that was
+    edited. A row changed by someone else in the meantime is reported as a
+    conflict and shown as stored. ``sync`` pulls other people's changes from
+    the change log. Queued writes are journalled to ``journal_path`` so they
+    survive a restart while the database is out of reach.
+
+    All methods are safe to call from any thread.
+    """
+
+    def __init__(self, journal_path: Optional[str] = None):
+        self.journal_path = journal_path
+        self.loaded = False
+        self.seq = 0
+        self._server: Dict[int, tuple] = {}
+        self._rows: Dict[int, tuple] = {}
+        self._ids: List[int] = []
+        self._new_ids: List[int] = []
+        self._pending: Dict[int, PendingWrite] = {}
+        self._in_flight: Dict[int, PendingWrite] = {}
+        self._next_temp_id = -1
+        self._lock = threading.RLock()
+        self._read_journal()
+
+    # Reads.
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._ids) + len(self._new_ids)
+
+    def fetch(self, start: int, size: int) -> List[tuple]:
+        with self._lock:
+            ordered = self._ids if start + size <= len(self._ids) else self._ids + self._new_ids
+            return [self._rows[row_id][:_VERSION] for row_id in ordered[start:start + size]]
+
+    def row(self, row_id: int) -> Optional[tuple]:
+        with self._lock:
+            row = self._rows.get(row_id)
+            return row[:_VERSION] if row else None
+
+    def search(self, query: str) -> List[int]:
+        terms = [term.casefold() for term in query.split()]
+        with self._lock:
+            rows = [self._rows[row_id] for row_id in self._ids + self._new_ids]
+        return [
+            row[0] for row in rows
+            if all(term in f'{row[1] or ""}\n{row[2] or ""}'.casefold() for term in terms)
+        ]
+
+    @property
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending) + len(self._in_flight)
+
+    # Local edits.
+
+    def create(self, **values: Any) -> int:
+        with self._lock:
+            row_id = self._next_temp_id
+            self._next_temp_id -= 1
+            self._enqueue(PendingWrite('create', row_id, values))
+            return row_id
+
+    def update(self, row_id: int, **values: Any) -> None:
+        with self._lock:
+            self._enqueue(PendingWrite('update', row_id, values, self._expected(row_id)))
+
+    def delete(self, row_id: int) -> None:
+        with self._lock:
+            self._enqueue(PendingWrite('delete', row_id, expected=self._expected(row_id)))
+
+    def _expected(self, row_id: int) -> Optional[int]:
+        flying = self._in_flight.get(row_id)
+        if flying is not None:
+            # The write in flight bumps the version once it succeeds.
+            return 0 if flying.op == 'create' else (flying.expected or 0) + 1
+        server = self._server.get(row_id)
+        return server[_VERSION] if server else None
+
+    def _enqueue(self, write: PendingWrite) -> None:
+        earlier = self._pending.pop(write.row_id, None)
+        merged = merge(earlier, write) if earlier is not None else write
+        if merged is not None:
+            self._pending[write.row_id] = merged
+        self._show(write.row_id)
+        self._write_journal()
+
+    def _show(self, row_id: int) -> None:
+        """Recompute the displayed row from the stored one and the queued writes."""
+        row = self._server.get(row_id)
+        values: Dict[str, Any] = {}
+        deleted = False
+        for writes in (self._in_flight, self._pending):
+            write = writes.get(row_id)
+            if write is None:
+                continue
+            if write.op == 'delete':
+                deleted = True
+            values.update(write.values)
+            if write.op == 'create' and row is None:
+                row = (row_id, None, None, 1, 0)
+        if row is None or deleted:
+            self._rows.pop(row_id, None)
+            self._remove_id(row_id)
+            return
+        if values:
+            row = tuple(values.get(name, value) for name, value in zip(CACHED_COLUMNS, row))
+        self._rows[row_id] = row
+        if row_id > 0:
+            position = bisect.bisect_left(self._ids, row_id)
+            if position == len(self._ids) or self._ids[position] != row_id:
+                self._ids.insert(position, row_id)
+        elif row_id not in self._new_ids:
+            self._new_ids.append(row_id)
+
+    def _remove_id(self, row_id: int) -> None:
+        if row_id < 0:
+            if row_id in self._new_ids:
+                self._new_ids.remove(row_id)
+            return
+        position = bisect.bisect_left(self._ids, row_id)
+        if position < len(self._ids) and self._ids[position] == row_id:
+            del self._ids[position]
+
+    # Database side; called from the background thread.
+
+    def load(self, session) -> None:
+        """Read every asset; the change log position is taken in the same snapshot."""
+        try:
+            seq = audit.latest_seq(session)
+            server = {row[0]: tuple(row) for row in session.execute(select(*_columns).order_by(_table.c.id))}
+        finally:
+            session.rollback()
+        with self._lock:
+            self.seq = seq
+            self._server = server
+            self._rows = {}
+            self._ids = []
+            self._new_ids = []
+            for row_id in list(server) + list(self._in_flight) + list(self._pending):
+                self._show(row_id)
+            self.loaded = True
+
+    def sync(self, session) -> bool:
+        """Apply changes logged since the last sync; True when anything changed."""
+        changed = False
+        try:
+            while True:
+                try:
+                    entries = audit.changes_since(session, self.seq, tables=[Asset.__tablename__])
+                except audit.ChangesPruned:
+                    session.rollback()
+                    self.load(session)
+                    return True
+                if not entries:
+                    break
+                ids = {entry.row_id for entry in entries}
+                current = {
+                    row[0]: tuple(row)
+                    for row in session.execute(select(*_columns).where(_table.c.id.in_(ids)))
+                }
+                with self._lock:
+                    for row_id in ids:
+                        if row_id in current:
+                            self._server[row_id] = current[row_id]
+                        else:
+                            self._server.pop(row_id, None)
+                        self._show(row_id)
+                    self.seq = entries[-1].seq
+                changed = True
+        finally:
+            session.rollback()
+        return changed
+
+    def flush(self, session) -> FlushResult:
+        """Write the queued changes in one transaction.
+
+        Raises on database errors, leaving them queued to try again.
+        """
+        result = FlushResult()
+        with self._lock:
+            if self._in_flight or not self._pending:
+                return result
+            self._in_flight, self._pending = self._pending, {}
+            batch = list(self._in_flight.values())
+        try:
+            connection = session.connection()
+            for write in batch:
+                if write.op == 'create':
+                    stmt = insert(_table).values(**write.values).returning(_table.c.id)
+                    result.created[write.row_id] = connection.execute(stmt).scalar()
+                    continue
+                condition = (_table.c.id == write.row_id, _table.c.row_version == write.expected)
+                if write.op == 'update':
+                    stmt = update(_table).where(*condition).values(
+                        **write.values, row_version=_table.c.row_version + 1
+                    )
+                else:
+                    stmt = delete(_table).where(*condition)
+                if connection.execute(stmt).rowcount:
+                    continue
+                row = connection.execute(select(*_columns).where(_table.c.id == write.row_id)).first()
+                result.conflicts.append((write.row_id, tuple(row) if row else None))
+            result.written = len(batch) - len(result.conflicts)
+            if result.written:
+                versions.bump(connection, Asset.__tablename__)
+            session.commit()
+        except BaseException:
+            session.rollback()
+            with self._lock:
+                restored = self._in_flight
+                for row_id, write in self._pending.items():
+                    merged = merge(restored[row_id], write) if row_id in restored else write
+                    if merged is None:
+                        restored.pop(row_id, None)
+                    else:
+                        restored[row_id] = merged
+                self._pending, self._in_flight = restored, {}
+            raise
+        with self._lock:
+            self._finish(batch, result)
+        return result
+
+    def _finish(self, batch: List[PendingWrite], result: FlushResult) -> None:
+        self._in_flight = {}
+        conflicted = dict(result.conflicts)
+        for write in batch:
+            if write.row_id in conflicted:
+                row = conflicted[write.row_id]
+                if row is None:
+                    self._server.pop(write.row_id, None)
+                else:
+                    self._server[write.row_id] = row
+                # Later edits of the row were based on the version that lost.
+                self._pending.pop(write.row_id, None)
+            elif write.op == 'create':
+                real_id = result.created[write.row_id]
+                values = {**write.values, 'id': real_id}
+                self._server[real_id] = tuple(values.get(name, default) for name, default in
+                                              zip(CACHED_COLUMNS, (real_id, None, None, 1, 0)))
+                follow_up = self._pending.pop(write.row_id, None)
+                if follow_up is not None:
+                    follow_up.row_id = real_id
+                    self._pending[real_id] = follow_up
+                self._show(write.row_id)
+                self._show(real_id)
+                continue
+            elif write.op == 'delete':
+                self._server.pop(write.row_id, None)
+            else:
+                old = self._server.get(write.row_id)
+                if old is not None:
+                    values = {**write.values, 'row_version': (write.expected or 0) + 1}
+                    self._server[write.row_id] = tuple(values.get(name, value)
+                                                       for name, value in zip(CACHED_COLUMNS, old))
+            self._show(write.row_id)
+        self._write_journal()
+
+    # Journal of queued writes.
+
+    def _write_journal(self) -> None:
+        if self.journal_path is None:
+            return
+        writes = [write.as_dict() for write in list(self._in_flight.values()) + list(self._pending.values())]
+        tmp_path = f'{self.journal_path}.tmp'
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as handle:
+            json.dump(writes, handle, ensure_ascii=False)
+        os.replace(tmp_path, self.journal_path)
+
+    def _read_journal(self) -> None:
+        if self.journal_path is None or not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, encoding='utf-8') as handle:
+            for data in json.load(handle):
+                write = PendingWrite(**data)
+                earlier = self._pending.pop(write.row_id, None)
+                merged = merge(earlier, write) if earlier is not None else write
+                if merged is not None:
+                    self._pending[write.row_id] = merged
+                self._next_temp_id = min(self._next_temp_id, write.row_id - 1)
+
+
+class SyncThread:
+    """Flush and sync an ``OfflineAssets`` in the background.
+
+    ``notify(kind, payload)`` is called from the background thread with
+    ``('loaded', None)``, ``('changed', None)``, ``('created', {temp: id})``,
+    ``('conflicts', [(row_id, row), ...])`` and ``('status', message)``.
+    """
+
+    def __init__(self, assets: OfflineAssets, session_factory: Callable, notify: Callable[[str, Any], None]):
+        self.assets = assets
+        self.session_factory = session_factory
+        self.notify = notify
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='offline-sync', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def changed(self) -> None:
+        """Ask for a flush soon; call after every local edit."""
+        self._wake.set()
+
+    def _run(self) -> None:
+        backoff = 1.0
+        online = None
+        while not self._stop.is_set():
+            try:
+                with self.session_factory() as session:
+                    if not self.assets.loaded:
+                        self.assets.load(session)
+                        self.notify('loaded', None)
+                    result = self.assets.flush(session)
+                    if result.created:
+                        self.notify('created', result.created)
+                    if result.conflicts:
+                        self.notify('conflicts', result.conflicts)
+                    if self.assets.sync(session) or result.written or result.conflicts:
+                        self.notify('changed', None)
+            except Exception as exc:  # reported in the status bar, then retried
+                if online is not False:
+                    reason = exc.orig if isinstance(exc, DBAPIError) else exc
+                    self.notify('status', f'Offline, changes are kept locally ({reason})')
+                online = False
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            backoff = 1.0
+            if online is not True:
+                online = True
+                self.notify('status', 'Online')
+            self._wake.wait(SYNC_INTERVAL)
+            if self._wake.is_set() and not self._stop.is_set():
+                # Let a burst of edits collect into one transaction.
+                time.sleep(FLUSH_DELAY)
+            self._wake.clear()
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+
+from exports import HEADERS, VALUE_COLUMNS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Set to the path of any TTF with Thai glyphs to override the search below.
+FONT_ENV = 'INVENTORY_PDF_FONT'
+FONT_CANDIDATES = (
+    os.path.join(BASE_DIR, 'fonts', 'THSarabunNew.ttf'),
+    os.path.join(BASE_DIR, 'fonts', 'Sarabun-Regular.ttf'),
+    '/usr/share/fonts/truetype/tlwg/Garuda.ttf',
+    '/usr/share/fonts/truetype/tlwg/Loma.ttf',
+    '/usr/share/fonts/truetype/noto/NotoSansThai-Regular.ttf',
+    '/usr/share/fonts/noto/NotoSansThai-Regular.ttf',
+    '/usr/share/fonts/google-noto/NotoSansThai-Regular.ttf',
+    'C:\\Windows\\Fonts\\tahoma.ttf',
+    'C:\\Windows\\Fonts\\LeelawUI.ttf',
+    '/System/Library/Fonts/Supplemental/Tahoma.ttf',
+)
+
+# Widths in mm for each export column on landscape A4 with 10 mm margins.
+COLUMN_WIDTHS = (10, 26, 12, 14, 34, 27, 21, 22, 11, 19, 15, 18, 12, 18, 18)
+MONEY_COLUMNS = [HEADERS.index('ราคา'), *(HEADERS.index(header) for header, _ in VALUE_COLUMNS)]
+RIGHT_ALIGNED = {HEADERS.index('จำนวน'), *MONEY_COLUMNS}
+TITLE = 'รายการครุภัณฑ์'
+FONT_SIZE = 9
+ROW_HEIGHT = 6
+ELLIPSIS = '…'
+
+
+class FontNotFoundError(RuntimeError):
+    pass
+
+
+def find_font() -> str:
+    """Return the path of a Thai-capable TTF, or raise ``FontNotFoundError``."""
+    path = os.environ.get(FONT_ENV)
+    if path:
+        if not os.path.isfile(path):
+            raise FontNotFoundError(f'{FONT_ENV} points to a missing file: {path}')
+        return path
+    for path in FONT_CANDIDATES:
+        if os.path.isfile(path):
+            return path
+    raise FontNotFoundError(
+        f'No Thai font found for the PDF report. Put THSarabunNew.ttf in '
+        f'{os.path.join(BASE_DIR, "fonts")} or set {FONT_ENV} to a TTF file.'
+    )
+
+
+class AssetReport(FPDF):
+    """Landscape asset register with fixed columns and a header on every page.
+
+    Each cell is a single line; text wider than its column is cut and ends
+    with an ellipsis, so no line wrapping is ever computed. Body cells are
+    placed with ``text()`` and the grid is drawn once per page, which is far
+    cheaper than one bordered ``cell()`` per value.
+    """
+
+    def __init__(self, font_path: str, title: str = TITLE, widths: Sequence[float] = COLUMN_WIDTHS):
+        super().__init__(orientation='L', unit='mm', format='A4')
+        self.title_text = title
+        self.widths = list(widths)
+        self.set_margins(10, 10, 10)
+        self.set_auto_page_break(False)
+        self.add_font('report', '', font_path)
+        self.set_font('report', size=FONT_SIZE)
+        self.columns = []
+        x = self.l_margin
+        for index, width in enumerate(self.widths):
+            self.columns.append((x, width, index in RIGHT_ALIGNED))
+            x += width
+        self.right = x
+        # Fitting depends only on the text and column width once the font is
+        # fixed, and registers repeat the same codes, years and units a lot.
+        self.char_width = lru_cache(maxsize=4096)(self.get_string_width)
+        self.fit = lru_cache(maxsize=16384)(self._fit)
+        self._bottom = self.h - self.b_margin - ROW_HEIGHT
+        self._baseline = (ROW_HEIGHT + FONT_SIZE * 0.7 / self.k) / 2
+        self._table_top = None
+
+    def text_width(self, text: str) -> float:
+        return sum(map(self.char_width, text))
+
+    def _fit(self, text: str, width: float) -> Tuple[str, float]:
+        room = width - 2 * self.c_margin
+        used = self.text_width(text)
+        if used <= room:
+            return text, used
+        room -= self.text_width(ELLIPSIS)
+        used = 0.0
+        for end, char in enumerate(text):
+            used += self.char_width(char)
+            if used > room:
+                text = text[:end] + ELLIPSIS
+                break
+        return text, self.text_width(text)
+
+    def header(self):
+        self.set_font_size(FONT_SIZE + 4)
+        self.cell(0, 8, self.title_text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.set_font_size(FONT_SIZE)
+        self.set_fill_color(230, 230, 230)
+        self._table_top = self.get_y()
+        self.rect(self.l_margin, self._table_top, self.right - self.l_margin, ROW_HEIGHT, style='DF')
+        self._row(HEADERS)
+
+    def footer(self):
+        if self._table_top is not None:
+            bottom = self.get_y()
+            for x, _, _ in self.columns[1:]:
+                self.line(x, self._table_top, x, bottom)
+            self.line(self.l_margin, self._table_top, self.l_margin, bottom)
+            self.line(self.right, self._table_top, self.right, bottom)
+        self.set_y(-8)
+        self.cell(0, 5, f'หน้า {self.page_no()}', align='R')
+
+    def _row(self, values: Sequence[str]) -> None:
+        y = self.get_y()
+        baseline = y + self._baseline
+        for (x, width, right), value in zip(self.columns, values):
+            if not value:
+                continue
+            text, used = self.fit(value, width)
+            left = x + width - self.c_margin - used if right else x + self.c_margin
+            self.text(left, baseline, text)
+        y += ROW_HEIGHT
+        self.line(self.l_margin, y, self.right, y)
+        self.set_y(y)
+
+    def add_row(self, values: Sequence[str]) -> None:
+        if self.page == 0 or self.get_y() > self._bottom:
+            self.add_page()
+        self._row(values)
+
+
+def _cells(row: tuple) -> List[str]:
+    cells = ['' if value is None else str(value) for value in row]
+    for index in MONEY_COLUMNS:
+        if row[index] is not None:
+            cells[index] = f'{row[index]:,.2f}'
+    return cells
+
+
+def write_report(rows: Iterable[tuple], fileobj, font_path: Optional[str] = None) -> None:
+    """Render export rows as a PDF table into ``fileobj``.
+
+    Rows are laid out as they arrive, but fpdf2 keeps the finished pages in
+    memory until the document is written out at the end.
+    """
+    pdf = AssetReport(font_path or find_font())
+    for row in rows:
+        pdf.add_row(_cells(row))
+    if pdf.page == 0:
+        pdf.add_page()
+    pdf.output(fileobj)
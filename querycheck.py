@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import logging
+import re
+from typing import Any, Iterator, List, Sequence, Tuple
+
+from sqlalchemy import event, select
+
+import listing
+import scan
+import search
+from models import Asset
+
+logger = logging.getLogger(__name__)
+
+# "SCAN asset" (before SQLite 3.36 "SCAN TABLE asset") is a full table scan;
+# "SCAN asset USING INDEX ..." walks an index in order and "SEARCH ..." is an
+# index lookup, both of which are fine.
+_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+
+
+def full_scans(connection, statement: str, parameters: Any = ()) -> List[str]:
+    """Return the tables ``statement`` reads with a full scan, per EXPLAIN QUERY PLAN."""
+    cursor = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)
+    tables = []
+    for row in cursor:
+        match = _FULL_SCAN.match(row[-1])
+        if match:
+            tables.append(match.group(1))
+    return tables
+
+
+def _compile(stmt, connection) -> str:
+    return str(stmt.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def representative_queries(session) -> Iterator[Tuple[str, Any]]:
+    """Statements matching what the listings, import and lookups run."""
+    for spec in (listing.asset_listing, listing.inventory_listing):
+        table = spec.model.__tablename__
+        for sort in spec.sort_keys[1:]:
+            column = spec.column(sort)
+            yield f'{table} sorted by {sort}', select(spec.model).order_by(column, spec.model.id).limit(51)
+        for name in spec.filters:
+            yield f'{table} filtered by {name}', (
+                select(spec.model).where(spec.column(name) == 'x').order_by(spec.model.id).limit(51)
+            )
+    yield 'assets by category and budget year', select(Asset).where(
+        Asset.category == 'x', Asset.budget_year == '2566'
+    ).order_by(Asset.id).limit(51)
+    yield 'assets by acquisition date range', select(Asset).where(*listing.filter_criteria(
+        listing.asset_listing, {'acquisition_date_from': '2020-01-01', 'acquisition_date_to': '2020-12-31'}
+    )).limit(51)
+    yield 'asset by code', select(Asset.id).where(Asset.asset_code.in_(['x', 'y']))
+    yield 'asset by serial number', select(Asset.id).where(Asset.serial_number == 'x')
+    yield 'asset by scanned label', scan.lookup_statement('x/1')
+    yield 'asset search', select(Asset).where(*search.match_criteria(session, Asset, 'keyboard')).limit(51)
+
+
+def check(session) -> List[Tuple[str, List[str]]]:
+    """Return ``(query name, scanned tables)`` for representative queries that scan."""
+    connection = session.connection()
+    problems = []
+    for name, stmt in representative_queries(session):
+        tables = full_scans(connection, _compile(stmt, connection))
+        if tables:
+            problems.append((name, tables))
+    return problems
+
+
+def warn_on_full_scans(engine, ignore: Sequence[str] = ()) -> None:
+    """Log a warning the first time each SELECT run on ``engine`` scans a table."""
+    seen = set()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _explain(conn, cursor, statement, parameters, context, executemany):
+        if executemany or statement in seen or not statement.lstrip().upper().startswith('SELECT'):
+            return
+        seen.add(statement)
+        raw = conn.connection.dbapi_connection.cursor()
+        try:
+            rows = raw.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ()).fetchall()
+        finally:
+            raw.close()
+        for row in rows:
+            match = _FULL_SCAN.match(row[-1])
+            if match and match.group(1) not in ignore:
+                logger.warning('Full scan of %s: %s', match.group(1), statement)
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import hmac
+import json
+import os
+from datetime import date
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import Date, Float, Integer
+
+try:
+    import orjson
+except ImportError:  # fall back to the standard library encoder
+    orjson = None
+
+# Comma separated bearer tokens accepted by the API and the command line.
+TOKENS_ENV = 'INVENTORY_API_TOKENS'
+# Recorded in the change log as the author of writes made with a token.
+TOKEN_USER = 'api-token'
+# Columns maintained by the database that clients may read but not write.
+# An update may still send the row_version it read, to be applied only if
+# nobody has changed the record since.
+READ_ONLY_FIELDS = ('id', 'row_version')
+VERSION_FIELD = 'row_version'
+
+
+class InvalidRecord(ValueError):
+    """A JSON record that does not fit its table; the message says where and why."""
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def configured_tokens() -> List[str]:
+    return [token.strip() for token in os.environ.get(TOKENS_ENV, '').split(',') if token.strip()]
+
+
+def check_token(supplied: str, tokens: Sequence[str]) -> bool:
+    return any(hmac.compare_digest(supplied, token) for token in tokens)
+
+
+def _coerce(column, value: Any) -> Any:
+    """Check a JSON value against ``column`` and convert it to the column's type."""
+    if isinstance(value, str) and not isinstance(column.type, Date):
+        value = value.strip() or None
+    if value is None:
+        if not column.nullable:
+            raise ValueError('is required')
+        return None
+    if isinstance(column.type, Integer):
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError('must be an integer')
+        return value
+    if isinstance(column.type, Float):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError('must be a number')
+        return float(value)
+    if isinstance(column.type, Date):
+        if not isinstance(value, str):
+            raise ValueError('must be a YYYY-MM-DD date')
+        try:
+            return date.fromisoformat(value.strip())
+        except ValueError:
+            raise ValueError('must be a YYYY-MM-DD date') from None
+    if not isinstance(value, str):
+        raise ValueError('must be a string')
+    return value
+
+
+def record_fields(model, data: Any, partial: bool = False, where: str = 'body') -> Dict[str, Any]:
+    """Validate one JSON record for ``model``; ``partial`` allows missing columns."""
+    if not isinstance(data, dict):
+        raise InvalidRecord(f'{where}: expected a JSON object')
+    columns = model.__table__.c
+    fields = {}
+    for name, value in data.items():
+        if name in READ_ONLY_FIELDS or name not in columns:
+            raise InvalidRecord(f'{where}: unknown field {name}')
+        try:
+            fields[name] = _coerce(columns[name], value)
+        except ValueError as exc:
+            raise InvalidRecord(f'{where}: {name} {exc}') from None
+    if not partial:
+        missing = [
+            c.name for c in columns
+            if not c.nullable and not c.primary_key and c.default is None and c.server_default is None
+            and c.name not in READ_ONLY_FIELDS and c.name not in fields
+        ]
+        if missing:
+            raise InvalidRecord(f'{where}: missing {", ".join(missing)}')
+    return fields
+
+
+def record_id(data: Any, where: str) -> int:
+    """The integer id of a record, given either as the record or on its own."""
+    value = data.get('id') if isinstance(data, dict) else data
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise InvalidRecord(f'{where}: expected an integer id')
+    return value
+
+
+def update_fields(model, data: Any, where: str) -> Dict[str, Any]:
+    """Validate a partial update that names the record it changes by ``id``.
+
+    A ``row_version``, as read from the record, is kept as the version the
+    update expects (see ``repository.apply_batch``).
+    """
+    if not isinstance(data, dict):
+        raise InvalidRecord(f'{where}: expected a JSON object')
+    fields = {'id': record_id(data, where)}
+    changes = {name: value for name, value in data.items() if name not in ('id', VERSION_FIELD)}
+    fields.update(record_fields(model, changes, partial=True, where=where))
+    if VERSION_FIELD in data and VERSION_FIELD in model.__table__.c:
+        version = data[VERSION_FIELD]
+        if version is not None:
+            if isinstance(version, bool) or not isinstance(version, int):
+                raise InvalidRecord(f'{where}: {VERSION_FIELD} must be an integer')
+            fields[VERSION_FIELD] = version
+    elif VERSION_FIELD in data:
+        raise InvalidRecord(f'{where}: unknown field {VERSION_FIELD}')
+    return fields
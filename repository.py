@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Any, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+import versions
+from models import Asset, InventoryItem
+
+ASSET_TEXT_FIELDS = (
+    'asset_code', 'sub_code', 'budget_year', 'name', 'details',
+    'serial_number', 'category', 'unit', 'note',
+)
+ITEM_TEXT_FIELDS = ('name', 'location', 'note')
+# Text fields a form may not leave blank (NOT NULL columns).
+ASSET_REQUIRED_FIELDS = ('asset_code', 'name')
+ITEM_REQUIRED_FIELDS = ('name',)
+
+
+def _text(value: Optional[str]) -> Optional[str]:
+    value = value.strip() if value else ''
+    return value or None
+
+
+def _date(value: Optional[str]) -> Optional[date]:
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def _float(value: Optional[str]) -> Optional[float]:
+    return float(value) if value else None
+
+
+def _int(value: Optional[str], default: int) -> int:
+    return int(value) if value else default
+
+
+def _require(fields: dict, names: Sequence[str]) -> None:
+    blank = [name for name in names if name in fields and fields[name] is None]
+    if blank:
+        raise ValueError(f'{", ".join(blank)} may not be blank')
+
+
+def asset_fields(form: Mapping[str, str]) -> dict:
+    """Convert submitted strings into Asset column values.
+
+    Raises ``ValueError`` when a number or date cannot be parsed, or a
+    required field is blank.
+    """
+    fields = {name: _text(form.get(name)) for name in ASSET_TEXT_FIELDS if name in form}
+    _require(fields, ASSET_REQUIRED_FIELDS)
+    if 'quantity' in form:
+        fields['quantity'] = _int(form.get('quantity'), 1)
+    if 'acquisition_date' in form:
+        fields['acquisition_date'] = _date(form.get('acquisition_date'))
+    if 'price' in form:
+        fields['price'] = _float(form.get('price'))
+    return fields
+
+
+def item_fields(form: Mapping[str, str]) -> dict:
+    fields = {name: _text(form.get(name)) for name in ITEM_TEXT_FIELDS if name in form}
+    _require(fields, ITEM_REQUIRED_FIELDS)
+    if 'quantity' in form:
+        fields['quantity'] = _int(form.get('quantity'), 0)
+    return fields
+
+
+def iter_assets(session: Session, chunk_size: int = 1000) -> Iterator[Asset]:
+    stmt = select(Asset).order_by(Asset.id).execution_options(yield_per=chunk_size)
+    return iter(session.execute(stmt).scalars())
+
+
+def get_asset(session: Session, asset_id: int) -> Optional[Asset]:
+    return session.get(Asset, asset_id)
+
+
+def create_asset(session: Session, **fields: Any) -> Asset:
+    asset = Asset(**fields)
+    session.add(asset)
+    session.commit()
+    return asset
+
+
+def update_asset(session: Session, asset: Asset, **fields: Any) -> Asset:
+    for name, value in fields.items():
+        setattr(asset, name, value)
+    session.commit()
+    return asset
+
+
+def delete_asset(session: Session, asset: Asset) -> None:
+    session.delete(asset)
+    session.commit()
+
+
+def get_item(session: Session, item_id: int) -> Optional[InventoryItem]:
+    return session.get(InventoryItem, item_id)
+
+
+def create_item(session: Session, commit: bool = True, **fields: Any) -> InventoryItem:
+    """Add an item; with ``commit=False`` it is only flushed, to commit with later writes."""
+    item = InventoryItem(**fields)
+    session.add(item)
+    if commit:
+        session.commit()
+    else:
+        session.flush()
+    return item
+
+
+def update_item(session: Session, item: InventoryItem, commit: bool = True, **fields: Any) -> InventoryItem:
+    """Change an item; with ``commit=False`` the change waits for the caller's commit."""
+    for name, value in fields.items():
+        setattr(item, name, value)
+    if commit:
+        session.commit()
+    return item
+
+
+def delete_item(session: Session, item: InventoryItem) -> None:
+    session.delete(item)
+    session.commit()
+
+
+class BatchResult(NamedTuple):
+    created: List[int]
+    updated: int
+    deleted: int
+
+
+class StaleRecords(Exception):
+    """Updates expected a ``row_version`` that the records no longer have."""
+
+    def __init__(self, ids: List[int]):
+        super().__init__(f'Changed since they were read: {", ".join(map(str, ids))}')
+        self.ids = ids
+
+
+def missing_ids(session: Session, model, ids: Iterable[int]) -> List[int]:
+    wanted = set(ids)
+    if not wanted:
+        return []
+    found = set(session.scalars(select(model.id).where(model.id.in_(wanted))))
+    return sorted(wanted - found)
+
+
+def apply_batch(
+    session: Session,
+    model,
+    create: Sequence[Mapping[str, Any]] = (),
+    update_rows: Sequence[Mapping[str, Any]] = (),
+    delete_ids: Sequence[int] = (),
+) -> BatchResult:
+    """Create, update and delete many ``model`` rows in one transaction.
+
+    ``update_rows`` hold an ``id`` and the columns to change, and may hold
+    the ``row_version`` they were read at. Raises ``LookupError`` with the
+    ids that do not exist, or ``StaleRecords`` with those whose version has
+    moved on, writing nothing. The statements bypass the unit of work, so
+    the table version is bumped here rather than by the flush listener.
+    """
+    try:
+        missing = missing_ids(session, model, [row['id'] for row in update_rows] + list(delete_ids))
+        if missing:
+            raise LookupError(missing)
+        created: List[int] = []
+        if create:
+            stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+            created = list(session.scalars(stmt, [dict(row) for row in create]))
+        expected = {row['id']: row['row_version'] for row in update_rows if row.get('row_version') is not None}
+        changes = [
+            {name: value for name, value in row.items() if name != 'row_version'}
+            for row in update_rows if set(row) - {'id', 'row_version'}
+        ]
+        if changes:
+            session.execute(update(model), changes)
+        if expected:
+            # Checked after writing, under the write lock: every update
+            # increments row_version, so an unchanged record is one step on.
+            changed = {row['id'] for row in changes}
+            stmt = select(model.id, model.row_version).where(model.id.in_(expected))
+            stale = sorted(
+                row_id for row_id, version in session.execute(stmt)
+                if version != expected[row_id] + (row_id in changed)
+            )
+            if stale:
+                raise StaleRecords(stale)
+        if delete_ids:
+            stmt = delete(model).where(model.id.in_(set(delete_ids)))
+            session.execute(stmt, execution_options={'synchronize_session': False})
+        if create or update_rows or delete_ids:
+            versions.bump(session.connection(), model.__tablename__)
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    return BatchResult(created=created, updated=len(update_rows), deleted=len(set(delete_ids)))
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, or_, select
+
+import versions
+from models import Asset
+
+# Scanned codes whose matches are remembered, per process.
+CACHE_SIZE = 4096
+# Labels join the asset code and sub code with this, as in 7440-001-0000001/2.
+SUB_CODE_SEPARATOR = '/'
+
+
+class ScanMatch(NamedTuple):
+    id: int
+    asset_code: str
+    sub_code: Optional[str]
+    name: str
+    serial_number: Optional[str]
+    category: Optional[str]
+    unit: Optional[str]
+    quantity: Optional[int]
+
+
+MATCH_COLUMNS = [getattr(Asset, name) for name in ScanMatch._fields]
+
+
+def scan_code(asset_code: str, sub_code: Optional[str] = None) -> str:
+    """The text a label encodes for an asset."""
+    return f'{asset_code}{SUB_CODE_SEPARATOR}{sub_code}' if sub_code else asset_code
+
+
+def lookup_statement(code: str):
+    """Assets whose label or serial number reads exactly ``code``.
+
+    Every alternative is an equality on ``ix_asset_code`` or
+    ``ix_asset_serial_number``, so SQLite answers it with index searches.
+    A bare asset code also finds the sub-numbered parts filed under it.
+    """
+    conditions = [Asset.asset_code == code, Asset.serial_number == code]
+    head, separator, tail = code.rpartition(SUB_CODE_SEPARATOR)
+    if separator and head and tail:
+        conditions.append(and_(Asset.asset_code == head, Asset.sub_code == tail))
+    return select(*MATCH_COLUMNS).where(or_(*conditions)).order_by(Asset.id)
+
+
+class ScanIndex:
+    """Resolve scanned codes to assets, remembering recent answers.
+
+    Answers are kept in a least recently used cache of ``size`` codes and
+    are only reused while the asset table's version (see ``versions``) is
+    the one they were read at, so a repeated scan costs one primary key
+    read and any write to the assets makes every code be looked up again.
+    Safe to share between threads.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._entries: OrderedDict[str, Tuple[ScanMatch, ...]] = OrderedDict()
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, session, code: str) -> List[ScanMatch]:
+        code = code.strip()
+        if not code:
+            return []
+        version = versions.get_version(session, Asset.__tablename__)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            matches = self._entries.get(code)
+            if matches is not None:
+                self._entries.move_to_end(code)
+                self.hits += 1
+                return list(matches)
+            self.misses += 1
+        matches = tuple(ScanMatch(*row) for row in session.execute(lookup_statement(code)))
+        with self._lock:
+            if version == self._version:
+                self._entries[code] = matches
+                if len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return list(matches)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._version = None
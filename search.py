@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import weakref
+from typing import Any, List, Optional, Sequence
+
+from sqlalchemy import column, literal_column, or_, select, table, text
+
+# Asset columns indexed by the asset_fts table, in index order.
+FTS_COLUMNS = ('name', 'details', 'serial_number', 'asset_code', 'sub_code', 'note', 'category')
+# bm25 weights per column above: codes and names matter more than free text.
+FTS_WEIGHTS = (10.0, 1.0, 8.0, 10.0, 6.0, 1.0, 2.0)
+# The trigram tokenizer cannot match terms shorter than this.
+MIN_TERM_LENGTH = 3
+DEFAULT_LIMIT = 50
+
+_columns = ', '.join(FTS_COLUMNS)
+_new_values = ', '.join(f'new.{name}' for name in FTS_COLUMNS)
+_old_values = ', '.join(f'old.{name}' for name in FTS_COLUMNS)
+
+# Trigram tokenizing gives substring matching that works for Thai, which has
+# no spaces between words, as well as for partial asset codes.
+CREATE_TABLE = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS asset_fts USING fts5({_columns}, '
+    "content='asset', content_rowid='id', tokenize='trigram')"
+)
+CREATE_TRIGGERS = (
+    'CREATE TRIGGER IF NOT EXISTS asset_fts_ai AFTER INSERT ON asset BEGIN '
+    f'INSERT INTO asset_fts(rowid, {_columns}) VALUES (new.id, {_new_values}); END',
+    'CREATE TRIGGER IF NOT EXISTS asset_fts_ad AFTER DELETE ON asset BEGIN '
+    f"INSERT INTO asset_fts(asset_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); END",
+    f'CREATE TRIGGER IF NOT EXISTS asset_fts_au AFTER UPDATE OF {_columns} ON asset BEGIN '
+    f"INSERT INTO asset_fts(asset_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f'INSERT INTO asset_fts(rowid, {_columns}) VALUES (new.id, {_new_values}); END',
+)
+
+asset_fts = table('asset_fts', column('rowid'))
+_rank = literal_column(f"bm25(asset_fts, {', '.join(str(w) for w in FTS_WEIGHTS)})")
+_match = text('asset_fts MATCH :query')
+
+_ready = weakref.WeakSet()
+
+
+def create_index(connection) -> None:
+    """Create the FTS table and its sync triggers, filling it on first creation."""
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'asset_fts'")
+    ).first()
+    connection.execute(text(CREATE_TABLE))
+    for ddl in CREATE_TRIGGERS:
+        connection.execute(text(ddl))
+    if not exists:
+        rebuild(connection)
+
+
+def ensure_index(engine) -> None:
+    """Run ``create_index`` once per engine in its own transaction.
+
+    A separate transaction keeps the index even when the caller's session is
+    only reading and gets rolled back.
+    """
+    if engine in _ready:
+        return
+    with engine.begin() as connection:
+        create_index(connection)
+    _ready.add(engine)
+
+
+def rebuild(connection) -> None:
+    """Re-read every asset row into the index."""
+    connection.execute(text("INSERT INTO asset_fts(asset_fts) VALUES ('rebuild')"))
+
+
+def match_expression(query: str) -> Optional[str]:
+    """Turn user input into an FTS5 query that ANDs every term as a phrase.
+
+    Returns ``None`` when a term is too short for the trigram index.
+    """
+    terms = query.split()
+    if not terms or any(len(term) < MIN_TERM_LENGTH for term in terms):
+        return None
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def _like_criteria(model, query: str) -> list:
+    criteria = []
+    for term in query.split():
+        like = f'%{term}%'
+        criteria.append(or_(*(getattr(model, name).ilike(like) for name in FTS_COLUMNS)))
+    return criteria
+
+
+def match_criteria(session, model, query: str) -> list:
+    """Criteria restricting ``model`` to assets matching ``query``, for use in listings."""
+    expression = match_expression(query)
+    if expression is None:
+        return _like_criteria(model, query)
+    ensure_index(session.get_bind())
+    matches = select(asset_fts.c.rowid).where(_match.bindparams(query=expression))
+    return [model.id.in_(matches)]
+
+
+def _ranked(session, model, entity, query: str, limit: Optional[int], criteria: Sequence[Any]):
+    expression = match_expression(query)
+    if expression is None:
+        stmt = select(entity).where(*_like_criteria(model, query), *criteria).order_by(model.id)
+    else:
+        ensure_index(session.get_bind())
+        stmt = (
+            select(entity)
+            .join(asset_fts, asset_fts.c.rowid == model.id)
+            .where(_match.bindparams(query=expression), *criteria)
+            .order_by(_rank)
+        )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return session.execute(stmt).scalars()
+
+
+def search_assets(
+    session,
+    model,
+    query: str,
+    limit: Optional[int] = DEFAULT_LIMIT,
+    criteria: Sequence[Any] = (),
+) -> List[Any]:
+    """Return assets matching ``query``, best matches first."""
+    query = query.strip()
+    if not query:
+        return []
+    return list(_ranked(session, model, model, query, limit, criteria))
+
+
+def search_ids(
+    session,
+    model,
+    query: str,
+    limit: Optional[int] = None,
+    criteria: Sequence[Any] = (),
+) -> List[int]:
+    """Like ``search_assets`` but return only the ids, which is much cheaper for big result sets."""
+    query = query.strip()
+    if not query:
+        return []
+    return list(_ranked(session, model, model.id, query, limit, criteria))
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import os
+import sys
+from typing import Any, Dict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BIND = '127.0.0.1:8000'
+DEFAULT_THREADS = 4
+DEFAULT_PID_FILE = os.path.join(BASE_DIR, 'instance', 'serve.pid')
+# Where the workers share their /metrics series; emptied on start.
+METRICS_DIR = os.path.join(BASE_DIR, 'instance', 'metrics')
+# Workers finish in-flight requests for this long on reload or shutdown.
+GRACEFUL_TIMEOUT = 30
+# Replace each worker after this many requests (plus jitter) to bound memory.
+MAX_REQUESTS = 5000
+
+
+def default_workers() -> int:
+    # SQLite takes one writer at a time, so processes beyond the core count
+    # only add lock waits; threads cover requests waiting on I/O.
+    return os.cpu_count() or 1
+
+
+def _post_fork(server, worker) -> None:
+    import database
+
+    # SQLite connections opened while preloading must not cross a fork.
+    database.dispose_engines()
+
+
+def _reset_metrics_dir(directory: str) -> None:
+    # Counters start again from zero with the server, as they would in one process.
+    os.makedirs(directory, exist_ok=True)
+    for entry in os.scandir(directory):
+        if entry.name.endswith(('.json', '.tmp')):
+            os.remove(entry.path)
+
+
+def run_gunicorn(options: Dict[str, Any]) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for name, value in options.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            from app import app
+
+            return app
+
+    Application().run()
+
+
+def run_waitress(bind: str, threads: int) -> None:
+    import waitress
+
+    from app import app
+
+    waitress.serve(app, listen=bind, threads=threads)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run the inventory web app with a production WSGI server')
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'waitress'), default='auto',
+                        help='gunicorn (Linux/macOS, several processes) or waitress (any OS, one process); '
+                             'auto picks the first one installed')
+    parser.add_argument('--bind', default=os.environ.get('INVENTORY_BIND', DEFAULT_BIND), help='host:port to listen on')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('INVENTORY_WORKERS', 0)) or default_workers(),
+                        help='worker processes (gunicorn only)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('INVENTORY_THREADS', DEFAULT_THREADS)),
+                        help='request threads per worker')
+    parser.add_argument('--timeout', type=int, default=120, help='restart a worker that stops responding for this long')
+    parser.add_argument('--no-preload', action='store_true',
+                        help='import the app in each worker instead of once before forking, so a HUP reload '
+                             'picks up new code')
+    parser.add_argument('--pid-file', default=DEFAULT_PID_FILE, help='where gunicorn writes its process id')
+    args = parser.parse_args()
+
+    server = args.server
+    if server == 'auto':
+        server = 'gunicorn' if importlib.util.find_spec('gunicorn') else 'waitress'
+    if importlib.util.find_spec(server) is None:
+        sys.exit(f'{server} is not installed; run: pip install {server}')
+    if server == 'waitress':
+        run_waitress(args.bind, args.threads)
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(args.pid_file)), exist_ok=True)
+    _reset_metrics_dir(os.environ.setdefault('INVENTORY_METRICS_DIR', METRICS_DIR))
+    run_gunicorn({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'timeout': args.timeout,
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'max_requests': MAX_REQUESTS,
+        'max_requests_jitter': MAX_REQUESTS // 10,
+        'preload_app': not args.no_preload,
+        'post_fork': _post_fork,
+        'pidfile': args.pid_file,
+    })
+
+
+if __name__ == '__main__':
+    main()
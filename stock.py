@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import Column, Float, Index, Integer, MetaData, String, Table, Text, func, insert, select, text
+
+import versions
+from models import InventoryItem
+
+KINDS = ('receive', 'issue', 'transfer', 'adjust')
+# Posting takes a snapshot once this many movements, or this much time, have
+# passed since the last one, so point-in-time queries replay a bounded tail.
+SNAPSHOT_EVERY = 10000
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+metadata = MetaData()
+stock_movement = Table(
+    'stock_movement',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('item_id', Integer, nullable=False),
+    Column('kind', String(20), nullable=False),
+    # Signed change to the item's quantity and the quantity right after it.
+    Column('quantity', Integer, nullable=False),
+    Column('balance', Integer, nullable=False),
+    Column('location', String(100)),
+    # The other location of a transfer.
+    Column('counterpart', String(100)),
+    Column('note', Text),
+    Column('username', String(80)),
+    Column('created', Float, nullable=False),
+    Index('ix_stock_movement_item', 'item_id'),
+    Index('ix_stock_movement_created', 'created'),
+)
+stock_snapshot = Table(
+    'stock_snapshot',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('taken', Float, nullable=False),
+    # Movements up to and including this id are part of the snapshot.
+    Column('last_movement', Integer, nullable=False),
+    Index('ix_stock_snapshot_taken', 'taken'),
+)
+stock_snapshot_line = Table(
+    'stock_snapshot_line',
+    metadata,
+    Column('snapshot_id', Integer, primary_key=True),
+    Column('item_id', Integer, primary_key=True),
+    Column('quantity', Integer, nullable=False),
+)
+
+
+# Holds a row only while post() runs. SQLite runs one write transaction at a
+# time, so the triggers below can tell ledger updates from other writes.
+stock_posting = Table('stock_posting', metadata, Column('id', Integer, primary_key=True))
+
+_NOW = "(julianday('now') - 2440587.5) * 86400.0"
+_RECORD = (
+    'INSERT INTO stock_movement (item_id, kind, quantity, balance, location, note, created) '
+    "VALUES (new.id, '{kind}', {change}, coalesce(new.quantity, 0), new.location, '{note}', " + _NOW + ');'
+)
+# Quantities written outside the ledger (new items, imports, the JSON API)
+# are recorded as movements too, so point-in-time stock stays complete.
+CREATE_TRIGGERS = (
+    'CREATE TRIGGER IF NOT EXISTS stock_movement_item_ai AFTER INSERT ON inventory_item '
+    'WHEN coalesce(new.quantity, 0) <> 0 BEGIN '
+    + _RECORD.format(kind='receive', change='new.quantity', note='Opening stock') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS stock_movement_item_au AFTER UPDATE OF quantity ON inventory_item '
+    'WHEN coalesce(new.quantity, 0) <> coalesce(old.quantity, 0) AND NOT EXISTS (SELECT 1 FROM stock_posting) BEGIN '
+    + _RECORD.format(kind='adjust', change='coalesce(new.quantity, 0) - coalesce(old.quantity, 0)', note='Edited')
+    + ' END',
+)
+
+
+class StockError(ValueError):
+    pass
+
+
+class Movement(NamedTuple):
+    """A stock change to post.
+
+    ``quantity`` is positive for receipts, issues and transfers, and the
+    signed change for adjustments. Transfers move stock to the item of the
+    same name at ``to_location``, which is created when missing.
+    """
+
+    item_id: int
+    kind: str
+    quantity: int
+    to_location: Optional[str] = None
+    note: Optional[str] = None
+
+
+_APPLY = text(
+    'UPDATE inventory_item SET quantity = coalesce(quantity, 0) + :delta WHERE id = :id RETURNING quantity'
+)
+
+
+def check(movement: Movement) -> Movement:
+    """Validate one movement, raising ``StockError``."""
+    if movement.kind not in KINDS:
+        raise StockError(f'Unknown movement kind: {movement.kind}')
+    if isinstance(movement.quantity, bool) or not isinstance(movement.quantity, int):
+        raise StockError('Quantity must be a whole number')
+    if movement.kind == 'adjust':
+        if not movement.quantity:
+            raise StockError('An adjustment must change the quantity')
+    elif movement.quantity <= 0:
+        raise StockError(f'A {movement.kind} quantity must be positive')
+    if movement.kind == 'transfer' and not (movement.to_location or '').strip():
+        raise StockError('A transfer needs a destination location')
+    return movement
+
+
+def _transfer_target(connection, name: str, location: str) -> int:
+    target = connection.execute(
+        select(InventoryItem.id)
+        .where(InventoryItem.name == name, InventoryItem.location == location)
+        .order_by(InventoryItem.id)
+        .limit(1)
+    ).scalar()
+    if target is None:
+        target = connection.execute(
+            insert(InventoryItem).values(name=name, location=location, quantity=0).returning(InventoryItem.id)
+        ).scalar()
+    return target
+
+
+def post(session, movements: Iterable[Movement], username: Optional[str] = None) -> List[int]:
+    """Apply ``movements`` in order in one transaction and return their ids.
+
+    Each item's quantity changes with a single ``quantity = quantity + ?``
+    update, so concurrent postings never lose each other's changes. Raises
+    ``StockError``, writing nothing, for unknown items or when any movement
+    would take an item below zero.
+    """
+    movements = [check(movement) for movement in movements]
+    if not movements:
+        return []
+    now = time.time()
+    try:
+        connection = session.connection()
+        connection.execute(insert(stock_posting).values(id=1))
+        item_ids = {movement.item_id for movement in movements}
+        items = {
+            row.id: row
+            for row in connection.execute(
+                select(InventoryItem.id, InventoryItem.name, InventoryItem.location).where(InventoryItem.id.in_(item_ids))
+            )
+        }
+        missing = sorted(item_ids - set(items))
+        if missing:
+            raise StockError(f'No inventory item with id {", ".join(map(str, missing))}')
+
+        # (item id, signed change, kind, counterpart, note) in posting order.
+        lines = []
+        for movement in movements:
+            item = items[movement.item_id]
+            if movement.kind == 'transfer':
+                to_location = movement.to_location.strip()
+                if to_location == (item.location or ''):
+                    raise StockError('A transfer must go to a different location')
+                target = _transfer_target(connection, item.name, to_location)
+                lines.append((item.id, -movement.quantity, 'transfer', to_location, movement.note))
+                lines.append((target, movement.quantity, 'transfer', item.location, movement.note))
+            else:
+                sign = -1 if movement.kind == 'issue' else 1
+                lines.append((item.id, sign * movement.quantity, movement.kind, None, movement.note))
+
+        totals: Dict[int, int] = defaultdict(int)
+        for item_id, delta, *_ in lines:
+            totals[item_id] += delta
+        balances = {}
+        for item_id, total in totals.items():
+            final = connection.execute(_APPLY, {'id': item_id, 'delta': total}).scalar()
+            balances[item_id] = final - total
+        locations = dict(connection.execute(
+            select(InventoryItem.id, InventoryItem.location).where(InventoryItem.id.in_(totals))
+        ).all())
+
+        rows = []
+        for item_id, delta, kind, counterpart, note in lines:
+            balances[item_id] += delta
+            if balances[item_id] < 0:
+                raise StockError(f'Not enough stock of item {item_id}')
+            rows.append({
+                'item_id': item_id,
+                'kind': kind,
+                'quantity': delta,
+                'balance': balances[item_id],
+                'location': locations[item_id],
+                'counterpart': counterpart,
+                'note': note,
+                'username': username,
+                'created': now,
+            })
+        stmt = insert(stock_movement).returning(stock_movement.c.id, sort_by_parameter_order=True)
+        ids = list(connection.execute(stmt, rows).scalars())
+        versions.bump(connection, InventoryItem.__tablename__)
+        connection.execute(stock_posting.delete())
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    maybe_snapshot(session)
+    return ids
+
+
+def adjust_to(session, item_id: int, quantity: int, expected: int, username: Optional[str] = None) -> Optional[int]:
+    """Post the change from ``expected`` (the quantity a form showed) to ``quantity``.
+
+    Changes made by others since the form was loaded are kept.
+    """
+    if quantity == expected:
+        return None
+    return post(session, [Movement(item_id, 'adjust', quantity - expected)], username)[0]
+
+
+def _snapshot(connection) -> int:
+    # One statement opens the write transaction and reads the last movement,
+    # so no posting can slip in between it and the copied quantities.
+    snapshot_id = connection.execute(text(
+        'INSERT INTO stock_snapshot (taken, last_movement) '
+        'SELECT :now, coalesce(max(id), 0) FROM stock_movement RETURNING id'
+    ), {'now': time.time()}).scalar()
+    connection.execute(text(
+        'INSERT INTO stock_snapshot_line (snapshot_id, item_id, quantity) '
+        'SELECT :snapshot, id, coalesce(quantity, 0) FROM inventory_item'
+    ), {'snapshot': snapshot_id})
+    return snapshot_id
+
+
+def take_snapshot(session) -> int:
+    """Record every item's quantity and return the snapshot id."""
+    try:
+        snapshot_id = _snapshot(session.connection())
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    return snapshot_id
+
+
+def maybe_snapshot(session) -> Optional[int]:
+    latest = session.execute(
+        select(stock_snapshot.c.taken, stock_snapshot.c.last_movement).order_by(stock_snapshot.c.id.desc()).limit(1)
+    ).first()
+    if latest is not None:
+        last_movement = session.execute(select(func.max(stock_movement.c.id))).scalar() or 0
+        if last_movement - latest.last_movement < SNAPSHOT_EVERY and time.time() - latest.taken < SNAPSHOT_MAX_AGE:
+            return None
+    return take_snapshot(session)
+
+
+def stock_at(session, when: float, location: Optional[str] = None) -> List[tuple]:
+    """``(item_id, quantity)`` for every item as it stood at Unix time ``when``.
+
+    Starts from the last snapshot taken by then and replays only the
+    movements after it. Raises ``StockError`` before the first snapshot.
+    """
+    snapshot = session.execute(
+        select(stock_snapshot.c.id, stock_snapshot.c.last_movement)
+        .where(stock_snapshot.c.taken <= when)
+        .order_by(stock_snapshot.c.taken.desc())
+        .limit(1)
+    ).first()
+    if snapshot is None:
+        raise StockError('No stock history that early')
+    params = {'snapshot': snapshot.id, 'last': snapshot.last_movement, 'when': when}
+    located = ''
+    if location is not None:
+        params['location'] = location
+        located = 'JOIN inventory_item ON inventory_item.id = levels.item_id WHERE inventory_item.location = :location '
+    return list(session.execute(text(
+        'SELECT levels.item_id, sum(levels.quantity) FROM ('
+        'SELECT item_id, quantity FROM stock_snapshot_line WHERE snapshot_id = :snapshot '
+        'UNION ALL '
+        'SELECT item_id, quantity FROM stock_movement WHERE id > :last AND created <= :when'
+        f') AS levels {located}GROUP BY levels.item_id ORDER BY levels.item_id'
+    ), params))
+
+
+def history(session, item_id: int, limit: int = 20) -> List[tuple]:
+    """The latest movements of one item, newest first."""
+    stmt = (
+        select(
+            stock_movement.c.created,
+            stock_movement.c.kind,
+            stock_movement.c.quantity,
+            stock_movement.c.balance,
+            stock_movement.c.counterpart,
+            stock_movement.c.note,
+            stock_movement.c.username,
+        )
+        .where(stock_movement.c.item_id == item_id)
+        .order_by(stock_movement.c.id.desc())
+        .limit(limit)
+    )
+    return list(session.execute(stmt))
+
+
+def install(connection) -> None:
+    """Create the ledger tables and triggers; a first snapshot anchors history here."""
+    metadata.create_all(connection)
+    for ddl in CREATE_TRIGGERS:
+        connection.execute(text(ddl))
+    if connection.execute(select(stock_snapshot.c.id).limit(1)).first() is None:
+        _snapshot(connection)
@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+import csv
+import itertools
+import time
+from collections import Counter
+from typing import IO, Any, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from exports import EXPORT_COLUMNS
+from models import Asset, InventoryItem
+from scan import scan_code
+
+STATUSES = ('ok', 'missing', 'mismatch', 'surplus')
+VARIANCES = STATUSES[1:]
+# Count lines are summed in memory and written this many lines at a time,
+# so memory stays bounded however long the count file is.
+BATCH_LINES = 100000
+# JSON count lines accepted per API request; CSV bodies are streamed.
+MAX_POSTED_LINES = 10000
+
+# Counted keys: a scanned label or serial number, an explicit serial number,
+# or an inventory item id.
+CODE, SERIAL, ITEM = 'code', 'serial', 'item'
+
+metadata = MetaData()
+stocktake = Table(
+    'stocktake',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(200), nullable=False),
+    Column('created', Float, nullable=False),
+    Column('username', String(80)),
+    # Count lines received so far, before summing repeats.
+    Column('lines', Integer, nullable=False, default=0),
+)
+stocktake_count = Table(
+    'stocktake_count',
+    metadata,
+    Column('stocktake_id', Integer, primary_key=True),
+    Column('kind', String(10), primary_key=True),
+    Column('key', Text, primary_key=True),
+    Column('quantity', Integer, nullable=False),
+)
+
+
+class CountError(ValueError):
+    pass
+
+
+class Stocktake(NamedTuple):
+    id: int
+    name: str
+    created: float
+    username: Optional[str]
+    lines: int
+
+
+class Variance(NamedTuple):
+    """One register record or unknown counted code, and how its count compares.
+
+    Assets are placed by ``unit`` (their ``location``) and ``category``;
+    inventory items by their location only.
+    """
+
+    kind: str
+    record_id: Optional[int]
+    code: str
+    name: Optional[str]
+    category: Optional[str]
+    location: Optional[str]
+    expected: int
+    counted: int
+    status: str
+
+
+class GroupSummary(NamedTuple):
+    kind: str
+    category: Optional[str]
+    location: Optional[str]
+    records: int
+    ok: int
+    missing: int
+    mismatch: int
+    surplus: int
+    expected: int
+    counted: int
+
+
+def install(connection) -> None:
+    metadata.create_all(connection)
+
+
+def create(session, name: str, username: Optional[str] = None) -> int:
+    name = (name or '').strip()
+    if not name:
+        raise CountError('A stocktake needs a name')
+    stocktake_id = session.execute(
+        insert(stocktake).values(name=name, created=time.time(), username=username, lines=0).returning(stocktake.c.id)
+    ).scalar()
+    session.commit()
+    return stocktake_id
+
+
+def get(session, stocktake_id: int) -> Optional[Stocktake]:
+    row = session.execute(select(stocktake).where(stocktake.c.id == stocktake_id)).first()
+    return None if row is None else Stocktake(*row)
+
+
+def list_all(session) -> List[Stocktake]:
+    return [Stocktake(*row) for row in session.execute(select(stocktake).order_by(stocktake.c.id.desc()))]
+
+
+# Column names accepted in count files besides the attribute names, so a
+# filled-in asset export can be read back as counts.
+HEADER_ALIASES = {header: attr for header, attr in EXPORT_COLUMNS}
+HEADER_ALIASES.update({'counted': 'quantity', 'count': 'quantity', 'id': 'item_id'})
+KEY_COLUMNS = ('code', 'asset_code', 'serial_number', 'item_id')
+
+
+def _text(value: Any) -> str:
+    return '' if value is None else str(value).strip()
+
+
+def _quantity(value: Any) -> int:
+    if value is None or _text(value) == '':
+        return 1
+    try:
+        quantity = value if isinstance(value, int) and not isinstance(value, bool) else int(_text(value))
+    except ValueError:
+        quantity = -1
+    if quantity < 0:
+        raise CountError(f'Quantity must be a whole number, got {value!r}')
+    return quantity
+
+
+def count_key(record: Mapping[str, Any]) -> Tuple[str, str, int]:
+    """``(kind, key, quantity)`` for one count line, or raise ``CountError``.
+
+    A line names a scanned ``code`` (label or serial number), an
+    ``asset_code`` with an optional ``sub_code``, a ``serial_number`` or an
+    inventory ``item_id``, with an optional ``quantity`` (default 1).
+    """
+    quantity = _quantity(record.get('quantity'))
+    code = _text(record.get('code'))
+    if code:
+        return CODE, code, quantity
+    asset_code = _text(record.get('asset_code'))
+    if asset_code:
+        return CODE, scan_code(asset_code, _text(record.get('sub_code'))), quantity
+    serial = _text(record.get('serial_number'))
+    if serial:
+        return SERIAL, serial, quantity
+    item_id = _text(record.get('item_id'))
+    if item_id:
+        if not item_id.isdigit():
+            raise CountError(f'item_id must be a number, got {item_id!r}')
+        return ITEM, str(int(item_id)), quantity
+    raise CountError(f'A count line needs one of: {", ".join(KEY_COLUMNS)}')
+
+
+def read_counts(stream: IO[str]) -> Iterator[Dict[str, str]]:
+    """Count lines from CSV text with a header row, or one scanned code per line.
+
+    Headers may be attribute names (``code``, ``asset_code``, ``sub_code``,
+    ``serial_number``, ``item_id``, ``quantity``) or the Thai export headers.
+    A file whose first line names none of the key columns is a plain list
+    of codes, as scanners save them.
+    """
+    first = stream.readline().lstrip('\ufeff')
+    if not first:
+        return
+    header = [HEADER_ALIASES.get(name.strip(), name.strip()) for name in next(csv.reader([first]))]
+    if not set(header) & set(KEY_COLUMNS):
+        for line in itertools.chain([first], stream):
+            code = line.strip()
+            if code:
+                yield {'code': code}
+        return
+    for values in csv.reader(stream):
+        if any(value.strip() for value in values):
+            yield dict(zip(header, values))
+
+
+_UPSERT = sqlite_insert(stocktake_count)
+_UPSERT = _UPSERT.on_conflict_do_update(
+    index_elements=[stocktake_count.c.stocktake_id, stocktake_count.c.kind, stocktake_count.c.key],
+    set_={'quantity': stocktake_count.c.quantity + _UPSERT.excluded.quantity},
+)
+
+
+def add_counts(session, stocktake_id: int, records: Iterable[Mapping[str, Any]], batch_lines: int = BATCH_LINES) -> int:
+    """Add count lines to a stocktake in one transaction; returns how many were read.
+
+    Lines are read once, as they arrive. Repeats of a key, such as the same
+    label scanned for each unit, are summed in a hash table that is written
+    out every ``batch_lines`` lines. Nothing is written if any line is
+    invalid; the ``CountError`` names the line.
+    """
+    if get(session, stocktake_id) is None:
+        raise LookupError(stocktake_id)
+    connection = session.connection()
+    pending: Counter = Counter()
+    lines = 0
+
+    def flush() -> None:
+        if pending:
+            connection.execute(_UPSERT, [
+                {'stocktake_id': stocktake_id, 'kind': kind, 'key': key, 'quantity': quantity}
+                for (kind, key), quantity in pending.items()
+            ])
+            pending.clear()
+
+    try:
+        for lines, record in enumerate(records, 1):
+            try:
+                kind, key, quantity = count_key(record)
+            except CountError as exc:
+                raise CountError(f'Count line {lines}: {exc}') from None
+            pending[kind, key] += quantity
+            if lines % batch_lines == 0:
+                flush()
+        flush()
+        connection.execute(
+            stocktake.update().where(stocktake.c.id == stocktake_id).values(lines=stocktake.c.lines + lines)
+        )
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    return lines
+
+
+def _counted(session, stocktake_id: int) -> Dict[str, Dict[str, int]]:
+    counted: Dict[str, Dict[str, int]] = {CODE: {}, SERIAL: {}, ITEM: {}}
+    rows = session.execute(
+        select(stocktake_count.c.kind, stocktake_count.c.key, stocktake_count.c.quantity)
+        .where(stocktake_count.c.stocktake_id == stocktake_id)
+    )
+    for kind, key, quantity in rows:
+        counted[kind][key] = quantity
+    return counted
+
+
+def _status(expected: int, counted: int) -> str:
+    if counted == expected:
+        return 'ok'
+    return 'missing' if counted == 0 else 'mismatch'
+
+
+def reconcile(session, stocktake_id: int, chunk_size: int = 1000) -> Iterator[Variance]:
+    """Compare a stocktake's counts with the register, one line per record.
+
+    The summed counts (one entry per distinct code, not per scan) are held
+    in hash tables and the asset and item tables are streamed past them
+    once. An asset takes the count of its label, or failing that of its
+    serial number; counts nobody claimed come last as ``surplus``.
+    """
+    counted = _counted(session, stocktake_id)
+    codes, serials, items = counted[CODE], counted[SERIAL], counted[ITEM]
+    stmt = (
+        select(Asset.id, Asset.asset_code, Asset.sub_code, Asset.serial_number, Asset.name,
+               Asset.category, Asset.unit, Asset.quantity)
+        .order_by(Asset.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for row_id, asset_code, sub_code, serial, name, category, unit, quantity in session.execute(stmt):
+        label = scan_code(asset_code, sub_code)
+        count = codes.pop(label, None)
+        if serial:
+            by_serial = (serials.pop(serial, None), codes.pop(serial, None))
+            if count is None and by_serial != (None, None):
+                count = sum(value or 0 for value in by_serial)
+        expected = quantity or 0
+        count = count or 0
+        yield Variance('asset', row_id, label, name, category, unit, expected, count, _status(expected, count))
+
+    stmt = (
+        select(InventoryItem.id, InventoryItem.name, InventoryItem.location, InventoryItem.quantity)
+        .order_by(InventoryItem.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for row_id, name, location, quantity in session.execute(stmt):
+        expected = quantity or 0
+        count = items.pop(str(row_id), 0)
+        yield Variance('item', row_id, str(row_id), name, None, location, expected, count, _status(expected, count))
+
+    for kind, keys in ((CODE, codes), (SERIAL, serials), (ITEM, items)):
+        for key, count in sorted(keys.items()):
+            yield Variance('item' if kind == ITEM else 'asset', None, key, None, None, None, 0, count, 'surplus')
+
+
+def summarize(variances: Iterable[Variance]) -> List[GroupSummary]:
+    """Totals of each status per kind, category and location."""
+    groups: Dict[Tuple[str, Optional[str], Optional[str]], List[int]] = {}
+    for line in variances:
+        totals = groups.setdefault((line.kind, line.category, line.location), [0] * 7)
+        totals[0] += 1
+        totals[1 + STATUSES.index(line.status)] += 1
+        totals[5] += line.expected
+        totals[6] += line.counted
+    return [
+        GroupSummary(kind, category, location, *totals)
+        for (kind, category, location), totals in sorted(
+            groups.items(), key=lambda item: tuple('' if value is None else value for value in item[0])
+        )
+    ]
+
+
+class Report(NamedTuple):
+    summary: List[GroupSummary]
+    variances: List[Variance]
+
+
+def report(session, stocktake_id: int, statuses: Iterable[str] = VARIANCES) -> Report:
+    """The per-group summary of every line and the lines with one of ``statuses``."""
+    statuses = set(statuses)
+    kept: List[Variance] = []
+
+    def keep(lines: Iterable[Variance]) -> Iterator[Variance]:
+        for line in lines:
+            if line.status in statuses:
+                kept.append(line)
+            yield line
+
+    summary = summarize(keep(reconcile(session, stocktake_id)))
+    return Report(summary, kept)
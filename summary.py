@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+from typing import List
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, select, text
+
+# Asset columns that asset_summary keeps totals for.
+ASSET_DIMENSIONS = ('category', 'budget_year', 'unit')
+
+metadata = MetaData()
+asset_summary = Table(
+    'asset_summary',
+    metadata,
+    Column('dimension', String(20), primary_key=True),
+    Column('value', String(100), primary_key=True),
+    Column('asset_count', Integer, nullable=False, default=0),
+    Column('total_quantity', Integer, nullable=False, default=0),
+    Column('total_value', Float, nullable=False, default=0),
+)
+inventory_summary = Table(
+    'inventory_summary',
+    metadata,
+    Column('location', String(100), primary_key=True),
+    Column('item_count', Integer, nullable=False, default=0),
+    Column('total_quantity', Integer, nullable=False, default=0),
+)
+
+
+def _add_asset(row: str, dimension: str, sign: int) -> str:
+    quantity = f'coalesce({row}.quantity, 0)'
+    return (
+        'INSERT INTO asset_summary (dimension, value, asset_count, total_quantity, total_value) '
+        f"VALUES ('{dimension}', coalesce({row}.{dimension}, ''), {sign}, {sign} * {quantity}, "
+        f'{sign} * {quantity} * coalesce({row}.price, 0)) '
+        'ON CONFLICT (dimension, value) DO UPDATE SET '
+        'asset_count = asset_count + excluded.asset_count, '
+        'total_quantity = total_quantity + excluded.total_quantity, '
+        'total_value = total_value + excluded.total_value;'
+    )
+
+
+def _add_item(row: str, sign: int) -> str:
+    return (
+        'INSERT INTO inventory_summary (location, item_count, total_quantity) '
+        f"VALUES (coalesce({row}.location, ''), {sign}, {sign} * coalesce({row}.quantity, 0)) "
+        'ON CONFLICT (location) DO UPDATE SET '
+        'item_count = item_count + excluded.item_count, '
+        'total_quantity = total_quantity + excluded.total_quantity;'
+    )
+
+
+_asset_new = ' '.join(_add_asset('new', d, 1) for d in ASSET_DIMENSIONS)
+_asset_old = ' '.join(_add_asset('old', d, -1) for d in ASSET_DIMENSIONS)
+_prune_assets = 'DELETE FROM asset_summary WHERE asset_count <= 0;'
+_prune_items = 'DELETE FROM inventory_summary WHERE item_count <= 0;'
+
+# Triggers keep the totals in step with every write, including bulk imports
+# that bypass the ORM, so reading a summary never scans the base tables.
+CREATE_TRIGGERS = (
+    f'CREATE TRIGGER IF NOT EXISTS asset_summary_ai AFTER INSERT ON asset BEGIN {_asset_new} END',
+    f'CREATE TRIGGER IF NOT EXISTS asset_summary_ad AFTER DELETE ON asset BEGIN {_asset_old} {_prune_assets} END',
+    'CREATE TRIGGER IF NOT EXISTS asset_summary_au AFTER UPDATE OF '
+    f"{', '.join(ASSET_DIMENSIONS)}, quantity, price ON asset "
+    f'BEGIN {_asset_old} {_asset_new} {_prune_assets} END',
+    f"CREATE TRIGGER IF NOT EXISTS inventory_summary_ai AFTER INSERT ON inventory_item BEGIN {_add_item('new', 1)} END",
+    'CREATE TRIGGER IF NOT EXISTS inventory_summary_ad AFTER DELETE ON inventory_item '
+    f"BEGIN {_add_item('old', -1)} {_prune_items} END",
+    'CREATE TRIGGER IF NOT EXISTS inventory_summary_au AFTER UPDATE OF location, quantity ON inventory_item '
+    f"BEGIN {_add_item('old', -1)} {_add_item('new', 1)} {_prune_items} END",
+)
+
+
+def install(connection) -> None:
+    """Create the summary tables and triggers, filling them on first creation."""
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'asset_summary'")
+    ).first()
+    metadata.create_all(connection)
+    for ddl in CREATE_TRIGGERS:
+        connection.execute(text(ddl))
+    if not exists:
+        rebuild(connection)
+
+
+def rebuild(connection) -> None:
+    """Recompute every summary row from the base tables."""
+    connection.execute(asset_summary.delete())
+    for dimension in ASSET_DIMENSIONS:
+        connection.execute(text(
+            'INSERT INTO asset_summary (dimension, value, asset_count, total_quantity, total_value) '
+            f"SELECT '{dimension}', coalesce({dimension}, ''), count(*), "
+            'sum(coalesce(quantity, 0)), total(coalesce(quantity, 0) * coalesce(price, 0)) '
+            f"FROM asset GROUP BY coalesce({dimension}, '')"
+        ))
+    connection.execute(inventory_summary.delete())
+    connection.execute(text(
+        'INSERT INTO inventory_summary (location, item_count, total_quantity) '
+        "SELECT coalesce(location, ''), count(*), sum(coalesce(quantity, 0)) "
+        "FROM inventory_item GROUP BY coalesce(location, '')"
+    ))
+
+
+def asset_totals(session, dimension: str) -> List[tuple]:
+    """``(value, asset_count, total_quantity, total_value)`` rows for one dimension."""
+    if dimension not in ASSET_DIMENSIONS:
+        raise ValueError(f'Unknown dimension: {dimension}')
+    stmt = (
+        select(
+            asset_summary.c.value,
+            asset_summary.c.asset_count,
+            asset_summary.c.total_quantity,
+            asset_summary.c.total_value,
+        )
+        .where(asset_summary.c.dimension == dimension)
+        .order_by(asset_summary.c.value)
+    )
+    return list(session.execute(stmt))
+
+
+def inventory_totals(session) -> List[tuple]:
+    """``(location, item_count, total_quantity)`` rows."""
+    stmt = select(
+        inventory_summary.c.location,
+        inventory_summary.c.item_count,
+        inventory_summary.c.total_quantity,
+    ).order_by(inventory_summary.c.location)
+    return list(session.execute(stmt))
@@ -0,0 +1,493 @@
+from __future__ import annotations
+
+import calendar
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import date
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, delete, func, insert, select, type_coerce
+
+import audit
+from models import Asset
+
+# The schema and the cached values need only SQLAlchemy; pandas is loaded by
+# the functions that compute values, so plain list and CLI commands skip it.
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+METHODS = ('straight_line', 'declining_balance')
+DEFAULT_METHOD = 'straight_line'
+# Book value left at the end of an asset's life, per unit, as government
+# registers keep fully depreciated assets at one baht.
+SALVAGE_VALUE = 1.0
+# Useful life in years per category; any other category gets DEFAULT_LIFE.
+# Override with a JSON file named by $INVENTORY_USEFUL_LIFE, e.g.
+# {"ครุภัณฑ์คอมพิวเตอร์": 3, "*": 5} where "*" replaces DEFAULT_LIFE.
+LIVES_ENV = 'INVENTORY_USEFUL_LIFE'
+DEFAULT_LIFE = 5
+DEFAULT_LIVES = {
+    'ครุภัณฑ์คอมพิวเตอร์': 3,
+    'ครุภัณฑ์สำนักงาน': 8,
+    'ครุภัณฑ์การศึกษา': 5,
+    'ครุภัณฑ์วิทยาศาสตร์': 5,
+    'ครุภัณฑ์ยานพาหนะ': 5,
+}
+# Assets read, valued and written per transaction, so a full valuation never
+# keeps other writers waiting for long.
+CHUNK_SIZE = 50000
+# Changed assets revalued per statement when bringing a period up to date.
+IDS_PER_QUERY = 500
+
+PERIOD_PATTERN = re.compile(r'^(\d{4})-(\d{2})$')
+
+metadata = MetaData()
+# One row per period and method whose values are cached.
+valuation_run = Table(
+    'valuation_run',
+    metadata,
+    Column('period', String(7), primary_key=True),
+    Column('method', String(20), primary_key=True),
+    # Fingerprint of the useful-life table the values were computed with.
+    Column('lives', String(40), nullable=False),
+    # Changes up to this change_log sequence number are reflected.
+    Column('through_seq', Integer, nullable=False),
+    # 0 while a full valuation is being written.
+    Column('complete', Integer, nullable=False, default=0),
+    Column('computed', Float, nullable=False),
+)
+asset_valuation = Table(
+    'asset_valuation',
+    metadata,
+    Column('period', String(7), primary_key=True),
+    Column('method', String(20), primary_key=True),
+    Column('asset_id', Integer, primary_key=True),
+    Column('category', String(100)),
+    Column('cost', Float),
+    Column('life', Integer, nullable=False),
+    # Months of depreciation charged, counting the month acquired; NULL
+    # when neither the acquisition date nor the budget year is known.
+    Column('months', Integer),
+    Column('accumulated', Float),
+    Column('book_value', Float),
+)
+
+VALUE_COLUMNS = ('category', 'cost', 'life', 'months', 'accumulated', 'book_value')
+# The acquisition date is read as its stored ISO text and parsed by pandas
+# for the whole batch rather than converted row by row.
+_SOURCE = (Asset.id, Asset.category, Asset.price, Asset.quantity, type_coerce(Asset.acquisition_date, String),
+           Asset.budget_year)
+_SOURCE_NAMES = ('asset_id', 'category', 'price', 'quantity', 'acquisition_date', 'budget_year')
+
+
+class ValuationError(ValueError):
+    pass
+
+
+class LifeTable(NamedTuple):
+    lives: Dict[str, int]
+    default: int = DEFAULT_LIFE
+
+    @property
+    def fingerprint(self) -> str:
+        raw = json.dumps([sorted(self.lives.items()), self.default], ensure_ascii=False)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def life(self, category: Optional[str]) -> int:
+        return self.lives.get(category or '', self.default)
+
+
+class Valuation(NamedTuple):
+    asset_id: int
+    category: Optional[str]
+    cost: Optional[float]
+    life: int
+    months: Optional[int]
+    accumulated: Optional[float]
+    book_value: Optional[float]
+
+
+class CategoryValue(NamedTuple):
+    category: Optional[str]
+    assets: int
+    cost: float
+    accumulated: float
+    book_value: float
+
+
+class RunResult(NamedTuple):
+    revalued: int
+    full: bool
+
+
+def install(connection) -> None:
+    metadata.create_all(connection)
+
+
+# The last table read, keyed by the file it came from and its mtime and size.
+_lives_cache: Dict[Any, LifeTable] = {}
+
+
+def load_lives(path: Optional[str] = None) -> LifeTable:
+    """The useful-life table from ``path`` (default ``$INVENTORY_USEFUL_LIFE``) over the defaults.
+
+    The table is kept until the file's modification time or size changes,
+    so callers on every request cost one ``stat``.
+    """
+    path = path or os.environ.get(LIVES_ENV)
+    key = None
+    if path:
+        info = os.stat(path)
+        key = (path, info.st_mtime_ns, info.st_size)
+    lives = _lives_cache.get(key)
+    if lives is None:
+        lives = _read_lives(path)
+        _lives_cache.clear()
+        _lives_cache[key] = lives
+    return lives
+
+
+def stamp() -> tuple:
+    """What book values depend on besides the assets: the month and the useful lives."""
+    return current_period(), load_lives().fingerprint
+
+
+def _read_lives(path: Optional[str]) -> LifeTable:
+    lives = dict(DEFAULT_LIVES)
+    default = DEFAULT_LIFE
+    if path:
+        with open(path, encoding='utf-8') as handle:
+            configured = json.load(handle)
+        if not isinstance(configured, dict):
+            raise ValuationError(f'{path}: expected an object of category: years')
+        for category, years in configured.items():
+            if not isinstance(years, int) or isinstance(years, bool) or years < 1:
+                raise ValuationError(f'{path}: useful life of {category!r} must be a whole number of years')
+            if category == '*':
+                default = years
+            else:
+                lives[category] = years
+    return LifeTable(lives, default)
+
+
+def current_period(today: Optional[date] = None) -> str:
+    return (today or date.today()).strftime('%Y-%m')
+
+
+def period_end(period: str) -> date:
+    """The last day of ``YYYY-MM``; values are as at the end of the month."""
+    match = PERIOD_PATTERN.match(period or '')
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        raise ValuationError(f'Period must be YYYY-MM, got {period!r}')
+    year, month = int(match.group(1)), int(match.group(2))
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+
+def check_method(method: str) -> str:
+    if method not in METHODS:
+        raise ValuationError(f'Unknown method {method!r} (use one of: {", ".join(METHODS)})')
+    return method
+
+
+def _basis_months(frame: pd.DataFrame) -> np.ndarray:
+    """Months since year 0 of the month each asset went into service, NaN if unknown.
+
+    Assets without an acquisition date start with their budget year, which
+    begins on 1 October of the previous year; years above 2400 are Buddhist era.
+    """
+    import numpy as np
+    import pandas as pd
+
+    acquired = pd.to_datetime(frame['acquisition_date'], errors='coerce')
+    months = (acquired.dt.year * 12 + acquired.dt.month - 1).to_numpy(dtype=float, na_value=np.nan)
+    year = pd.to_numeric(frame['budget_year'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    year = np.where(year > 2400, year - 543, year)
+    return np.where(np.isnan(months), (year - 1) * 12 + 9, months)
+
+
+def _remaining(method: str, elapsed: np.ndarray, life: np.ndarray) -> np.ndarray:
+    """Share of the depreciable amount left after ``elapsed`` years of ``life``.
+
+    Straight line charges it evenly, month by month. Declining balance
+    charges twice the straight-line rate on the balance at the start of each
+    year, spread over its months, and switches to straight line over the
+    remaining years from the first year where that charges more.
+
+    >>> import numpy as np
+    >>> _remaining('straight_line', np.array([0.0, 2.5, 5.0, 9.0]), np.full(4, 5.0)).tolist()
+    [1.0, 0.5, 0.0, 0.0]
+
+    Over five years the declining rate is 40% and the switch comes after
+    year three, leaving the last two years half each of what is left:
+
+    >>> _remaining('declining_balance', np.array([1.0, 2.5, 3.0, 4.0, 5.0]), np.full(5, 5.0)).round(3).tolist()
+    [0.6, 0.288, 0.216, 0.108, 0.0]
+    """
+    import numpy as np
+
+    elapsed = np.clip(elapsed, 0, life)
+    if method == 'straight_line':
+        return 1 - elapsed / life
+    rate = np.minimum(2 / life, 1.0)
+    switch = np.ceil(life / 2)
+    year = np.floor(np.minimum(elapsed, switch))
+    declining = (1 - rate) ** year * (1 - rate * (np.minimum(elapsed, switch) - year))
+    at_switch = (1 - rate) ** switch
+    straight = at_switch * (1 - (elapsed - switch) / np.maximum(life - switch, 1))
+    return np.where(elapsed < switch, declining, np.maximum(straight, 0))
+
+
+def compute(frame: pd.DataFrame, period: str, method: str, lives: LifeTable) -> pd.DataFrame:
+    """Value a batch of assets at the end of ``period``, one vectorized pass.
+
+    ``frame`` has the asset columns ``asset_id``, ``category``, ``price``,
+    ``quantity``, ``acquisition_date`` and ``budget_year``. Assets that came
+    into service after the period are left out. Cost is price times
+    quantity, depreciated down to ``SALVAGE_VALUE`` per unit; assets of
+    unknown age keep their cost.
+
+    A three-year computer bought in January 2020, an asset known only by
+    its Buddhist-era budget year (in service from October 2019), one of
+    unknown age and one bought after the period:
+
+    >>> import pandas as pd
+    >>> frame = pd.DataFrame({
+    ...     'asset_id': [1, 2, 3, 4],
+    ...     'category': ['ครุภัณฑ์คอมพิวเตอร์', None, None, None],
+    ...     'price': [1000.0] * 4,
+    ...     'quantity': [1] * 4,
+    ...     'acquisition_date': ['2020-01-05', None, None, '2023-01-01'],
+    ...     'budget_year': [None, '2563', None, None],
+    ... })
+    >>> values = compute(frame, '2022-12', 'straight_line', LifeTable({'ครุภัณฑ์คอมพิวเตอร์': 3}))
+    >>> values['asset_id'].tolist(), values['months'].tolist(), values['book_value'].round(2).tolist()
+    ([1, 2, 3], [36.0, 39.0, nan], [1.0, 350.65, 1000.0])
+    >>> compute(frame, '2022-12', 'declining_balance', LifeTable({}))['book_value'].round(2).tolist()
+    [216.78, 189.81, 1000.0]
+    """
+    import numpy as np
+    import pandas as pd
+
+    check_method(method)
+    end = period_end(period)
+    basis = _basis_months(frame)
+    months = end.year * 12 + end.month - 1 - basis + 1
+    keep = ~(months < 1)
+    frame, basis, months = frame[keep], basis[keep], months[keep]
+    quantity = pd.to_numeric(frame['quantity'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    cost = pd.to_numeric(frame['price'], errors='coerce').to_numpy(dtype=float, na_value=np.nan) * quantity
+    salvage = np.minimum(SALVAGE_VALUE * quantity, np.where(np.isnan(cost), 0, cost))
+    life = frame['category'].map(lives.life).to_numpy(dtype=float)
+    share = _remaining(method, np.nan_to_num(months, nan=0.0) / 12, life)
+    book = salvage + (cost - salvage) * share
+    return pd.DataFrame({
+        'asset_id': frame['asset_id'].to_numpy(),
+        'category': frame['category'].to_numpy(),
+        'cost': cost,
+        'life': life.astype(int),
+        'months': months,
+        'accumulated': cost - book,
+        'book_value': book,
+    })
+
+
+# Rows are written with the driver's executemany; building a parameter
+# dictionary per row through SQLAlchemy takes longer than the valuation.
+_INSERT = (
+    f'INSERT INTO {asset_valuation.name} (period, method, asset_id, {", ".join(VALUE_COLUMNS)}) '
+    f'VALUES ({", ".join("?" * (len(VALUE_COLUMNS) + 3))})'
+)
+
+
+def _tuples(values: pd.DataFrame) -> Iterator[tuple]:
+    """``compute`` output as plain Python tuples in ``Valuation`` order, NaN as None."""
+    columns = [values['asset_id'].tolist(), values['category'].tolist()]
+    for name in VALUE_COLUMNS[1:]:
+        integer = name in ('life', 'months')
+        columns.append([
+            None if value != value else (int(value) if integer else value) for value in values[name].tolist()
+        ])
+    return zip(*columns)
+
+
+def _write(session, values: pd.DataFrame, period: str, method: str) -> None:
+    if not values.empty:
+        session.connection().exec_driver_sql(_INSERT, [(period, method, *row) for row in _tuples(values)])
+
+
+def _read(session, *criteria, limit: Optional[int] = None) -> pd.DataFrame:
+    import pandas as pd
+
+    stmt = select(*_SOURCE).where(*criteria).order_by(Asset.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return pd.DataFrame.from_records(session.connection().execute(stmt).all(), columns=_SOURCE_NAMES)
+
+
+def _run(session, period: str, method: str):
+    return session.execute(
+        select(valuation_run).where(valuation_run.c.period == period, valuation_run.c.method == method)
+    ).first()
+
+
+def _revalue_ids(session, ids: Sequence[int], period: str, method: str, lives: LifeTable) -> None:
+    frame = _read(session, Asset.id.in_(ids))
+    session.execute(delete(asset_valuation).where(
+        asset_valuation.c.period == period, asset_valuation.c.method == method, asset_valuation.c.asset_id.in_(ids)
+    ))
+    _write(session, compute(frame, period, method, lives), period, method)
+
+
+def refresh(
+    session,
+    period: Optional[str] = None,
+    method: str = DEFAULT_METHOD,
+    lives: Optional[LifeTable] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> RunResult:
+    """Bring the cached values of ``period`` and ``method`` up to date.
+
+    The first valuation of a period, or one after the useful lives change,
+    reads the whole register ``chunk_size`` assets at a time. Later calls
+    revalue only the assets the change log shows were written since, in one
+    transaction, and cost two small queries when nothing was.
+    """
+    period = period or current_period()
+    period_end(period)
+    check_method(method)
+    lives = lives or load_lives()
+    run = _run(session, period, method)
+    latest = audit.latest_seq(session)
+    if run is not None and run.complete and run.lives == lives.fingerprint:
+        if run.through_seq == latest:
+            session.rollback()
+            return RunResult(0, False)
+        try:
+            ids = sorted(audit.changed_ids(session, Asset.__tablename__, run.through_seq))
+        except audit.ChangesPruned:
+            ids = None
+        # After a large import, going through the register in batches is quicker.
+        if ids is not None and len(ids) <= chunk_size:
+            try:
+                for start in range(0, len(ids), IDS_PER_QUERY):
+                    _revalue_ids(session, ids[start:start + IDS_PER_QUERY], period, method, lives)
+                _save_run(session, period, method, lives, latest, complete=True)
+                session.commit()
+            except BaseException:
+                session.rollback()
+                raise
+            return RunResult(len(ids), False)
+    return RunResult(_full(session, period, method, lives, latest, chunk_size), True)
+
+
+def _save_run(session, period: str, method: str, lives: LifeTable, through_seq: int, complete: bool) -> None:
+    session.execute(delete(valuation_run).where(valuation_run.c.period == period, valuation_run.c.method == method))
+    session.execute(insert(valuation_run).values(
+        period=period, method=method, lives=lives.fingerprint, through_seq=through_seq,
+        complete=int(complete), computed=time.time(),
+    ))
+
+
+def _full(session, period: str, method: str, lives: LifeTable, through_seq: int, chunk_size: int) -> int:
+    # Writes that commit while this runs have later sequence numbers, so
+    # the next refresh revalues them.
+    count = 0
+    last_id = 0
+    try:
+        _save_run(session, period, method, lives, through_seq, complete=False)
+        session.commit()
+        while True:
+            frame = _read(session, Asset.id > last_id, limit=chunk_size)
+            last = len(frame) < chunk_size
+            high = int(frame['asset_id'].iloc[-1]) if len(frame) else last_id
+            # Cached values of assets deleted since are dropped with the range.
+            scope = [asset_valuation.c.period == period, asset_valuation.c.method == method,
+                     asset_valuation.c.asset_id > last_id]
+            if not last:
+                scope.append(asset_valuation.c.asset_id <= high)
+            session.execute(delete(asset_valuation).where(*scope))
+            _write(session, compute(frame, period, method, lives), period, method)
+            count += len(frame)
+            last_id = high
+            session.commit()
+            if last:
+                break
+        session.execute(valuation_run.update().where(
+            valuation_run.c.period == period, valuation_run.c.method == method
+        ).values(complete=1))
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    return count
+
+
+def cached_values(session, ids: Iterable[int], period: Optional[str] = None,
+                  method: str = DEFAULT_METHOD) -> Dict[int, Valuation]:
+    """Cached values of the assets ``ids``, such as a list page, by asset id.
+
+    Call ``refresh`` first. Assets acquired after the period have no value.
+    """
+    period = period or current_period()
+    ids = list(ids)
+    values = {}
+    for start in range(0, len(ids), IDS_PER_QUERY):
+        stmt = select(asset_valuation.c.asset_id, *(asset_valuation.c[name] for name in VALUE_COLUMNS)).where(
+            asset_valuation.c.period == period, asset_valuation.c.method == method,
+            asset_valuation.c.asset_id.in_(ids[start:start + IDS_PER_QUERY]),
+        )
+        values.update((row[0], Valuation(*row)) for row in session.execute(stmt))
+    return values
+
+
+def round_amount(amount: Optional[float]) -> Optional[float]:
+    """``amount`` rounded to satang, as lists and exports show it."""
+    return None if amount is None else round(amount, 2)
+
+
+def amounts(valued: Optional[Valuation], names: Sequence[str]) -> tuple:
+    """The ``names`` fields of ``valued`` rounded to satang, or Nones for an unvalued asset."""
+    if valued is None:
+        return (None,) * len(names)
+    return tuple(round_amount(getattr(valued, name)) for name in names)
+
+
+def iter_values(session, period: str, method: str = DEFAULT_METHOD, criteria: Sequence[Any] = (),
+                chunk_size: int = 1000) -> Iterator[tuple]:
+    """Cached values joined with the asset code and name, in asset id order.
+
+    Call ``refresh`` first; the rows are those of its last run.
+    """
+    stmt = (
+        select(Asset.id, Asset.asset_code, Asset.sub_code, Asset.name, Asset.acquisition_date,
+               *(asset_valuation.c[name] for name in VALUE_COLUMNS))
+        .join(asset_valuation, asset_valuation.c.asset_id == Asset.id)
+        .where(asset_valuation.c.period == period, asset_valuation.c.method == method, *criteria)
+        .order_by(Asset.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    yield from session.execute(stmt)
+
+
+ROW_FIELDS = ('id', 'asset_code', 'sub_code', 'name', 'acquisition_date', *VALUE_COLUMNS)
+
+
+def category_totals(session, period: str, method: str = DEFAULT_METHOD) -> List[CategoryValue]:
+    """Cost, accumulated depreciation and book value per category from the cache."""
+    stmt = (
+        select(
+            asset_valuation.c.category,
+            func.count(),
+            func.total(asset_valuation.c.cost),
+            func.total(asset_valuation.c.accumulated),
+            func.total(asset_valuation.c.book_value),
+        )
+        .where(asset_valuation.c.period == period, asset_valuation.c.method == method)
+        .group_by(asset_valuation.c.category)
+        .order_by(asset_valuation.c.category)
+    )
+    return [CategoryValue(*row) for row in session.execute(stmt)]
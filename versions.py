@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional, Tuple
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, event, select, text
+from sqlalchemy.orm import Session
+
+# Tables whose writes bump a version number that caches can key on.
+TRACKED_TABLES = ('asset', 'inventory_item')
+
+metadata = MetaData()
+table_version = Table(
+    'table_version',
+    metadata,
+    Column('table_name', String(50), primary_key=True),
+    Column('version', Integer, nullable=False, default=0),
+    # Unix time of the last bump, for Last-Modified headers.
+    Column('updated', Float),
+)
+
+_BUMP = text(
+    'INSERT INTO table_version (table_name, version, updated) VALUES (:name, 1, :now) '
+    'ON CONFLICT(table_name) DO UPDATE SET version = version + 1, updated = :now'
+)
+
+_CREATE = text(
+    'CREATE TABLE IF NOT EXISTS table_version ('
+    'table_name VARCHAR(50) NOT NULL PRIMARY KEY, version INTEGER NOT NULL, updated FLOAT)'
+)
+
+
+class Stamp(NamedTuple):
+    """The versions of some tables and when the latest of them changed."""
+
+    versions: Tuple[int, ...]
+    updated: Optional[float]
+
+    @property
+    def last_modified(self) -> Optional[datetime]:
+        if self.updated is None:
+            return None
+        return datetime.fromtimestamp(self.updated, timezone.utc)
+
+
+def ensure_table(connection) -> None:
+    # A no-op once the table exists; kept in the caller's transaction so a
+    # rolled back write never leaves the table half created.
+    connection.execute(_CREATE)
+
+
+def bump(connection, *tables: str) -> None:
+    """Increment the version of ``tables`` inside the caller's transaction."""
+    if not tables:
+        return
+    ensure_table(connection)
+    now = time.time()
+    for name in tables:
+        connection.execute(_BUMP, {'name': name, 'now': now})
+
+
+def get_version(session, table: str) -> int:
+    ensure_table(session.connection())
+    version = session.execute(
+        select(table_version.c.version).where(table_version.c.table_name == table)
+    ).scalar()
+    return version or 0
+
+
+def get_stamp(session, *tables: str) -> Stamp:
+    """Read the versions of ``tables`` (in that order) with one query."""
+    ensure_table(session.connection())
+    rows = session.execute(
+        select(table_version.c.table_name, table_version.c.version, table_version.c.updated)
+        .where(table_version.c.table_name.in_(tables))
+    ).all()
+    found = {name: (version, updated) for name, version, updated in rows}
+    updated = [found[name][1] for name in tables if name in found and found[name][1] is not None]
+    return Stamp(
+        versions=tuple(found.get(name, (0, None))[0] for name in tables),
+        updated=max(updated) if updated else None,
+    )
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_changed_tables(session, flush_context, instances) -> None:
+    changed = set()
+    for obj in session.new:
+        changed.add(obj.__table__.name)
+    for obj in session.deleted:
+        changed.add(obj.__table__.name)
+    for obj in session.dirty:
+        if session.is_modified(obj):
+            changed.add(obj.__table__.name)
+    changed &= set(TRACKED_TABLES)
+    if changed:
+        bump(session.connection(), *sorted(changed))